@@ -0,0 +1,323 @@
+"""
+Batch solver for many small independent markets: the markets are stacked into one block-diagonal MatchingEngine whose
+preference lists never cross market boundaries, so a single run of vectorized proposal rounds solves all of them
+"""
+from itertools import chain
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from Deferred_Acceptance_Engine import MatchingEngine, PreferenceTable
+
+MarketSnapshot = Tuple[int, List[Tuple[Optional[int], Optional[int]]]]
+
+
+def stack_engine_arrays(engines: List[MatchingEngine]) -> Tuple[MatchingEngine, np.ndarray, np.ndarray]:
+    """
+    concatenate the arrays of every engine, their proposal ranks included, so no list is sorted or looked up again
+    :param engines: engines of independent markets
+    :return: (1) one engine holding every market, proposers and responders of market k shifted by the number of
+                 proposers and responders of markets before k, with no proposal made; its uuids are those of the
+                 engines and may repeat across markets
+             (2) first proposer index of each market in the stacked engine, followed by total number of proposers
+             (3) first responder index of each market in the stacked engine, followed by total number of responders
+    """
+    proposer_start = np.zeros(len(engines) + 1, dtype=np.int64)
+    np.cumsum([engine.count_proposer for engine in engines], out=proposer_start[1:])
+    responder_start = np.zeros(len(engines) + 1, dtype=np.int64)
+    np.cumsum([engine.count_responder for engine in engines], out=responder_start[1:])
+
+    def stack_tables(tables: List[PreferenceTable], index_shift: np.ndarray) -> PreferenceTable:
+        # row ends of each table move by the number of entries of the tables before it
+        entry_start = np.zeros(len(tables) + 1, dtype=np.int64)
+        np.cumsum([len(table.indices) for table in tables], out=entry_start[1:])
+        row_counts = [table.count_rows for table in tables]
+        offsets = np.zeros(sum(row_counts) + 1, dtype=np.int64)
+        offsets[1:] = np.concatenate([table.offsets[1:] for table in tables]) + np.repeat(entry_start[:-1], row_counts)
+        indices = np.concatenate([table.indices for table in tables]) + \
+            np.repeat(index_shift, np.diff(entry_start)).astype(np.int32)
+        return PreferenceTable(offsets, indices, np.concatenate([table.ranks for table in tables]))
+
+    # rows of every responder table are sorted by index already and stay so once shifted
+    stacked = MatchingEngine(np.concatenate([engine.proposer_uuids for engine in engines]),
+                             np.concatenate([engine.responder_uuids for engine in engines]),
+                             stack_tables([engine.proposer_preference for engine in engines], responder_start[:-1]),
+                             stack_tables([engine.responder_preference for engine in engines], proposer_start[:-1]),
+                             np.concatenate([engine.responder_capacity for engine in engines]),
+                             np.concatenate([engine.proposal_rank for engine in engines]))
+    return stacked, proposer_start, responder_start
+
+
+def stack_engines(engines: List[MatchingEngine]) -> Tuple[MatchingEngine, np.ndarray, np.ndarray]:
+    """
+    :param engines: engines of independent markets, possibly with proposals already made
+    :return: (1) one engine holding every market, proposers and responders of market k shifted by the number of
+                 proposers and responders of markets before k, with their matching state
+             (2) first proposer index of each market in the stacked engine, followed by total number of proposers
+             (3) first responder index of each market in the stacked engine, followed by total number of responders
+    """
+    stacked, proposer_start, responder_start = stack_engine_arrays(engines)
+    stacked.last_proposed_to = np.concatenate([engine.last_proposed_to for engine in engines])
+    stacked.proposer_matched_to = np.concatenate([
+        np.where(engine.proposer_matched_to != MatchingEngine.NO_MATCH, engine.proposer_matched_to + shift,
+                 MatchingEngine.NO_MATCH)
+        for engine, shift in zip(engines, responder_start[:-1].tolist())]).astype(np.int32)
+    stacked.unmatched_proposer = np.concatenate([engine.unmatched_proposer + shift
+                                                 for engine, shift in zip(engines, proposer_start[:-1].tolist())])
+    stacked.unmatched_proposer = stacked.unmatched_proposer.astype(np.int32)
+    stacked.refresh_responder_state()
+    stacked.proposal_count = sum(engine.proposal_count for engine in engines)
+    return stacked, proposer_start, responder_start
+
+
+def solve_engines(engines: List[MatchingEngine]) -> List[MarketSnapshot]:
+    """
+    run deferred acceptance to completion on every engine at once and copy the outcome back into each engine
+    :param engines: engines of independent markets
+    :return: per market, snapshot in the format of Market.market_snapshot_uuid()
+    """
+    if not engines:
+        return []
+    stacked, proposer_start, responder_start = stack_engines(engines)
+    last_proposed_before = stacked.last_proposed_to.copy()
+    stacked.run_rounds()
+
+    proposals_made = np.zeros(len(stacked.last_proposed_to) + 1, dtype=np.int64)
+    np.cumsum(stacked.last_proposed_to.astype(np.int64) - last_proposed_before, out=proposals_made[1:])
+    held_count = np.bincount(stacked.proposer_matched_to[stacked.proposer_matched_to != MatchingEngine.NO_MATCH],
+                             minlength=stacked.count_responder)
+    vacancies = stacked.responder_capacity - held_count
+
+    snapshots = []
+    for market, engine in enumerate(engines):
+        proposers = slice(proposer_start[market], proposer_start[market + 1])
+        responders = slice(responder_start[market], responder_start[market + 1])
+        matched_to = stacked.proposer_matched_to[proposers]
+        engine.last_proposed_to = stacked.last_proposed_to[proposers].copy()
+        engine.proposer_matched_to = np.where(matched_to != MatchingEngine.NO_MATCH,
+                                              matched_to - responder_start[market], MatchingEngine.NO_MATCH)
+        engine.proposer_matched_to = engine.proposer_matched_to.astype(np.int32)
+        engine.unmatched_proposer = np.empty(0, dtype=np.int32)
+        engine.proposal_count += int(proposals_made[proposer_start[market + 1]] - proposals_made[proposer_start[market]])
+        held = stacked.responder_matched_to[responders]
+        engine.responder_matched_to = np.where(held != MatchingEngine.NO_MATCH, held - proposer_start[market],
+                                               MatchingEngine.NO_MATCH).astype(np.int32)
+        engine.responder_matched_rank = stacked.responder_matched_rank[responders].copy()
+        engine.held_heaps = None
+
+        responder_uuids = engine.responder_uuids.tolist() + [None]
+        market_description = list(zip(engine.proposer_uuids.tolist(),
+                                      [responder_uuids[responder] for responder in engine.proposer_matched_to.tolist()]))
+        market_description.extend((None, responder_uuid) for responder_uuid, free in
+                                  zip(engine.responder_uuids.tolist(), vacancies[responders].tolist()) if free > 0)
+        snapshots.append((engine.proposal_count, market_description))
+    return snapshots
+
+
+def solve_preference_tables(proposer_preference: PreferenceTable, responder_preference: PreferenceTable,
+                            proposer_count: np.ndarray, responder_count: np.ndarray,
+                            responder_capacity: np.ndarray = None) -> List[MarketSnapshot]:
+    """
+    solve markets given as one ragged stack of preference lists, without any per market set up
+    :param proposer_preference: rows of proposers of every market, market after market; each row lists responder
+        row indices local to its market, from most to least preferred
+    :param responder_preference: rows of responders of every market, market after market; each row lists proposer
+        row indices local to its market, rank 0 most preferred
+    :param proposer_count: number of proposers of each market
+    :param responder_count: number of responders of each market
+    :param responder_capacity: number of seats of every responder, market after market; if None one seat each
+    :return: per market, snapshot in the format of Market.market_snapshot_uuid(), using the uuids
+        Market.from_preference_tables() would give
+    """
+    proposer_start = np.zeros(len(proposer_count) + 1, dtype=np.int64)
+    np.cumsum(proposer_count, out=proposer_start[1:])
+    responder_start = np.zeros(len(responder_count) + 1, dtype=np.int64)
+    np.cumsum(responder_count, out=responder_start[1:])
+    proposer_market = np.repeat(np.arange(len(proposer_count)), proposer_count)
+    responder_market = np.repeat(np.arange(len(responder_count)), responder_count)
+
+    proposer_shift = np.repeat(responder_start[:-1][proposer_market], proposer_preference.row_lengths())
+    responder_shift = np.repeat(proposer_start[:-1][responder_market], responder_preference.row_lengths())
+    stacked = MatchingEngine.from_preference_tables(
+        PreferenceTable(proposer_preference.offsets, proposer_preference.indices + proposer_shift,
+                        proposer_preference.ranks),
+        PreferenceTable(responder_preference.offsets, responder_preference.indices + responder_shift,
+                        responder_preference.ranks),
+        np.arange(proposer_start[-1]), np.arange(responder_start[-1]), responder_capacity)
+    stacked.run_rounds()
+
+    proposals_made = np.bincount(proposer_market, weights=stacked.last_proposed_to + 1,
+                                 minlength=len(proposer_count)).astype(np.int64)
+    # uuids local to each market, as given by register_proposer() and register_responder()
+    proposer_uuid = (np.arange(proposer_start[-1]) - proposer_start[:-1][proposer_market] + 1).tolist()
+    responder_uuid = (np.arange(responder_start[-1]) - responder_start[:-1][responder_market] + 1001).tolist()
+    return stacked_snapshots(stacked, proposer_start, responder_start, proposer_uuid, responder_uuid,
+                             proposals_made.tolist())
+
+
+def stacked_snapshots(stacked: MatchingEngine, proposer_start: np.ndarray, responder_start: np.ndarray,
+                      proposer_uuid: List[int], responder_uuid: List[int],
+                      proposal_counts: List[int]) -> List[MarketSnapshot]:
+    """
+    :param stacked: solved engine holding markets one after the other
+    :param proposer_start: first proposer index of each market, followed by total number of proposers
+    :param responder_start: first responder index of each market, followed by total number of responders
+    :param proposer_uuid: uuid of the proposer at each stacked index
+    :param responder_uuid: uuid of the responder at each stacked index
+    :param proposal_counts: number of proposals made in each market
+    :return: per market, snapshot in the format of Market.market_snapshot_uuid()
+    """
+    is_matched = stacked.proposer_matched_to != MatchingEngine.NO_MATCH
+    vacancies = stacked.responder_capacity - np.bincount(stacked.proposer_matched_to[is_matched],
+                                                         minlength=stacked.count_responder)
+    responder_uuid = responder_uuid + [None]
+    # pairs of every market built at once, each market then takes its slices
+    matched_pairs = list(zip(proposer_uuid, [responder_uuid[responder]
+                                             for responder in stacked.proposer_matched_to.tolist()]))
+    free_responders = np.flatnonzero(vacancies > 0)
+    free_start = np.searchsorted(free_responders, responder_start).tolist()
+    free_pairs = [(None, responder_uuid[responder]) for responder in free_responders.tolist()]
+    proposer_start = proposer_start.tolist()
+    return [(proposal_count, matched_pairs[proposer_start[market]:proposer_start[market + 1]] +
+             free_pairs[free_start[market]:free_start[market + 1]])
+            for market, proposal_count in enumerate(proposal_counts)]
+
+
+def index_within_market(row_market: np.ndarray, row_uuid: np.ndarray, entry_market: np.ndarray,
+                        entry_uuid: np.ndarray) -> np.ndarray:
+    """
+    :param row_market: market of each row of the stacked side
+    :param row_uuid: uuid of each row of the stacked side, uuids are unique within a market only
+    :param entry_market: market of each listed uuid
+    :param entry_uuid: listed uuids
+    :return: row of each listed uuid among the rows of its market, -1 if that market has no such row
+    """
+    if not len(row_uuid):
+        return np.full(len(entry_uuid), -1, dtype=np.int64)
+    uuids = np.concatenate((row_uuid, entry_uuid))
+    low, high = int(uuids.min()), int(uuids.max())
+    market_count = int(max(row_market[-1], entry_market.max(initial=0))) + 1
+    if (high - low + 1) * market_count <= 4 * len(uuids):
+        # uuids given by register_proposer() and register_responder() are consecutive: one slot per uuid and market
+        row_of_key = np.full((high - low + 1) * market_count, -1, dtype=np.int64)
+        row_of_key[row_market * (high - low + 1) + (row_uuid - low)] = np.arange(len(row_uuid))
+        return row_of_key[entry_market * (high - low + 1) + (entry_uuid - low)]
+    codes, inverse = np.unique(uuids, return_inverse=True)
+    keys = np.concatenate((row_market, entry_market)).astype(np.int64) * len(codes) + inverse.reshape(-1)
+    row_keys, entry_keys = keys[:len(row_uuid)], keys[len(row_uuid):]
+    row_order = np.argsort(row_keys, kind="stable")
+    position = np.minimum(np.searchsorted(row_keys[row_order], entry_keys), len(row_keys) - 1)
+    return np.where(row_keys[row_order[position]] == entry_keys, row_order[position], -1)
+
+
+def stack_markets(markets: list) -> Tuple[MatchingEngine, np.ndarray, np.ndarray]:
+    """
+    build one engine holding every engine-backed market out of the arrays of their engines, see
+    stack_engine_arrays(), and gather the matching state of every participant in one pass
+    :param markets: Markets built from preference tables, possibly with proposals already made
+    :return: (1) one engine holding every market one after the other, with their matching state; its uuids are those
+                 of the markets and may repeat across markets
+             (2) first proposer index of each market in the stacked engine, followed by total number of proposers
+             (3) first responder index of each market in the stacked engine, followed by total number of responders
+    """
+    stacked, proposer_start, responder_start = stack_engine_arrays([market.engine for market in markets])
+    proposers = [proposer for market in markets for proposer in market.proposer_uuid_dict.values()]
+    proposer_market = np.repeat(np.arange(len(markets)), np.diff(proposer_start))
+    responder_market = np.repeat(np.arange(len(markets)), np.diff(responder_start))
+
+    stacked.last_proposed_to = np.fromiter((proposer.last_proposed_to for proposer in proposers), dtype=np.int32,
+                                           count=len(proposers))
+    matched_proposers = np.flatnonzero(stacked.last_proposed_to >= 0)
+    matched_responders = [proposers[proposer].matched_to for proposer in matched_proposers.tolist()]
+    matched_proposers = matched_proposers[[uuid is not None for uuid in matched_responders]]
+    if len(matched_proposers):
+        stacked.proposer_matched_to[matched_proposers] = index_within_market(
+            responder_market, stacked.responder_uuids, proposer_market[matched_proposers],
+            np.array([uuid for uuid in matched_responders if uuid is not None], dtype=np.int64))
+    unmatched_count = [len(market.unmatched_proposer_uuid) for market in markets]
+    if sum(unmatched_count) == len(proposers):
+        # nobody matched yet, as in a market just built
+        stacked.unmatched_proposer = np.arange(len(proposers), dtype=np.int32)
+    else:
+        stacked.unmatched_proposer = index_within_market(
+            proposer_market, stacked.proposer_uuids, np.repeat(np.arange(len(markets)), unmatched_count),
+            np.fromiter(chain.from_iterable(market.unmatched_proposer_uuid for market in markets), dtype=np.int64,
+                        count=sum(unmatched_count))).astype(np.int32)
+    stacked.refresh_responder_state()
+    stacked.proposal_count = sum(market.proposal_count for market in markets)
+    return stacked, proposer_start, responder_start
+
+
+def solve_engine_markets(markets: list) -> List[MarketSnapshot]:
+    """
+    solve engine-backed markets in one stacked engine and write the outcome back into their participants in bulk
+    :param markets: Markets built from preference tables
+    :return: per market, snapshot in the format of Market.market_snapshot_uuid()
+    """
+    if not markets:
+        return []
+    stacked, proposer_start, responder_start = stack_markets(markets)
+    last_proposed_before = stacked.last_proposed_to.copy()
+    stacked.run_rounds()
+
+    proposals_made = np.zeros(stacked.count_proposer + 1, dtype=np.int64)
+    np.cumsum(stacked.last_proposed_to.astype(np.int64) - last_proposed_before, out=proposals_made[1:])
+    proposals_made = np.diff(proposals_made[proposer_start]).tolist()
+    proposer_uuid = stacked.proposer_uuids.tolist()
+    responder_uuid = stacked.responder_uuids.tolist()
+    proposers, responders = [], []
+    for market in markets:
+        proposers.extend(market.proposer_uuid_dict.values())
+        responders.extend(market.responder_uuid_dict.values())
+
+    # write back participant after participant, every market at once
+    for proposer, last_proposed_to, matched_to in zip(proposers, stacked.last_proposed_to.tolist(),
+                                                      stacked.proposer_matched_to.tolist()):
+        proposer.last_proposed_to = last_proposed_to
+        proposer.matched_to = responder_uuid[matched_to] if matched_to != MatchingEngine.NO_MATCH else None
+    # (rank, uuid) held by responders with several seats, sorted by responder then as tuples: sorted lists are heaps
+    is_held = stacked.proposer_matched_to != MatchingEngine.NO_MATCH
+    is_held[is_held] = stacked.responder_capacity[stacked.proposer_matched_to[is_held]] > 1
+    holders = np.flatnonzero(is_held)
+    holder_responders = stacked.proposer_matched_to[holders]
+    holder_ranks = stacked.responder_preference.lookup(holder_responders, holders, stacked.count_proposer,
+                                                       MatchingEngine.UNRANKED)
+    order = np.lexsort((stacked.proposer_uuids[holders], holder_ranks, holder_responders))
+    held = list(zip(holder_ranks[order].tolist(), stacked.proposer_uuids[holders[order]].tolist()))
+    held_start = np.searchsorted(holder_responders[order], np.arange(stacked.count_responder + 1)).tolist()
+    for index, (responder, matched_to) in enumerate(zip(responders, stacked.responder_matched_to.tolist())):
+        if responder.capacity > 1:
+            responder.held = held[held_start[index]:held_start[index + 1]]
+        else:
+            responder.matched_to = proposer_uuid[matched_to] if matched_to != MatchingEngine.NO_MATCH else None
+    for market, proposal_count in zip(markets, proposals_made):
+        market.unmatched_proposer_uuid = set()
+        market.proposal_count += proposal_count
+    return stacked_snapshots(stacked, proposer_start, responder_start, proposer_uuid, responder_uuid,
+                             [market.proposal_count for market in markets])
+
+
+def solve_markets(markets: list, markets_per_chunk: int = None) -> List[MarketSnapshot]:
+    """
+    solve many independent markets: those built from preference tables in one vectorized pass over their stacked
+    engine arrays, see solve_engine_markets(); the others by their own run_to_completion(), since gathering every list
+    entry of Proposer and Responder objects into arrays takes longer than the proposals of a sequential run
+    :param markets: Markets whose participants and preferences are registered
+    :param markets_per_chunk: stack at most this many markets at a time to bound memory; if None stack all of them
+    :return: per market, snapshot in the format of Market.market_snapshot_uuid(); the outcome is also written back
+        into each Market
+    """
+    markets_per_chunk = markets_per_chunk if markets_per_chunk else max(len(markets), 1)
+    snapshots = []
+    for chunk_start in range(0, len(markets), markets_per_chunk):
+        chunk = markets[chunk_start:chunk_start + markets_per_chunk]
+        is_engine_backed = [market.engine is not None for market in chunk]
+        engine_snapshots = iter(solve_engine_markets([market for market, has_engine in zip(chunk, is_engine_backed)
+                                                      if has_engine]))
+        for market, has_engine in zip(chunk, is_engine_backed):
+            if has_engine:
+                snapshots.append(next(engine_snapshots))
+            else:
+                market.run_to_completion()
+                snapshots.append(market.market_snapshot_uuid())
+    return snapshots
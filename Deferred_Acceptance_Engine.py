@@ -0,0 +1,885 @@
+"""
+Array-backed engine for the Gale-Shapley algorithm: Proposers and Responders are mapped to dense integer indices and
+preferences and matching state are kept in flat numpy arrays instead of one Python object per participant
+"""
+import copy
+from collections import Counter
+from collections.abc import Mapping, Sequence
+from heapq import heapify, heappush, heapreplace
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from Deferred_Acceptance_Entity import ValidationReport
+
+
+class PreferenceTable:
+    """
+    CSR-style preference lists: row i holds indices[offsets[i]:offsets[i + 1]], with ranks aligned to indices;
+    memory scales with total length of the lists rather than with the number of possible pairs
+    """
+    __slots__ = ("offsets", "indices", "ranks")
+
+    def __init__(self, offsets: np.ndarray, indices: np.ndarray, ranks: np.ndarray):
+        """
+        :param offsets: int64 array of count_rows + 1 row boundaries into indices and ranks
+        :param indices: int32 array of listed indices, row after row
+        :param ranks: int32 array of rank of each listed index within its row
+        """
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.ranks = np.asarray(ranks, dtype=np.int32)
+
+    @classmethod
+    def from_lengths(cls, lengths: np.ndarray, indices: np.ndarray, ranks: np.ndarray = None) -> 'PreferenceTable':
+        """
+        :param lengths: length of each row
+        :param indices: listed indices, row after row
+        :param ranks: rank of each listed index; if None the position within its row, 0 for most preferred
+        :return: PreferenceTable holding the rows
+        """
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        if ranks is None:
+            ranks = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], lengths)
+        return cls(offsets, indices, ranks)
+
+    @classmethod
+    def from_padded(cls, matrix: np.ndarray) -> 'PreferenceTable':
+        """
+        :param matrix: row i lists indices from most to least preferred, shorter rows padded at the end with -1
+        :return: PreferenceTable of the rows, ranks hold the position within each row
+        """
+        matrix = np.asarray(matrix, dtype=np.int32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(len(matrix), -1)
+        is_entry = matrix >= 0
+        _, positions = np.nonzero(is_entry)
+        return cls.from_lengths(np.count_nonzero(is_entry, axis=1), matrix[is_entry], positions)
+
+    @property
+    def count_rows(self) -> int:
+        return len(self.offsets) - 1
+
+    def row_lengths(self) -> np.ndarray:
+        """
+        :return: length of each row
+        """
+        return np.diff(self.offsets)
+
+    def row_of_entries(self) -> np.ndarray:
+        """
+        :return: row of each entry of indices
+        """
+        return np.repeat(np.arange(self.count_rows, dtype=np.int32), self.row_lengths())
+
+    def sorted_by_index(self) -> 'PreferenceTable':
+        """
+        :return: table with the same rows, each row sorted by index so ranks can be looked up by binary search
+        """
+        lowest, highest = int(self.indices.min(initial=0)), int(self.indices.max(initial=0))
+        entry_order = np.argsort(self.row_of_entries().astype(np.int64) * (highest - lowest + 1) +
+                                 (self.indices - lowest))
+        return PreferenceTable(self.offsets, self.indices[entry_order], self.ranks[entry_order])
+
+    def find(self, rows: np.ndarray, indices: np.ndarray, count_columns: int) -> np.ndarray:
+        """
+        vectorized entry lookup on a table sorted by index
+        :param rows: row of each query
+        :param indices: index looked up in the row of each query
+        :param count_columns: upper bound on listed indices
+        :return: position in indices and ranks of each queried (row, index) pair, -1 if index is not listed in row
+        """
+        entry_keys = self.row_of_entries().astype(np.int64) * count_columns + self.indices
+        query_keys = np.asarray(rows, dtype=np.int64) * count_columns + np.asarray(indices, dtype=np.int64)
+        if not len(entry_keys):
+            return np.full(len(query_keys), -1, dtype=np.int64)
+        # binary search with sorted queries walks entry_keys in order instead of jumping around memory
+        query_order = np.argsort(query_keys)
+        found_at = np.empty(len(query_keys), dtype=np.int64)
+        found_at[query_order] = np.searchsorted(entry_keys, query_keys[query_order])
+        np.minimum(found_at, len(entry_keys) - 1, out=found_at)
+        return np.where(entry_keys[found_at] == query_keys, found_at, -1)
+
+    def lookup(self, rows: np.ndarray, indices: np.ndarray, count_columns: int, default: int) -> np.ndarray:
+        """
+        vectorized rank lookup on a table sorted by index
+        :param rows: row of each query
+        :param indices: index looked up in the row of each query
+        :param count_columns: upper bound on listed indices
+        :param default: rank returned for indices not listed in their row
+        :return: rank of each queried (row, index) pair
+        """
+        found_at = self.find(rows, indices, count_columns)
+        if not len(self.ranks):
+            return np.full(len(found_at), default, dtype=np.int32)
+        return np.where(found_at >= 0, self.ranks[found_at], default).astype(np.int32)
+
+    def rank_of(self, row: int, index: int, default: Optional[int] = None) -> Optional[int]:
+        """
+        rank lookup of a single pair on a table sorted by index, binary search within the row
+        :param row: row looked up
+        :param index: index looked up within the row
+        :param default: returned if index is not listed in the row
+        :return: rank of index in row
+        """
+        start, stop = int(self.offsets[row]), int(self.offsets[row + 1])
+        found_at = start + int(np.searchsorted(self.indices[start:stop], index))
+        if found_at < stop and self.indices[found_at] == index:
+            return int(self.ranks[found_at])
+        return default
+
+    def first_invalid_row(self, count_columns: int) -> Optional[int]:
+        """
+        :param count_columns: valid indices are 0 to count_columns - 1
+        :return: first row listing an invalid index, None if every index is valid
+        """
+        is_unknown = (self.indices < 0) | (self.indices >= count_columns)
+        if not is_unknown.any():
+            return None
+        return int(np.searchsorted(self.offsets, np.argmax(is_unknown), side="right")) - 1
+
+    def with_rows(self, rows: Dict[int, Tuple[np.ndarray, np.ndarray]]) -> 'PreferenceTable':
+        """
+        :param rows: new indices and ranks of each replaced row
+        :return: table with those rows replaced and every other row as it is, in O(total length of the lists)
+        """
+        lengths = self.row_lengths()
+        for row, (indices, _) in rows.items():
+            lengths[row] = len(indices)
+        return PreferenceTable.from_lengths(
+            lengths, splice_rows(self.offsets, self.indices, {row: indices for row, (indices, _) in rows.items()}),
+            splice_rows(self.offsets, self.ranks, {row: ranks for row, (_, ranks) in rows.items()}))
+
+    def row_errors(self, count_columns: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param count_columns: valid indices are 0 to count_columns - 1
+        :return: per row, number of invalid indices and number of duplicated indices
+        """
+        rows = self.row_of_entries()
+        is_unknown = (self.indices < 0) | (self.indices >= count_columns)
+        unknown_per_row = np.bincount(rows[is_unknown], minlength=self.count_rows)
+        entry_keys = np.sort(rows[~is_unknown].astype(np.int64) * count_columns + self.indices[~is_unknown])
+        duplicate_keys = entry_keys[1:][entry_keys[1:] == entry_keys[:-1]]
+        duplicate_per_row = np.bincount(duplicate_keys // max(count_columns, 1), minlength=self.count_rows)
+        return unknown_per_row, duplicate_per_row
+
+
+def splice_rows(offsets: np.ndarray, values: np.ndarray, rows: Dict[int, np.ndarray]) -> np.ndarray:
+    """
+    :param offsets: row boundaries into values
+    :param values: array aligned with the entries of a PreferenceTable
+    :param rows: new values of each replaced row
+    :return: values with the entries of every replaced row swapped for its new ones
+    """
+    pieces, start = [], 0
+    for row in sorted(rows):
+        pieces.append(values[start:offsets[row]])
+        pieces.append(np.asarray(rows[row], dtype=values.dtype))
+        start = offsets[row + 1]
+    pieces.append(values[start:])
+    return np.concatenate(pieces)
+
+
+class MatchingEngine:
+    NO_MATCH = -1
+    UNRANKED = -1
+    SCALAR_ROUND_PROPOSERS = 256
+
+    def __init__(self, proposer_uuids: List[int], responder_uuids: List[int],
+                 proposer_preference: PreferenceTable, responder_preference: PreferenceTable,
+                 responder_capacity: np.ndarray = None, proposal_rank: np.ndarray = None):
+        """
+        :param proposer_uuids: uuid of the Proposer at each dense proposer index
+        :param responder_uuids: uuid of the Responder at each dense responder index
+        :param proposer_preference: row i lists responder indices in proposal order of proposer i
+        :param responder_preference: row j lists proposer indices ranked by responder j, with ranks following
+            Responder.preference_order: higher is better; unlisted proposers are never accepted
+        :param responder_capacity: number of proposers each responder can hold, at least one; if None every responder
+            holds one
+        :param proposal_rank: precomputed proposal_rank of a previous engine over the same preferences, e.g. read from
+            a market file; responder_preference must then already be sorted by index
+        """
+        self.proposer_uuids = np.asarray(proposer_uuids, dtype=np.int64)
+        self.responder_uuids = np.asarray(responder_uuids, dtype=np.int64)
+        self.proposer_index: Dict[int, int] = {uuid: index for index, uuid in enumerate(self.proposer_uuids.tolist())}
+        self.responder_index: Dict[int, int] = {uuid: index for index, uuid in enumerate(self.responder_uuids.tolist())}
+        self.count_proposer = len(self.proposer_uuids)
+        self.count_responder = len(self.responder_uuids)
+
+        self.proposer_preference = proposer_preference
+        self.responder_preference = responder_preference.sorted_by_index() if proposal_rank is None else \
+            responder_preference
+        self.proposal_offsets = proposer_preference.offsets
+        self.proposal_order = proposer_preference.indices
+        self.proposal_length = proposer_preference.row_lengths().astype(np.int32)
+        # rank the responder proposed to gives the proposer, aligned with proposal_order: O(1) per proposal
+        self.proposal_rank = np.asarray(proposal_rank, dtype=np.int32) if proposal_rank is not None else \
+            self.responder_preference.lookup(self.proposal_order, proposer_preference.row_of_entries(),
+                                             self.count_proposer, self.UNRANKED)
+
+        # position within responder_preference of the entry of each proposal, computed when ties are redrawn
+        self.proposal_responder_entry: Optional[np.ndarray] = None
+
+        self.responder_capacity = np.ones(self.count_responder, dtype=np.int32) if responder_capacity is None else \
+            np.asarray(responder_capacity, dtype=np.int32)
+        if np.any(self.responder_capacity < 1):
+            responder = int(np.argmax(self.responder_capacity < 1))
+            raise ValueError("Responder %d has capacity %d, every responder needs at least one seat" %
+                             (self.responder_uuids[responder], self.responder_capacity[responder]))
+        self.is_many_to_one = bool(np.any(self.responder_capacity > 1))
+        self.reset_state()
+
+    def reset_state(self) -> None:
+        """
+        forget every proposal made, as if the market had just been set up
+        """
+        # position in proposal order of the last proposal made by each proposer, -1 if none made yet
+        self.last_proposed_to = np.full(self.count_proposer, -1, dtype=np.int32)
+        self.proposer_matched_to = np.full(self.count_proposer, self.NO_MATCH, dtype=np.int32)
+        # responder_matched_to is only kept for responders with a single seat; responder_matched_rank is the rank a
+        # new proposal has to beat: rank of the worst held proposer once all seats are taken, UNRANKED before that
+        self.responder_matched_to = np.full(self.count_responder, self.NO_MATCH, dtype=np.int32)
+        self.responder_matched_rank = np.full(self.count_responder, self.UNRANKED, dtype=np.int32)
+        # min-heaps of (rank, proposer) per responder with several seats, rebuilt lazily by run()
+        self.held_heaps: Optional[Dict[int, List[Tuple[int, int]]]] = None
+        self.unmatched_proposer = np.arange(self.count_proposer, dtype=np.int32)
+        self.proposal_count = 0
+
+    @classmethod
+    def from_preference_matrix(cls, proposer_preference: np.ndarray, responder_preference: np.ndarray,
+                               proposer_uuids: List[int], responder_uuids: List[int],
+                               responder_capacity: np.ndarray = None) -> 'MatchingEngine':
+        """
+        :param proposer_preference: row i lists responder indices from most to least preferred by proposer i;
+            shorter lists are padded at the end with negative numbers
+        :param responder_preference: row j lists proposer indices from most to least preferred by responder j;
+            shorter lists are padded at the end with negative numbers
+        :param proposer_uuids: uuid of the Proposer at each row of proposer_preference
+        :param responder_uuids: uuid of the Responder at each row of responder_preference
+        :param responder_capacity: number of proposers each responder can hold; if None every responder holds one
+        :return: engine holding the market in array form, without any proposal made
+        """
+        return cls.from_preference_tables(PreferenceTable.from_padded(proposer_preference),
+                                          PreferenceTable.from_padded(responder_preference),
+                                          proposer_uuids, responder_uuids, responder_capacity)
+
+    @classmethod
+    def from_preference_tables(cls, proposer_preference: PreferenceTable, responder_preference: PreferenceTable,
+                               proposer_uuids: List[int], responder_uuids: List[int],
+                               responder_capacity: np.ndarray = None) -> 'MatchingEngine':
+        """
+        :param proposer_preference: row i lists responder indices from most to least preferred by proposer i
+        :param responder_preference: row j lists proposer indices ranked by responder j, ranks counted from 0 for
+            most preferred as PreferenceTable.from_padded() gives them; equal ranks stand for indifference
+        :param proposer_uuids: uuid of the Proposer at each row of proposer_preference
+        :param responder_uuids: uuid of the Responder at each row of responder_preference
+        :param responder_capacity: number of proposers each responder can hold; if None every responder holds one
+        :return: engine holding the market in array form, without any proposal made
+        """
+        lengths = responder_preference.row_lengths()
+        worst_rank = np.zeros(len(lengths), dtype=np.int32)
+        has_entries = lengths > 0
+        worst_rank[has_entries] = np.maximum.reduceat(responder_preference.ranks,
+                                                      responder_preference.offsets[:-1][has_entries])
+        # same convention as Responder.set_strict_preference: the least preferred proposer gets rank 0
+        responder_table = PreferenceTable(responder_preference.offsets, responder_preference.indices,
+                                          np.repeat(worst_rank, lengths) - responder_preference.ranks)
+        return cls(proposer_uuids, responder_uuids, proposer_preference, responder_table, responder_capacity)
+
+    @classmethod
+    def from_market(cls, market) -> 'MatchingEngine':
+        """
+        build engine arrays out of registered Proposers and Responders, including current matching state
+        :param market: Market whose participants and preferences are registered
+        :return: engine holding the same market in array form
+        """
+        proposer_uuids = list(market.proposer_uuid_dict)
+        responder_uuids = list(market.responder_uuid_dict)
+        proposer_index = {uuid: index for index, uuid in enumerate(proposer_uuids)}
+        responder_index = {uuid: index for index, uuid in enumerate(responder_uuids)}
+
+        proposal_order = []
+        for proposer in market.proposer_uuid_dict.values():
+            try:
+                proposal_order.extend([responder_index[uuid] for uuid in proposer.proposal_order])
+            except KeyError:
+                raise ValueError("Proposer %s is incorrect" % proposer.name)
+        proposal_length = [len(proposer.proposal_order) for proposer in market.proposer_uuid_dict.values()]
+        proposer_table = PreferenceTable.from_lengths(proposal_length, proposal_order)
+        if any(proposer.proposal_tier is not None for proposer in market.proposer_uuid_dict.values()):
+            # weak preferences: ranks of the proposer table hold the tie tier rather than the position
+            proposer_table.ranks = np.fromiter(
+                (tier for proposer in market.proposer_uuid_dict.values()
+                 for tier in (proposer.proposal_tier if proposer.proposal_tier is not None
+                              else range(len(proposer.proposal_order)))),
+                dtype=np.int32, count=sum(proposal_length))
+
+        ranked_proposers, ranks = [], []
+        for responder in market.responder_uuid_dict.values():
+            try:
+                ranked_proposers.extend([proposer_index[uuid] for uuid in responder.preference_order])
+            except KeyError:
+                raise ValueError("Responder %s is incorrect" % responder.name)
+            ranks.extend(responder.preference_order.values())
+        responder_table = PreferenceTable.from_lengths(
+            [len(responder.preference_order) for responder in market.responder_uuid_dict.values()],
+            ranked_proposers, ranks)
+
+        responder_capacity = [responder.capacity for responder in market.responder_uuid_dict.values()]
+        engine = cls(proposer_uuids, responder_uuids, proposer_table, responder_table, responder_capacity)
+        engine.import_state(market)
+        return engine
+
+    def with_preference_ranks(self, proposal_permutation: np.ndarray, responder_ranks: np.ndarray) -> 'MatchingEngine':
+        """
+        engine over the same participants and preference lists with ties broken differently, sharing every array
+        that does not change and skipping the sort of preference tables done by the constructor
+        :param proposal_permutation: permutation of proposal entries that keeps every entry within its proposer's row
+        :param responder_ranks: new ranks aligned with responder_preference.indices
+        :return: new engine without any proposal made
+        """
+        if self.proposal_responder_entry is None:
+            self.proposal_responder_entry = self.responder_preference.find(
+                self.proposal_order, self.proposer_preference.row_of_entries(), self.count_proposer)
+        engine = copy.copy(self)
+        engine.proposer_preference = PreferenceTable(self.proposal_offsets, self.proposal_order[proposal_permutation],
+                                                     self.proposer_preference.ranks[proposal_permutation])
+        engine.proposal_order = engine.proposer_preference.indices
+        engine.proposal_responder_entry = self.proposal_responder_entry[proposal_permutation]
+        engine.responder_preference = PreferenceTable(self.responder_preference.offsets,
+                                                      self.responder_preference.indices, responder_ranks)
+        engine.proposal_rank = np.where(engine.proposal_responder_entry >= 0,
+                                        responder_ranks[engine.proposal_responder_entry], self.UNRANKED).astype(np.int32)
+        engine.reset_state()
+        return engine
+
+    def replace_preferences(self, proposal_orders: Dict[int, List[int]],
+                            responder_orders: Dict[int, List[int]]) -> None:
+        """
+        replace strict preference lists in place, in O(total length of the lists) with every other list kept as it is;
+        views handed out by the engine read the new lists. The matching state is left to import_state() to refresh
+        :param proposal_orders: responder indices in proposal order, per proposer index
+        :param responder_orders: proposer indices from most to least preferred, per responder index
+        """
+        if responder_orders:
+            rows = dict()
+            for responder, order in responder_orders.items():
+                order = np.asarray(order, dtype=np.int32)
+                by_index = np.argsort(order, kind="stable")
+                # least preferred gets rank 0, as in from_preference_tables()
+                rows[responder] = order[by_index], (len(order) - 1 - by_index).astype(np.int32)
+            self.responder_preference = self.responder_preference.with_rows(rows)
+            # proposals to those responders are ranked anew, the array may be a read-only memory map
+            changed = np.flatnonzero(np.isin(self.proposal_order, list(responder_orders)))
+            self.proposal_rank = self.proposal_rank.copy()
+            self.proposal_rank[changed] = self.responder_preference.lookup(
+                self.proposal_order[changed], self.proposer_preference.row_of_entries()[changed], self.count_proposer,
+                self.UNRANKED)
+        if proposal_orders:
+            orders = {proposer: np.asarray(order, dtype=np.int32) for proposer, order in proposal_orders.items()}
+            new_ranks = np.split(self.responder_preference.lookup(
+                np.concatenate(list(orders.values())),
+                np.repeat(list(orders), [len(order) for order in orders.values()]), self.count_proposer,
+                self.UNRANKED), np.cumsum([len(order) for order in orders.values()])[:-1])
+            self.proposal_rank = splice_rows(self.proposal_offsets, self.proposal_rank, dict(zip(orders, new_ranks)))
+            self.proposer_preference = self.proposer_preference.with_rows(
+                {proposer: (order, np.arange(len(order), dtype=np.int32)) for proposer, order in orders.items()})
+            self.proposal_offsets = self.proposer_preference.offsets
+            self.proposal_order = self.proposer_preference.indices
+            self.proposal_length = self.proposer_preference.row_lengths().astype(np.int32)
+        self.proposal_responder_entry = None
+        self.held_heaps = None
+
+    def remove_proposer(self, proposer: int) -> None:
+        """
+        drop a proposer and every list entry naming him in O(total length of the lists); proposers after him move
+        down one index, so views of them have to follow. The matching state is reset, for import_state() to refresh
+        :param proposer: dense index of the proposer
+        """
+        start, stop = int(self.proposal_offsets[proposer]), int(self.proposal_offsets[proposer + 1])
+        offsets = np.delete(self.proposal_offsets, proposer + 1)
+        offsets[proposer + 1:] -= stop - start
+        self.proposer_preference = PreferenceTable(offsets, np.delete(self.proposal_order, slice(start, stop)),
+                                                   np.delete(self.proposer_preference.ranks, slice(start, stop)))
+        self.proposal_rank = np.delete(self.proposal_rank, slice(start, stop))
+        self.proposal_offsets = self.proposer_preference.offsets
+        self.proposal_order = self.proposer_preference.indices
+        self.proposal_length = np.delete(self.proposal_length, proposer)
+
+        table = self.responder_preference
+        is_kept = table.indices != proposer
+        indices = table.indices[is_kept]
+        indices[indices > proposer] -= 1
+        # rows stay sorted by index, the ranks left keep their order
+        self.responder_preference = PreferenceTable.from_lengths(
+            np.bincount(table.row_of_entries()[is_kept], minlength=self.count_responder), indices, table.ranks[is_kept])
+
+        self.proposer_uuids = np.delete(self.proposer_uuids, proposer)
+        self.proposer_index = {uuid: index for index, uuid in enumerate(self.proposer_uuids.tolist())}
+        self.count_proposer -= 1
+        self.proposal_responder_entry = None
+        self.reset_state()
+
+    def proposal_order_view(self, proposer: int) -> 'ProposalOrderView':
+        """
+        :param proposer: dense proposer index
+        :return: read-only list of responder uuids in proposal order of the proposer, backed by engine arrays
+        """
+        return ProposalOrderView(self, proposer)
+
+    def preference_order_view(self, responder: int) -> 'PreferenceOrderView':
+        """
+        :param responder: dense responder index
+        :return: read-only dict from proposer uuid to preference rank of the responder, backed by engine arrays
+        """
+        return PreferenceOrderView(self, responder)
+
+    def import_state(self, market) -> None:
+        """
+        copy matching state (proposals made so far, current matches, unmatched proposers) out of market objects
+        :param market: Market with the same participants as the engine
+        """
+        self.proposer_matched_to[:] = self.NO_MATCH
+        for index, proposer in enumerate(market.proposer_uuid_dict.values()):
+            self.last_proposed_to[index] = proposer.last_proposed_to
+            if proposer.matched_to is not None:
+                self.proposer_matched_to[index] = self.responder_index[proposer.matched_to]
+        self.refresh_responder_state()
+        self.unmatched_proposer = np.fromiter((self.proposer_index[uuid] for uuid in market.unmatched_proposer_uuid),
+                                              dtype=np.int32, count=len(market.unmatched_proposer_uuid))
+        self.proposal_count = market.proposal_count
+
+    def write_back(self, market) -> None:
+        """
+        copy matching state held by the engine back into market objects, so snapshots of the market reflect the engine
+        :param market: Market the engine was built from
+        """
+        responder_uuids = self.responder_uuids.tolist()
+        proposer_uuids = self.proposer_uuids.tolist()
+        for proposer, last_proposed_to, matched_to in zip(market.proposer_uuid_dict.values(),
+                                                          self.last_proposed_to.tolist(),
+                                                          self.proposer_matched_to.tolist()):
+            proposer.last_proposed_to = last_proposed_to
+            proposer.matched_to = responder_uuids[matched_to] if matched_to != self.NO_MATCH else None
+        held = self.held_by_responder() if self.is_many_to_one else {}
+        for index, (responder, matched_to) in enumerate(zip(market.responder_uuid_dict.values(),
+                                                            self.responder_matched_to.tolist())):
+            if responder.capacity > 1:
+                responder.held = [(rank, proposer_uuids[proposer]) for rank, proposer in held.get(index, [])]
+                heapify(responder.held)
+            else:
+                responder.matched_to = proposer_uuids[matched_to] if matched_to != self.NO_MATCH else None
+        market.unmatched_proposer_uuid = set(self.proposer_uuids[self.unmatched_proposer].tolist())
+        market.proposal_count = self.proposal_count
+
+    def refresh_responder_state(self) -> None:
+        """
+        recompute responder side of the matching (single seat holders and rank to beat) out of proposer_matched_to
+        """
+        self.held_heaps = None
+        self.responder_matched_to[:] = self.NO_MATCH
+        self.responder_matched_rank[:] = self.UNRANKED
+        is_matched = self.proposer_matched_to != self.NO_MATCH
+        if not is_matched.any():
+            return
+        proposers = np.flatnonzero(is_matched)
+        responders = self.proposer_matched_to[is_matched]
+        ranks = self.responder_preference.lookup(responders, proposers, self.count_proposer, self.UNRANKED)
+
+        is_single_seat = self.responder_capacity[responders] == 1
+        self.responder_matched_to[responders[is_single_seat]] = proposers[is_single_seat]
+        held_count = np.bincount(responders, minlength=self.count_responder)
+        worst_held_rank = np.full(self.count_responder, np.iinfo(np.int32).max, dtype=np.int32)
+        np.minimum.at(worst_held_rank, responders, ranks)
+        self.responder_matched_rank[:] = np.where(held_count >= self.responder_capacity, worst_held_rank, self.UNRANKED)
+
+    def held_by_responder(self) -> Dict[int, List[Tuple[int, int]]]:
+        """
+        :return: for each responder with several seats holding anyone, min-heap of (rank, proposer index) it holds
+        """
+        held: Dict[int, List[Tuple[int, int]]] = {}
+        is_held = self.proposer_matched_to != self.NO_MATCH
+        is_held[is_held] = self.responder_capacity[self.proposer_matched_to[is_held]] > 1
+        proposers = np.flatnonzero(is_held)
+        responders = self.proposer_matched_to[proposers]
+        ranks = self.responder_preference.lookup(responders, proposers, self.count_proposer, self.UNRANKED)
+        for responder, rank, proposer in zip(responders.tolist(), ranks.tolist(), proposers.tolist()):
+            held.setdefault(responder, []).append((rank, proposer))
+        for heap in held.values():
+            heapify(heap)
+        return held
+
+    def validation_report(self, proposer_name: Callable[[int], str] = None,
+                          responder_name: Callable[[int], str] = None) -> ValidationReport:
+        """
+        vectorized check of the array form of the market: every preference list entry must be a valid index of the
+        other side and no index may appear twice in the same list; messages are worded as Market.validation_report()
+        words them for the same problems
+        :param proposer_name: name of the proposer with a given uuid; if None "Proposer proposer_uuid"
+        :param responder_name: name of the responder with a given uuid; if None "Responder responder_uuid"
+        :return: ValidationReport, see Market.validation_report()
+        """
+        proposer_name = proposer_name or "Proposer {}".format
+        responder_name = responder_name or "Responder {}".format
+        error_counts = Counter()
+        error_messages = []
+        bool_market = len(self.proposer_index) == self.count_proposer and \
+            len(self.responder_index) == self.count_responder
+        if not bool_market:
+            error_counts["duplicate uuid"] += 1
+            error_messages.append("Duplicate uuid among Proposers or Responders")
+
+        def describe_rows(kind: str, uuids: np.ndarray, name: Callable[[int], str], unknown_per_row: np.ndarray,
+                          duplicate_per_row: np.ndarray, listed: str, order: str) -> None:
+            for row in np.flatnonzero(unknown_per_row | duplicate_per_row).tolist():
+                problems = []
+                if unknown_per_row[row]:
+                    problems.append("%d unknown %s uuid(s) in %s" % (unknown_per_row[row], listed, order))
+                if duplicate_per_row[row]:
+                    problems.append("%d duplicate %s uuid(s) in %s" % (duplicate_per_row[row], listed, order))
+                error_messages.append("%s %s is incorrect: %s" % (kind, name(int(uuids[row])), ", ".join(problems)))
+
+        unknown_per_proposer, duplicate_per_proposer = self.proposer_preference.row_errors(self.count_responder)
+        error_counts["unknown responder in proposal order"] = int(np.count_nonzero(unknown_per_proposer))
+        error_counts["duplicate responder in proposal order"] = int(np.count_nonzero(duplicate_per_proposer))
+        describe_rows("Proposer", self.proposer_uuids, proposer_name, unknown_per_proposer, duplicate_per_proposer,
+                      "responder", "proposal order")
+        bool_proposer = not (error_counts["unknown responder in proposal order"] or
+                             error_counts["duplicate responder in proposal order"])
+
+        unknown_per_responder, duplicate_per_responder = self.responder_preference.row_errors(self.count_proposer)
+        error_counts["unknown proposer in preference order"] = int(np.count_nonzero(unknown_per_responder))
+        error_counts["duplicate proposer in preference order"] = int(np.count_nonzero(duplicate_per_responder))
+        describe_rows("Responder", self.responder_uuids, responder_name, unknown_per_responder,
+                      duplicate_per_responder, "proposer", "preference order")
+        bool_responder = not (error_counts["unknown proposer in preference order"] or
+                              error_counts["duplicate proposer in preference order"])
+
+        return ValidationReport(bool_market, bool_proposer, bool_responder, +error_counts, error_messages)
+
+    def blocking_pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        pairs blocking the current matching: the proposer strictly prefers the responder to their match (or lists it
+        while unmatched) and the responder ranks the proposer strictly above the rank it has to beat; with weak
+        preferences proposer ranks hold tie tiers, so only strict improvements on both sides count
+        :return: dense proposer indices and dense responder indices of every blocking pair
+        """
+        proposer_ranks = self.proposer_preference.ranks
+        rows = self.proposer_preference.row_of_entries()
+        # rank of their current match in each proposer's own list; unmatched proposers would take anyone listed
+        is_match = self.proposal_order == self.proposer_matched_to[rows]
+        matched_rank = np.full(self.count_proposer, np.iinfo(np.int32).max, dtype=np.int32)
+        matched_rank[rows[is_match]] = proposer_ranks[is_match]
+
+        # only entries ranked above the current match need the responder side checked
+        above_match = np.flatnonzero(proposer_ranks < matched_rank[rows])
+        responders = self.proposal_order[above_match]
+        is_blocking = self.proposal_rank[above_match] > self.responder_matched_rank[responders]
+        return rows[above_match[is_blocking]], responders[is_blocking]
+
+    def has_more_proposal(self) -> bool:
+        """
+        :return: whether more proposer wants to makes offer
+        """
+        return len(self.unmatched_proposer) > 0
+
+    def run(self, on_round: Callable[[int, int, int, int], None] = None) -> int:
+        """
+        run deferred acceptance until every unmatched proposer has exhausted his proposal order; a rejected proposer
+        immediately makes his next proposal, so each displacement chain is followed to its end
+        :param on_round: called once at the end, the run counting as a single round, see run_rounds()
+        :return: number of proposals made in this run
+        """
+        proposal_offsets = self.proposal_offsets.tolist()
+        proposal_length = self.proposal_length.tolist()
+        proposal_order = self.proposal_order
+        proposal_rank = self.proposal_rank
+        last_proposed_to = self.last_proposed_to
+        proposer_matched_to = self.proposer_matched_to
+        responder_matched_to = self.responder_matched_to
+        responder_matched_rank = self.responder_matched_rank
+        responder_capacity = self.responder_capacity.tolist()
+        if self.held_heaps is None:
+            self.held_heaps = self.held_by_responder() if self.is_many_to_one else {}
+        held_heaps = self.held_heaps
+
+        proposals_before = self.proposal_count
+        proposal_count = proposals_before
+        matched_before = np.count_nonzero(proposer_matched_to != self.NO_MATCH) if on_round is not None else 0
+        for proposer in self.unmatched_proposer.tolist():
+            while proposer != self.NO_MATCH:
+                next_position = int(last_proposed_to[proposer]) + 1
+                if next_position >= proposal_length[proposer]:
+                    break
+                last_proposed_to[proposer] = next_position
+                entry = proposal_offsets[proposer] + next_position
+                responder = int(proposal_order[entry])
+                rank = proposal_rank[entry]
+                proposal_count += 1
+
+                if rank > responder_matched_rank[responder]:
+                    capacity = responder_capacity[responder]
+                    if capacity == 1:
+                        held = int(responder_matched_to[responder])
+                        responder_matched_to[responder] = proposer
+                        responder_matched_rank[responder] = rank
+                    else:
+                        heap = held_heaps.setdefault(responder, [])
+                        if len(heap) < capacity:
+                            heappush(heap, (int(rank), proposer))
+                            held = self.NO_MATCH
+                        else:
+                            _, held = heapreplace(heap, (int(rank), proposer))
+                        if len(heap) == capacity:
+                            responder_matched_rank[responder] = heap[0][0]
+                    proposer_matched_to[proposer] = responder
+                    if held != self.NO_MATCH:
+                        proposer_matched_to[held] = self.NO_MATCH
+                    proposer = held
+
+        self.unmatched_proposer = np.empty(0, dtype=np.int32)
+        self.proposal_count = proposal_count
+        if on_round is not None:
+            # every proposal either takes a free seat or ends with a proposer rejected
+            newly_matched = np.count_nonzero(proposer_matched_to != self.NO_MATCH) - matched_before
+            on_round(proposal_count - proposals_before, proposal_count - proposals_before - int(newly_matched), 0,
+                     proposal_count)
+        return proposal_count - proposals_before
+
+    def one_round_simultaneous_proposals(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        all currently unmatched proposers simultaneously make their next proposal; proposals are grouped by the
+        responder proposed to and each responder keeps the best of its offers and its current holder, ties going to
+        the current holder and then to the earlier proposal
+        :return: three aligned arrays describing proposals in current round, (proposer index, responder index,
+                index of the proposer rejected as outcome of the proposal or NO_MATCH)
+        """
+        proposers = self.unmatched_proposer
+        next_position = self.last_proposed_to[proposers] + 1
+        wants_to_propose = next_position < self.proposal_length[proposers]
+        proposers = proposers[wants_to_propose]
+        next_position = next_position[wants_to_propose]
+        self.last_proposed_to[proposers] = next_position
+        entries = self.proposal_offsets[proposers] + next_position
+        responders = self.proposal_order[entries]
+        ranks = self.proposal_rank[entries]
+        self.proposal_count += len(proposers)
+        if self.is_many_to_one:
+            return self.resolve_round_many_to_one(proposers, responders, ranks)
+
+        proposed_to = np.unique(responders)
+        proposed_to = proposed_to[self.responder_matched_to[proposed_to] != self.NO_MATCH]
+        candidate_responder = np.concatenate((responders, proposed_to))
+        candidate_rank = np.concatenate((ranks, self.responder_matched_rank[proposed_to]))
+        is_new_proposal = np.concatenate((np.ones(len(proposers), dtype=bool), np.zeros(len(proposed_to), dtype=bool)))
+
+        # sort by responder, then best rank first, then current holder first; lexsort is stable
+        candidate_order = np.lexsort((is_new_proposal, -candidate_rank, candidate_responder))
+        sorted_responder = candidate_responder[candidate_order]
+        is_best = np.ones(len(candidate_order), dtype=bool)
+        is_best[1:] = sorted_responder[1:] != sorted_responder[:-1]
+        best = candidate_order[is_best]
+        best = best[is_new_proposal[best] & (candidate_rank[best] > self.UNRANKED)]
+
+        accepted_proposer = proposers[best]
+        accepted_responder = responders[best]
+        displaced = self.responder_matched_to[accepted_responder]
+        self.proposer_matched_to[displaced[displaced != self.NO_MATCH]] = self.NO_MATCH
+        self.proposer_matched_to[accepted_proposer] = accepted_responder
+        self.responder_matched_to[accepted_responder] = accepted_proposer
+        self.responder_matched_rank[accepted_responder] = ranks[best]
+
+        rejected = proposers.copy()
+        rejected[best] = displaced
+        self.unmatched_proposer = np.concatenate((np.delete(proposers, best), displaced[displaced != self.NO_MATCH]))
+        return proposers, responders, rejected
+
+    def resolve_round_many_to_one(self, proposers: np.ndarray, responders: np.ndarray,
+                                  ranks: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        apply one round of proposals when responders may hold several proposers: each responder keeps the best
+        capacity candidates out of its offers and its current holders, ties going to current holders
+        :param proposers: proposer index of each proposal in the round
+        :param responders: responder index of each proposal in the round
+        :param ranks: rank each responder gives the proposer of each proposal
+        :return: see one_round_simultaneous_proposals()
+        """
+        is_proposed_to = np.zeros(self.count_responder, dtype=bool)
+        is_proposed_to[responders] = True
+        is_holder = self.proposer_matched_to != self.NO_MATCH
+        is_holder[is_holder] = is_proposed_to[self.proposer_matched_to[is_holder]]
+        holders = np.flatnonzero(is_holder).astype(np.int32)
+        holder_responder = self.proposer_matched_to[holders]
+        holder_rank = self.proposal_rank[self.proposal_offsets[holders] + self.last_proposed_to[holders]]
+
+        candidate_proposer = np.concatenate((proposers, holders))
+        candidate_responder = np.concatenate((responders, holder_responder))
+        candidate_rank = np.concatenate((ranks, holder_rank))
+        is_new_proposal = np.concatenate((np.ones(len(proposers), dtype=bool), np.zeros(len(holders), dtype=bool)))
+
+        # sort by responder, then best rank first, then current holder first; keep the first capacity of each group
+        candidate_order = np.lexsort((is_new_proposal, -candidate_rank, candidate_responder))
+        sorted_responder = candidate_responder[candidate_order]
+        group_start = np.ones(len(candidate_order), dtype=bool)
+        group_start[1:] = sorted_responder[1:] != sorted_responder[:-1]
+        position = np.arange(len(candidate_order))
+        position_in_group = position - np.maximum.accumulate(np.where(group_start, position, 0))
+        is_kept = np.zeros(len(candidate_order), dtype=bool)
+        is_kept[candidate_order] = (position_in_group < self.responder_capacity[sorted_responder]) & \
+                                   (candidate_rank[candidate_order] > self.UNRANKED)
+
+        is_accepted = is_kept[:len(proposers)]
+        displaced = holders[~is_kept[len(proposers):]]
+        displaced_responder = holder_responder[~is_kept[len(proposers):]]
+        self.proposer_matched_to[displaced] = self.NO_MATCH
+        self.proposer_matched_to[proposers[is_accepted]] = responders[is_accepted]
+
+        kept_responder = candidate_responder[is_kept]
+        is_single_seat = self.responder_capacity[kept_responder] == 1
+        self.responder_matched_to[kept_responder[is_single_seat]] = candidate_proposer[is_kept][is_single_seat]
+        held_count = np.bincount(kept_responder, minlength=self.count_responder)
+        worst_held_rank = np.full(self.count_responder, np.iinfo(np.int32).max, dtype=np.int32)
+        np.minimum.at(worst_held_rank, kept_responder, candidate_rank[is_kept])
+        self.responder_matched_rank[is_proposed_to] = np.where(
+            held_count >= self.responder_capacity, worst_held_rank, self.UNRANKED)[is_proposed_to]
+        self.held_heaps = None
+
+        # pair each displaced holder with an accepted proposal to the same responder
+        rejected = proposers.copy()
+        accepted = np.flatnonzero(is_accepted)
+        accepted = accepted[np.argsort(responders[accepted], kind="stable")]
+        rejected[accepted] = self.NO_MATCH
+        displaced_order = np.argsort(displaced_responder, kind="stable")
+        accepted_key = self.group_keys(responders[accepted])
+        displaced_key = self.group_keys(displaced_responder[displaced_order])
+        rejected[accepted[np.searchsorted(accepted_key, displaced_key)]] = displaced[displaced_order]
+
+        self.unmatched_proposer = np.concatenate((proposers[~is_accepted], displaced))
+        return proposers, responders, rejected
+
+    def group_keys(self, sorted_groups: np.ndarray) -> np.ndarray:
+        """
+        :param sorted_groups: sorted group labels
+        :return: increasing keys identifying each element by its group and its position within the group; a group
+            never holds more than count_proposer elements, so keys of different arrays of groups are comparable
+        """
+        position = np.arange(len(sorted_groups))
+        group_start = np.ones(len(sorted_groups), dtype=bool)
+        group_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+        position_in_group = position - np.maximum.accumulate(np.where(group_start, position, 0))
+        return sorted_groups.astype(np.int64) * (self.count_proposer + 1) + position_in_group
+
+    def run_rounds(self, on_round: Callable[[int, int, int, int], None] = None,
+                   scalar_below: int = None) -> int:
+        """
+        run deferred acceptance as a sequence of simultaneous proposal rounds; once fewer than scalar_below proposers
+        are left to propose, the fixed cost of a vectorized round outweighs its proposals and the long tail of small
+        rounds is left to run()
+        :param on_round: called after every round with counts read off the arrays: number of proposals made in the
+            round, number of them ending with a proposer rejected, number of proposers making a proposal next round
+            and number of proposals made so far; the tail left to run() is reported as one last round
+        :param scalar_below: number of proposers below which the remaining proposals are made by run(); if None
+            SCALAR_ROUND_PROPOSERS, 0 keeps making rounds until the end
+        :return: number of proposals made in this run
+        """
+        scalar_below = self.SCALAR_ROUND_PROPOSERS if scalar_below is None else scalar_below
+        proposals_before = self.proposal_count
+        while self.has_more_proposal():
+            if len(self.unmatched_proposer) < scalar_below:
+                self.run(on_round)
+                break
+            _, _, rejected = self.one_round_simultaneous_proposals()
+            if on_round is not None:
+                on_round(len(rejected), int(np.count_nonzero(rejected != self.NO_MATCH)), len(self.unmatched_proposer),
+                         self.proposal_count)
+        return self.proposal_count - proposals_before
+
+
+class ProposalOrderView(Sequence):
+    """
+    stands in for Proposer.proposal_order without copying a row of the engine into a Python list
+    """
+    __slots__ = ("engine", "proposer")
+
+    def __init__(self, engine: MatchingEngine, proposer: int):
+        self.engine = engine
+        self.proposer = proposer
+
+    def __len__(self) -> int:
+        return int(self.engine.proposal_length[self.proposer])
+
+    def row(self) -> np.ndarray:
+        """
+        :return: responder indices of the proposal order, a view of the engine array
+        """
+        start = self.engine.proposal_offsets[self.proposer]
+        return self.engine.proposal_order[start:start + self.engine.proposal_length[self.proposer]]
+
+    def __contains__(self, responder_uuid) -> bool:
+        responder = self.engine.responder_index.get(responder_uuid)
+        return responder is not None and bool(np.any(self.row() == responder))
+
+    def index(self, responder_uuid: int, start: int = 0, stop: int = None) -> int:
+        start, stop, _ = slice(start, stop).indices(len(self))
+        responder = self.engine.responder_index.get(responder_uuid)
+        if responder is not None:
+            found_at = np.flatnonzero(self.row()[start:stop] == responder)
+            if len(found_at):
+                return start + int(found_at[0])
+        raise ValueError("%s is not in proposal order" % responder_uuid)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return self.engine.responder_uuids[self.row()[position]].tolist()
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("proposal order index out of range")
+        entry = self.engine.proposal_offsets[self.proposer] + position
+        return int(self.engine.responder_uuids[self.engine.proposal_order[entry]])
+
+
+class PreferenceOrderView(Mapping):
+    """
+    stands in for Responder.preference_order without building a dict per Responder
+    """
+    __slots__ = ("engine", "responder")
+
+    def __init__(self, engine: MatchingEngine, responder: int):
+        self.engine = engine
+        self.responder = responder
+
+    def __len__(self) -> int:
+        offsets = self.engine.responder_preference.offsets
+        return int(offsets[self.responder + 1] - offsets[self.responder])
+
+    def __iter__(self) -> Iterator[int]:
+        table = self.engine.responder_preference
+        ranked = table.indices[table.offsets[self.responder]:table.offsets[self.responder + 1]]
+        return iter(self.engine.proposer_uuids[ranked].tolist())
+
+    def values(self) -> List[int]:
+        """
+        :return: ranks in iteration order, copied out of the engine array at once rather than looked up one by one
+        """
+        table = self.engine.responder_preference
+        return table.ranks[table.offsets[self.responder]:table.offsets[self.responder + 1]].tolist()
+
+    def items(self) -> List[Tuple[int, int]]:
+        """
+        :return: (proposer uuid, rank) pairs in iteration order, copied out of the engine arrays at once
+        """
+        return list(zip(self, self.values()))
+
+    def __getitem__(self, proposer_uuid: int) -> int:
+        rank = self.get(proposer_uuid)
+        if rank is None:
+            raise KeyError(proposer_uuid)
+        return rank
+
+    def get(self, proposer_uuid: int, default: Optional[int] = None) -> Optional[int]:
+        proposer = self.engine.proposer_index.get(proposer_uuid)
+        if proposer is None:
+            return default
+        return self.engine.responder_preference.rank_of(self.responder, proposer, default)
@@ -3,10 +3,12 @@ Gale-Shapley algorithm for Stable Matching Problem (SMP) between two equally siz
 Responders
 """
 from collections import namedtuple
-from typing import List, Optional
+from heapq import heapify, heappush, heapreplace
+from typing import List, Optional, Tuple
 
 
 class Proposer:
+    __slots__ = ("uuid", "name", "matched_to", "proposal_order", "proposal_tier", "last_proposed_to")
     NO_NEXT_PROPOSAL = -1
 
     def __init__(self, uuid: int, name: str = None):
@@ -18,6 +20,7 @@ class Proposer:
         self.name = name if name else "Proposer " + str(uuid)
         self.matched_to = None
         self.proposal_order = []
+        self.proposal_tier = None
         self.last_proposed_to = -1
 
     def set_strict_preference(self, strict_preference: List[int]) -> None:
@@ -25,6 +28,7 @@ class Proposer:
         :param strict_preference: proposer make offer from most preferred to least preferred
         """
         self.proposal_order = strict_preference
+        self.proposal_tier = None
 
     def set_weak_preference(self, weak_preference: List[List[int]]) -> bool:
         """
@@ -32,6 +36,8 @@ class Proposer:
         :return: return True if proposer shows strict preference among Responders
         """
         self.proposal_order = [responder_uuid for rank_set in weak_preference for responder_uuid in rank_set]
+        # index of the rank_set of each entry of proposal_order, kept so ties can be redrawn later
+        self.proposal_tier = [tier for tier, rank_set in enumerate(weak_preference) for _ in rank_set]
         return all(len(rank_set) <= 1 for rank_set in weak_preference)
 
     def validate(self, proposer_list: List[int], responder_list: List[int]) -> bool:
@@ -61,6 +67,9 @@ class Proposer:
 
 
 class Responder:
+    __slots__ = ("uuid", "name", "matched_to", "preference_order")
+    capacity = 1
+
     def __init__(self, uuid: int, name: str = None):
         """
         :param uuid: universally unique identifier for responder
@@ -110,5 +119,126 @@ class Responder:
         else:
             return proposer_uuid
 
+    def held_proposers(self) -> List[int]:
+        """
+        :return: proposer_uuid of Proposers currently held by the responder
+        """
+        return [] if self.matched_to is None else [self.matched_to]
+
+    def vacancies(self) -> int:
+        """
+        :return: number of seats of the responder not currently held by any Proposer
+        """
+        return 0 if self.matched_to is not None else 1
+
+    def clear_held(self) -> None:
+        """
+        release every held Proposer
+        """
+        self.matched_to = None
+
+    def hold(self, proposer_uuids: List[int]) -> None:
+        """
+        :param proposer_uuids: proposer_uuid of the Proposers to hold instead of the current ones, at most capacity
+        """
+        self.matched_to = proposer_uuids[0] if proposer_uuids else None
+
+    def release(self, proposer_uuid: int) -> None:
+        """
+        :param proposer_uuid: proposer_uuid of a held Proposer to release, nothing happens if he is not held
+        """
+        if self.matched_to == proposer_uuid:
+            self.matched_to = None
+
+    def release_unacceptable(self) -> List[int]:
+        """
+        release held Proposers missing from the preference order, e.g. after it was replaced
+        :return: proposer_uuid of the released Proposers
+        """
+        if self.matched_to is None or self.matched_to in self.preference_order:
+            return []
+        released, self.matched_to = self.matched_to, None
+        return [released]
+
+
+class CapacityResponder(Responder):
+    """
+    Responder with several seats, e.g. a school or a hospital in the college admissions problem; held proposers are
+    kept in a min-heap keyed by preference rank so the worst held proposer is evicted in O(log capacity).
+    matched_to stays None, held proposers are listed by held_proposers()
+    """
+    __slots__ = ("capacity", "held")
+
+    def __init__(self, uuid: int, name: str = None, capacity: int = 1):
+        """
+        :param uuid: universally unique identifier for responder
+        :param name: name of current responder; if None name set to "Responder proposer_uuid"
+        :param capacity: number of Proposers the responder can hold at the same time
+        """
+        super().__init__(uuid, name)
+        self.capacity = capacity
+        self.held: List[Tuple[int, int]] = []
+
+    def respond_to_proposal(self, proposer_uuid: int) -> Optional[int]:
+        """
+        accepts the proposal if a seat is free or if it is a strict improvement over the worst held proposer
+        :param proposer_uuid: proposer_uuid for current proposer
+        :return: rejection sent to either new proposer or evicted worst held proposer, None if a free seat was taken
+        """
+        preference_rank = self.preference_order.get(proposer_uuid, -1)
+        if preference_rank < 0:
+            return proposer_uuid
+        if len(self.held) < self.capacity:
+            heappush(self.held, (preference_rank, proposer_uuid))
+            return None
+        if self.held[0][0] < preference_rank:
+            _, evicted_uuid = heapreplace(self.held, (preference_rank, proposer_uuid))
+            return evicted_uuid
+        return proposer_uuid
+
+    def held_proposers(self) -> List[int]:
+        """
+        :return: proposer_uuid of Proposers currently held by the responder
+        """
+        return [proposer_uuid for _, proposer_uuid in self.held]
+
+    def vacancies(self) -> int:
+        """
+        :return: number of seats of the responder not currently held by any Proposer
+        """
+        return self.capacity - len(self.held)
+
+    def clear_held(self) -> None:
+        """
+        release every held Proposer
+        """
+        self.held = []
+
+    def hold(self, proposer_uuids: List[int]) -> None:
+        """
+        :param proposer_uuids: proposer_uuid of the Proposers to hold instead of the current ones, at most capacity
+        """
+        self.held = [(self.preference_order.get(uuid, -1), uuid) for uuid in proposer_uuids]
+        heapify(self.held)
+
+    def release(self, proposer_uuid: int) -> None:
+        """
+        :param proposer_uuid: proposer_uuid of a held Proposer to release, nothing happens if he is not held
+        """
+        self.held = [(preference_rank, uuid) for preference_rank, uuid in self.held if uuid != proposer_uuid]
+        heapify(self.held)
+
+    def release_unacceptable(self) -> List[int]:
+        """
+        release held Proposers missing from the preference order and re-key the others by their current rank, e.g.
+        after the preference order was replaced
+        :return: proposer_uuid of the released Proposers
+        """
+        released = [uuid for _, uuid in self.held if uuid not in self.preference_order]
+        self.held = [(self.preference_order[uuid], uuid) for _, uuid in self.held if uuid in self.preference_order]
+        heapify(self.held)
+        return released
+
 
 Proposal = namedtuple("Proposal", "proposal_id proposer_uuid responder_uuid rejected_uuid")
+ValidationReport = namedtuple("ValidationReport", "bool_market bool_proposer bool_responder error_counts error_messages")
@@ -0,0 +1,148 @@
+"""
+Binary market file: preference arrays of a MatchingEngine laid out so that opening the file memory-maps them instead of
+reading them, letting several processes share one page-cached copy.
+
+Layout, all integers little-endian:
+
+    offset 0   8 bytes   magic b"DAMARKET"
+    offset 8   uint32    format version, currently 1
+    offset 12  uint32    length H of the header in bytes
+    offset 16  H bytes   UTF-8 JSON header:
+                             "count_proposer", "count_responder": number of participants on each side
+                             "proposer_names", "responder_names": list of names in dense index order, or null for
+                                 the default "Proposer uuid" and "Responder uuid" names
+                             "arrays": for each array below, {"dtype": numpy dtype string, "offset": byte offset from
+                                 the start of the data section, "length": number of items}
+    data section, starting at 16 + H rounded up to a multiple of ALIGNMENT; every array starts at a multiple of
+    ALIGNMENT bytes:
+        proposer_uuids      int64   uuid of each dense proposer index
+        responder_uuids     int64   uuid of each dense responder index
+        proposer_offsets    int64   CSR row boundaries of proposer lists, count_proposer + 1 items
+        proposer_indices    int32   responder indices, row after row, from most to least preferred
+        proposer_ranks      int32   position of each entry in its row, or tie tier for weak preferences
+        responder_offsets   int64   CSR row boundaries of responder lists, count_responder + 1 items
+        responder_indices   int32   proposer indices, each row sorted by increasing index
+        responder_ranks     int32   rank of each entry as in Responder.preference_order, higher is better
+        proposal_rank       int32   responder rank of each proposer list entry, -1 if unranked
+        responder_capacity  int32   number of seats of each responder
+
+Dense preference matrices are converted to the CSR layout when written. The file holds preferences only, no matching
+state.
+"""
+import json
+import mmap
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from Deferred_Acceptance_Engine import MatchingEngine, PreferenceTable
+
+MAGIC = b"DAMARKET"
+VERSION = 1
+ALIGNMENT = 64
+ARRAYS = (("proposer_uuids", np.int64), ("responder_uuids", np.int64),
+          ("proposer_offsets", np.int64), ("proposer_indices", np.int32), ("proposer_ranks", np.int32),
+          ("responder_offsets", np.int64), ("responder_indices", np.int32), ("responder_ranks", np.int32),
+          ("proposal_rank", np.int32), ("responder_capacity", np.int32))
+
+
+def aligned(position: int) -> int:
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+def save_engine(path: str, engine: MatchingEngine, proposer_names: List[str] = None,
+                responder_names: List[str] = None) -> None:
+    """
+    :param path: market file to write
+    :param engine: engine holding the preferences to save
+    :param proposer_names: names of proposers in dense index order; if None the default names are kept
+    :param responder_names: names of responders in dense index order; if None the default names are kept
+    """
+    arrays = {
+        "proposer_uuids": engine.proposer_uuids,
+        "responder_uuids": engine.responder_uuids,
+        "proposer_offsets": engine.proposer_preference.offsets,
+        "proposer_indices": engine.proposer_preference.indices,
+        "proposer_ranks": engine.proposer_preference.ranks,
+        "responder_offsets": engine.responder_preference.offsets,
+        "responder_indices": engine.responder_preference.indices,
+        "responder_ranks": engine.responder_preference.ranks,
+        "proposal_rank": engine.proposal_rank,
+        "responder_capacity": engine.responder_capacity,
+    }
+    layout, position = {}, 0
+    for name, dtype in ARRAYS:
+        arrays[name] = np.ascontiguousarray(arrays[name], dtype=np.dtype(dtype).newbyteorder("<"))
+        layout[name] = {"dtype": arrays[name].dtype.str, "offset": position, "length": len(arrays[name])}
+        position = aligned(position + arrays[name].nbytes)
+    header = json.dumps({
+        "count_proposer": engine.count_proposer,
+        "count_responder": engine.count_responder,
+        "proposer_names": proposer_names,
+        "responder_names": responder_names,
+        "arrays": layout,
+    }).encode("utf-8")
+
+    data_start = aligned(16 + len(header))
+    with open(path, "wb") as market_file:
+        market_file.write(MAGIC)
+        market_file.write(np.array([VERSION, len(header)], dtype="<u4").tobytes())
+        market_file.write(header)
+        for name, _ in ARRAYS:
+            market_file.write(b"\0" * (data_start + layout[name]["offset"] - market_file.tell()))
+            market_file.write(arrays[name].tobytes())
+
+
+def save_market(path: str, market) -> None:
+    """
+    :param path: market file to write
+    :param market: Market whose participants and preferences are registered; its names are saved along
+    """
+    engine = market.build_engine()
+    proposer_names = [proposer.name for proposer in market.proposer_uuid_dict.values()]
+    responder_names = [responder.name for responder in market.responder_uuid_dict.values()]
+    is_default = all(name == "Proposer " + str(uuid) for name, uuid in zip(proposer_names, market.proposer_uuid_dict)) \
+        and all(name == "Responder " + str(uuid) for name, uuid in zip(responder_names, market.responder_uuid_dict))
+    save_engine(path, engine, None if is_default else proposer_names, None if is_default else responder_names)
+
+
+def save_preference_tables(path: str, proposer_preference: PreferenceTable, responder_preference: PreferenceTable,
+                           proposer_names: List[str] = None, responder_names: List[str] = None,
+                           responder_capacity: np.ndarray = None) -> None:
+    """
+    write a market given as preference tables, in the conventions of Market.from_preference_tables(); use
+    PreferenceTable.from_padded() for dense matrices
+    """
+    count_proposer, count_responder = proposer_preference.count_rows, responder_preference.count_rows
+    engine = MatchingEngine.from_preference_tables(proposer_preference, responder_preference,
+                                                   list(range(1, count_proposer + 1)),
+                                                   list(range(1001, 1001 + count_responder)), responder_capacity)
+    save_engine(path, engine, proposer_names, responder_names)
+
+
+def open_engine(path: str) -> Tuple[MatchingEngine, Optional[List[str]], Optional[List[str]]]:
+    """
+    :param path: market file written by save_engine(), save_market() or save_preference_tables()
+    :return: engine whose preference arrays are read-only views into the memory-mapped file, without any proposal
+        made, and names of proposers and responders as saved
+    """
+    with open(path, "rb") as market_file:
+        mapped = mmap.mmap(market_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:8] != MAGIC:
+        raise ValueError("%s is not a market file" % path)
+    version, header_length = np.frombuffer(mapped, dtype="<u4", count=2, offset=8).tolist()
+    if version != VERSION:
+        raise ValueError("Unsupported market file version %d" % version)
+    header = json.loads(bytes(mapped[16:16 + header_length]).decode("utf-8"))
+    data_start = aligned(16 + header_length)
+    arrays = {name: np.frombuffer(mapped, dtype=np.dtype(layout["dtype"]), count=layout["length"],
+                                  offset=data_start + layout["offset"])
+              for name, layout in header["arrays"].items()}
+
+    engine = MatchingEngine(arrays["proposer_uuids"], arrays["responder_uuids"],
+                            PreferenceTable(arrays["proposer_offsets"], arrays["proposer_indices"],
+                                            arrays["proposer_ranks"]),
+                            PreferenceTable(arrays["responder_offsets"], arrays["responder_indices"],
+                                            arrays["responder_ranks"]),
+                            arrays["responder_capacity"], proposal_rank=arrays["proposal_rank"])
+    return engine, header["proposer_names"], header["responder_names"]
@@ -0,0 +1,223 @@
+"""
+Opt-in instrumentation of the proposal loop of a Market: the market reports every proposal and every round of
+simultaneous proposals to a MarketInstrumentation, which forwards them to pluggable sinks; MatchingEngine runs report
+counts read off their arrays instead of individual proposals
+"""
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from Deferred_Acceptance_Entity import Proposal
+
+
+class InstrumentationSink:
+    """
+    receiver of instrumentation events; subclasses override the events they need, the others are never called
+    """
+
+    def on_proposal(self, proposal: Proposal, unmatched_count: int) -> None:
+        """
+        :param proposal: proposal just made, as returned by Market.proposer_make_move()
+        :param unmatched_count: number of unmatched proposers still wanting to propose after the proposal; during a
+            round of simultaneous proposals, number of proposers rejected so far in the round
+        """
+
+    def on_round(self, round_index: int, proposals: List[Proposal], seconds: float, unmatched_count: int) -> None:
+        """
+        :param round_index: index of the round of simultaneous proposals, starting from 0
+        :param proposals: proposals made in the round, as returned by Market.one_round_simultaneous_proposals()
+        :param seconds: wall time of the round
+        :param unmatched_count: number of proposers making a proposal next round
+        """
+
+    def on_engine_round(self, round_index: int, round_proposal_count: int, rejection_count: int, seconds: float,
+                        unmatched_count: int, proposal_count: int) -> None:
+        """
+        :param round_index: index of the round, counted together with rounds reported by on_round()
+        :param round_proposal_count: number of proposals made in the round of MatchingEngine.run_rounds(), or in the
+            whole of MatchingEngine.run() which has no rounds
+        :param rejection_count: number of those proposals that ended with a proposer rejected
+        :param seconds: wall time of the round
+        :param unmatched_count: number of proposers making a proposal next round
+        :param proposal_count: number of proposals made in the market so far, as Market.proposal_count counts them
+        """
+
+    def on_finish(self, proposal_count: int, unmatched_count: int) -> None:
+        """
+        :param proposal_count: number of proposals made when Market.run_to_completion() returned
+        :param unmatched_count: number of proposers left unmatched
+        """
+
+
+class CallbackSink(InstrumentationSink):
+    """
+    sink forwarding events to plain functions
+    """
+
+    def __init__(self, on_proposal: Callable[[Proposal, int], None] = None,
+                 on_round: Callable[[int, List[Proposal], float, int], None] = None,
+                 on_finish: Callable[[int, int], None] = None,
+                 on_engine_round: Callable[[int, int, int, float, int, int], None] = None):
+        """
+        :param on_proposal: called as InstrumentationSink.on_proposal(); if None the event is not listened to
+        :param on_round: called as InstrumentationSink.on_round(); if None the event is not listened to
+        :param on_finish: called as InstrumentationSink.on_finish(); if None the event is not listened to
+        :param on_engine_round: called as InstrumentationSink.on_engine_round(); if None the event is not listened to
+        """
+        if on_proposal is not None:
+            self.on_proposal = on_proposal
+        if on_round is not None:
+            self.on_round = on_round
+        if on_engine_round is not None:
+            self.on_engine_round = on_engine_round
+        if on_finish is not None:
+            self.on_finish = on_finish
+
+
+class ProposalStatistics(InstrumentationSink):
+    """
+    counters of a run: rejections, proposals per proposer, displacement-chain lengths, round timings and size of the
+    unmatched set over time
+    """
+
+    def __init__(self, sample_interval: int = 1000):
+        """
+        :param sample_interval: record the size of the unmatched set every sample_interval proposals, besides after
+            every round
+        """
+        self.sample_interval = sample_interval
+        self.proposal_count = 0
+        self.rejection_count = 0
+        self.proposals_by_proposer = Counter()
+        # a displacement chain starts with an unmatched proposer and follows whoever gets rejected, the proposer
+        # himself or the holder he displaced, until a free seat is taken or the rejected proposer runs out of
+        # proposals; chains are followed per proposer, so proposals of chains interleaving in any order are told apart
+        self.chain_lengths: List[int] = []
+        # length so far of the chain each rejected proposer is carrying on
+        self.open_chains: Dict[int, int] = dict()
+        self.round_seconds: List[float] = []
+        self.unmatched_history: List[Tuple[int, int]] = []
+
+    def on_proposal(self, proposal: Proposal, unmatched_count: int) -> None:
+        proposal_id, proposer_uuid, _, rejected_uuid = proposal
+        self.proposal_count += 1
+        self.proposals_by_proposer[proposer_uuid] += 1
+        chain_length = self.open_chains.pop(proposer_uuid, 0) + 1
+        if rejected_uuid is None:
+            self.chain_lengths.append(chain_length)
+        else:
+            self.rejection_count += 1
+            self.open_chains[rejected_uuid] = chain_length
+        if proposal_id % self.sample_interval == 0:
+            self.unmatched_history.append((proposal_id, unmatched_count))
+
+    def on_round(self, round_index: int, proposals: List[Proposal], seconds: float, unmatched_count: int) -> None:
+        self.round_seconds.append(seconds)
+        if proposals:
+            self.unmatched_history.append((proposals[-1].proposal_id, unmatched_count))
+
+    def on_engine_round(self, round_index: int, round_proposal_count: int, rejection_count: int, seconds: float,
+                        unmatched_count: int, proposal_count: int) -> None:
+        # engine runs report no individual proposals: per proposer counts and chains only cover the other events
+        self.proposal_count += round_proposal_count
+        self.rejection_count += rejection_count
+        self.round_seconds.append(seconds)
+        self.unmatched_history.append((proposal_count, unmatched_count))
+
+    def on_finish(self, proposal_count: int, unmatched_count: int) -> None:
+        # chains of proposers who ran out of proposals end without a seat
+        self.chain_lengths.extend(self.open_chains.values())
+        self.open_chains.clear()
+        self.unmatched_history.append((proposal_count, unmatched_count))
+
+    def top_proposers(self, count: int = 10) -> List[Tuple[int, int]]:
+        """
+        :param count: number of proposers to list
+        :return: (proposer_uuid, number of proposals) of the proposers who made the most proposals
+        """
+        return self.proposals_by_proposer.most_common(count)
+
+    def longest_chain(self) -> int:
+        """
+        :return: length of the longest displacement chain, 0 if no proposal was made
+        """
+        return max(self.chain_lengths, default=0)
+
+    def summary(self) -> dict:
+        """
+        :return: counters as a JSON serializable dict
+        """
+        return {
+            "proposal_count": self.proposal_count,
+            "rejection_count": self.rejection_count,
+            "round_count": len(self.round_seconds),
+            "round_seconds": self.round_seconds,
+            "chain_count": len(self.chain_lengths),
+            "longest_chain": self.longest_chain(),
+            "unmatched_history": self.unmatched_history,
+            "top_proposers": self.top_proposers(),
+        }
+
+
+class MarketInstrumentation:
+    """
+    dispatcher of the events of one Market to its sinks; only events overridden by at least one sink are dispatched
+    """
+
+    def __init__(self, sinks: List[InstrumentationSink] = None):
+        """
+        :param sinks: receivers of events; if None a single ProposalStatistics
+        """
+        self.sinks = sinks if sinks is not None else [ProposalStatistics()]
+        self.round_index = 0
+
+        def listens(sink: InstrumentationSink, event: str) -> bool:
+            return getattr(getattr(sink, event), "__func__", None) is not getattr(InstrumentationSink, event)
+
+        def listeners(event: str) -> list:
+            return [getattr(sink, event) for sink in self.sinks if listens(sink, event)]
+
+        self.proposal_listeners = listeners("on_proposal")
+        self.round_listeners = listeners("on_round")
+        self.engine_round_listeners = listeners("on_engine_round")
+        self.finish_listeners = listeners("on_finish")
+        # sinks that only learn of proposals one at a time, e.g. a ProposalLog, see nothing of a run on engine arrays
+        self.proposal_only_sinks = [sink for sink in self.sinks
+                                    if listens(sink, "on_proposal") and not listens(sink, "on_engine_round")]
+        self.round_start: Optional[float] = None
+
+    def statistics(self) -> Optional[ProposalStatistics]:
+        """
+        :return: first ProposalStatistics sink, None if there is none
+        """
+        return next((sink for sink in self.sinks if isinstance(sink, ProposalStatistics)), None)
+
+    def record_proposal(self, proposal: Proposal, unmatched_count: int) -> None:
+        for listener in self.proposal_listeners:
+            listener(proposal, unmatched_count)
+
+    def start_round(self) -> None:
+        self.round_start = time.perf_counter()
+
+    def record_round(self, proposals: List[Proposal], unmatched_count: int) -> None:
+        seconds = time.perf_counter() - self.round_start
+        for listener in self.round_listeners:
+            listener(self.round_index, proposals, seconds, unmatched_count)
+        self.round_index += 1
+
+    def record_engine_round(self, round_proposal_count: int, rejection_count: int, unmatched_count: int,
+                            proposal_count: int) -> None:
+        """
+        callback of MatchingEngine.run_rounds() and MatchingEngine.run(); each round is timed from the end of the
+        previous one, the first from start_round()
+        """
+        round_end = time.perf_counter()
+        for listener in self.engine_round_listeners:
+            listener(self.round_index, round_proposal_count, rejection_count, round_end - self.round_start,
+                     unmatched_count, proposal_count)
+        self.round_index += 1
+        self.round_start = round_end
+
+    def record_finish(self, proposal_count: int, unmatched_count: int) -> None:
+        for listener in self.finish_listeners:
+            listener(proposal_count, unmatched_count)
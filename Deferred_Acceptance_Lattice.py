@@ -0,0 +1,427 @@
+"""
+Lattice of all stable matchings of a one-to-one market with strict (possibly truncated) preferences, following
+Gusfield and Irving: every stable matching is obtained from the proposer-optimal one by eliminating a set of rotations
+closed under the rotation poset, so matchings are enumerated and optimized over the poset rather than listed
+"""
+import copy
+from collections import deque, namedtuple
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from Deferred_Acceptance_Engine import MatchingEngine, PreferenceTable
+
+# pairs (proposer_index, responder_index) held before elimination; proposer i then moves to the responder of pair i + 1
+Rotation = namedtuple("Rotation", "pairs weight")
+MatchingOutcome = namedtuple("MatchingOutcome", "matching value rotations")
+
+
+def row_positions(table: PreferenceTable, higher_is_better: bool) -> np.ndarray:
+    """
+    :param table: preference table
+    :param higher_is_better: whether ranks count up (Responder.preference_order) or down (proposal positions)
+    :return: position of each entry within its row once the row is sorted from most to least preferred, 0 for best
+    :raise ValueError: if a row ranks two entries equally
+    """
+    rows = table.row_of_entries()
+    entry_order = np.lexsort((-table.ranks if higher_is_better else table.ranks, rows))
+    sorted_ranks, sorted_rows = table.ranks[entry_order], rows[entry_order]
+    if np.any((sorted_rows[1:] == sorted_rows[:-1]) & (sorted_ranks[1:] == sorted_ranks[:-1])):
+        raise ValueError("Stable matching lattice requires strict preferences")
+    positions = np.empty(len(entry_order), dtype=np.int64)
+    positions[entry_order] = np.arange(len(entry_order)) - table.offsets[sorted_rows]
+    return positions
+
+
+def minimum_cut_source_side(count_nodes: int, arcs: List[Tuple[int, int, float]], source: int, sink: int) -> Set[int]:
+    """
+    Dinic's maximum flow
+    :param count_nodes: number of nodes, numbered from 0
+    :param arcs: (tail, head, capacity) of every arc
+    :param source: source node
+    :param sink: sink node
+    :return: nodes reachable from source in the residual graph of a maximum flow, i.e. source side of a minimum cut
+    """
+    heads, capacities, adjacent = [], [], [[] for _ in range(count_nodes)]
+    for tail, head, capacity in arcs:
+        adjacent[tail].append(len(heads))
+        heads.append(head)
+        capacities.append(capacity)
+        adjacent[head].append(len(heads))
+        heads.append(tail)
+        capacities.append(0)
+
+    def levels_from_source() -> List[int]:
+        level = [-1] * count_nodes
+        level[source] = 0
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for arc in adjacent[node]:
+                if capacities[arc] > 0 and level[heads[arc]] < 0:
+                    level[heads[arc]] = level[node] + 1
+                    queue.append(heads[arc])
+        return level
+
+    level = levels_from_source()
+    while level[sink] >= 0:
+        next_arc = [0] * count_nodes
+        while True:
+            # one augmenting path of the level graph, found iteratively
+            path, node = [], source
+            while node != sink:
+                while next_arc[node] < len(adjacent[node]):
+                    arc = adjacent[node][next_arc[node]]
+                    if capacities[arc] > 0 and level[heads[arc]] == level[node] + 1:
+                        break
+                    next_arc[node] += 1
+                if next_arc[node] == len(adjacent[node]):
+                    if not path:
+                        break
+                    level[node] = -1
+                    node = heads[path.pop() ^ 1]
+                    next_arc[node] += 1
+                    continue
+                path.append(adjacent[node][next_arc[node]])
+                node = heads[path[-1]]
+            if node != sink:
+                break
+            bottleneck = min(capacities[arc] for arc in path)
+            for arc in path:
+                capacities[arc] -= bottleneck
+                capacities[arc ^ 1] += bottleneck
+        level = levels_from_source()
+    return {node for node, node_level in enumerate(level) if node_level >= 0}
+
+
+class StableMatchingLattice:
+    """
+    rotations of a one-to-one market with strict preferences and the poset they form; a set of rotations closed under
+    predecessors stands for the stable matching obtained by eliminating them from the proposer-optimal matching
+    """
+
+    def __init__(self, market):
+        """
+        :param market: Market whose participants and strict preferences are registered, every responder with one seat
+        """
+        engine = copy.copy(market.build_engine())
+        if engine.is_many_to_one:
+            raise ValueError("Stable matching lattice requires responders with a single seat")
+        self.proposer_uuids = engine.proposer_uuids.tolist()
+        self.responder_uuids = engine.responder_uuids.tolist()
+        count_proposer, count_responder = engine.count_proposer, engine.count_responder
+
+        proposer_position = row_positions(engine.proposer_preference, higher_is_better=False)
+        responder_position = row_positions(engine.responder_preference, higher_is_better=True)
+
+        engine.reset_state()
+        engine.run()
+        self.proposer_optimal = engine.proposer_matched_to.copy()
+        # responder-optimal matching: responders propose down their lists, proposers rank them by list position
+        responder_rows = engine.responder_preference.row_of_entries()
+        swapped_order = np.lexsort((responder_position, responder_rows))
+        swapped = MatchingEngine.from_preference_tables(
+            PreferenceTable(engine.responder_preference.offsets, engine.responder_preference.indices[swapped_order],
+                            responder_position[swapped_order]),
+            PreferenceTable(engine.proposer_preference.offsets, engine.proposer_preference.indices, proposer_position),
+            list(range(count_responder)), list(range(count_proposer)))
+        swapped.run()
+        self.responder_optimal = np.full(count_proposer, MatchingEngine.NO_MATCH, dtype=np.int32)
+        is_matched = swapped.proposer_matched_to != MatchingEngine.NO_MATCH
+        self.responder_optimal[swapped.proposer_matched_to[is_matched]] = np.flatnonzero(is_matched)
+
+        # rank of each mutually acceptable pair on both sides, 0 for most preferred
+        self.proposer_rank: List[Dict[int, int]] = [dict() for _ in range(count_proposer)]
+        for proposer, responder, position in zip(engine.proposer_preference.row_of_entries().tolist(),
+                                                 engine.proposer_preference.indices.tolist(),
+                                                 proposer_position.tolist()):
+            self.proposer_rank[proposer][responder] = position
+        self.responder_rank: List[Dict[int, int]] = [dict() for _ in range(count_responder)]
+        for responder, proposer, position in zip(responder_rows.tolist(), engine.responder_preference.indices.tolist(),
+                                                 responder_position.tolist()):
+            self.responder_rank[responder][proposer] = position
+
+        self.rotations: List[Rotation] = []
+        # immediate predecessors of each rotation; their transitive closure is the rotation poset
+        self.predecessors: List[Set[int]] = []
+        # rotation moving the proposer away from each (proposer, responder) pair it eliminates
+        self.rotation_of_pair: Dict[Tuple[int, int], int] = dict()
+        self.find_rotations()
+
+    def reduced_lists(self) -> Tuple[List[List[int]], List[List[int]]]:
+        """
+        :return: per proposer, responders between their proposer-optimal and responder-optimal partners that rank
+                them between the same two partners; per responder, the same pairs ordered by the responder's preference
+        """
+        proposer_lists = [[] for _ in self.proposer_uuids]
+        responder_lists = [[] for _ in self.responder_uuids]
+        best_for_responder = [MatchingEngine.NO_MATCH] * len(self.responder_uuids)
+        worst_for_responder = [MatchingEngine.NO_MATCH] * len(self.responder_uuids)
+        for proposer, (best, worst) in enumerate(zip(self.proposer_optimal.tolist(), self.responder_optimal.tolist())):
+            if best != MatchingEngine.NO_MATCH:
+                worst_for_responder[best] = proposer
+                best_for_responder[worst] = proposer
+
+        for proposer, (best, worst) in enumerate(zip(self.proposer_optimal.tolist(), self.responder_optimal.tolist())):
+            if best == MatchingEngine.NO_MATCH:
+                continue
+            ranks = self.proposer_rank[proposer]
+            for responder, rank in sorted(ranks.items(), key=lambda item: item[1]):
+                if ranks[best] <= rank <= ranks[worst] and best_for_responder[responder] != MatchingEngine.NO_MATCH:
+                    responder_ranks = self.responder_rank[responder]
+                    if proposer in responder_ranks and responder_ranks[best_for_responder[responder]] <= \
+                            responder_ranks[proposer] <= responder_ranks[worst_for_responder[responder]]:
+                        proposer_lists[proposer].append(responder)
+                        responder_lists[responder].append(proposer)
+        for responder, proposers in enumerate(responder_lists):
+            proposers.sort(key=self.responder_rank[responder].__getitem__)
+        return proposer_lists, responder_lists
+
+    def find_rotations(self) -> None:
+        """
+        Gusfield's O(n^2) walk from the proposer-optimal to the responder-optimal matching, eliminating each rotation
+        as soon as it is exposed, then the sparse subgraph of the rotation poset out of the labels of eliminated pairs
+        """
+        proposer_lists, responder_lists = self.reduced_lists()
+        responder_rank = self.responder_rank
+        position_in_responder_list = [{proposer: position for position, proposer in enumerate(proposers)}
+                                      for proposers in responder_lists]
+        matched_to = self.proposer_optimal.tolist()
+        holder = [MatchingEngine.NO_MATCH] * len(self.responder_uuids)
+        for proposer, responder in enumerate(matched_to):
+            if responder != MatchingEngine.NO_MATCH:
+                holder[responder] = proposer
+        # position in the proposer's reduced list of the first responder that may still prefer them to her partner
+        scan = [1] * len(matched_to)
+        # (rotation, is eliminated pair of the rotation) of each (proposer, responder) pair of the reduced lists
+        labels: Dict[Tuple[int, int], Tuple[int, bool]] = dict()
+
+        def next_responder(proposer: int) -> int:
+            proposers_list = proposer_lists[proposer]
+            while True:
+                responder = proposers_list[scan[proposer]]
+                ranks = responder_rank[responder]
+                if ranks[proposer] < ranks[holder[responder]]:
+                    return responder
+                scan[proposer] += 1
+
+        responder_optimal = self.responder_optimal.tolist()
+        stack: List[int] = []
+        on_stack = [False] * len(matched_to)
+        for start in range(len(matched_to)):
+            while matched_to[start] != responder_optimal[start]:
+                if not stack:
+                    stack.append(start)
+                    on_stack[start] = True
+                following = holder[next_responder(stack[-1])]
+                if not on_stack[following]:
+                    stack.append(following)
+                    on_stack[following] = True
+                    continue
+
+                cycle = []
+                while True:
+                    proposer = stack.pop()
+                    on_stack[proposer] = False
+                    cycle.append(proposer)
+                    if proposer == following:
+                        break
+                cycle.reverse()
+                rotation = len(self.rotations)
+                pairs = [(proposer, matched_to[proposer]) for proposer in cycle]
+                weight = 0
+                for index, (proposer, responder) in enumerate(pairs):
+                    new_responder = pairs[(index + 1) % len(pairs)][1]
+                    new_holder = pairs[index - 1][0]
+                    weight += self.proposer_rank[proposer][new_responder] - self.proposer_rank[proposer][responder]
+                    weight += responder_rank[responder][new_holder] - responder_rank[responder][proposer]
+                    labels[(proposer, responder)] = (rotation, True)
+                    self.rotation_of_pair[(proposer, responder)] = rotation
+                    # proposers the responder now ranks between her new and old partner can never be matched to her
+                    positions = position_in_responder_list[responder]
+                    for passed in responder_lists[responder][positions[new_holder] + 1:positions[proposer]]:
+                        labels.setdefault((passed, responder), (rotation, False))
+                for index, (proposer, responder) in enumerate(pairs):
+                    new_responder = pairs[(index + 1) % len(pairs)][1]
+                    matched_to[proposer] = new_responder
+                    holder[new_responder] = proposer
+                    scan[proposer] += 1
+                self.rotations.append(Rotation(tuple(pairs), weight))
+                self.predecessors.append(set())
+
+        for proposer, responders in enumerate(proposer_lists):
+            last_moved = None
+            for responder in responders:
+                label = labels.get((proposer, responder))
+                if label is None:
+                    continue
+                rotation, is_eliminated_pair = label
+                if is_eliminated_pair:
+                    if last_moved is not None:
+                        self.predecessors[rotation].add(last_moved)
+                    last_moved = rotation
+                elif last_moved is not None and last_moved != rotation:
+                    # the proposer cannot move past the responder before the rotation that took her
+                    self.predecessors[last_moved].add(rotation)
+
+    def closure(self, rotations: Set[int]) -> Set[int]:
+        """
+        :param rotations: rotation indices
+        :return: rotations together with all their predecessors in the poset
+        """
+        closed, pending = set(rotations), list(rotations)
+        while pending:
+            for predecessor in self.predecessors[pending.pop()]:
+                if predecessor not in closed:
+                    closed.add(predecessor)
+                    pending.append(predecessor)
+        return closed
+
+    def matching_indices(self, rotations: Set[int]) -> List[int]:
+        """
+        :param rotations: rotation indices closed under predecessors
+        :return: responder index matched to each proposer index, NO_MATCH if unmatched
+        """
+        matched_to = self.proposer_optimal.tolist()
+        for rotation in sorted(rotations):
+            pairs = self.rotations[rotation].pairs
+            for index, (proposer, _) in enumerate(pairs):
+                matched_to[proposer] = pairs[(index + 1) % len(pairs)][1]
+        return matched_to
+
+    def to_uuid_matching(self, matched_to: List[int]) -> Dict[int, Optional[int]]:
+        """
+        :param matched_to: responder index matched to each proposer index
+        :return: responder_uuid matched to each proposer_uuid, None if unmatched
+        """
+        responder_uuids = self.responder_uuids + [None]
+        return dict(zip(self.proposer_uuids, [responder_uuids[responder] for responder in matched_to]))
+
+    def matching(self, rotations: Set[int] = frozenset()) -> Dict[int, Optional[int]]:
+        """
+        :param rotations: rotation indices; their predecessors are eliminated as well
+        :return: stable matching obtained by eliminating the rotations, responder_uuid of each proposer_uuid
+        """
+        return self.to_uuid_matching(self.matching_indices(self.closure(rotations)))
+
+    def proposer_optimal_matching(self) -> Dict[int, Optional[int]]:
+        return self.to_uuid_matching(self.proposer_optimal.tolist())
+
+    def responder_optimal_matching(self) -> Dict[int, Optional[int]]:
+        return self.to_uuid_matching(self.responder_optimal.tolist())
+
+    def rotation_poset(self) -> Dict[int, Set[int]]:
+        """
+        :return: immediate predecessors of each rotation index, generating the poset by transitive closure
+        """
+        return {rotation: set(predecessors) for rotation, predecessors in enumerate(self.predecessors)}
+
+    def rotation_uuids(self, rotation: int) -> List[Tuple[int, int]]:
+        """
+        :param rotation: rotation index
+        :return: (proposer_uuid, responder_uuid) pairs broken by the rotation
+        """
+        return [(self.proposer_uuids[proposer], self.responder_uuids[responder])
+                for proposer, responder in self.rotations[rotation].pairs]
+
+    def stable_matchings(self) -> Iterator[Dict[int, Optional[int]]]:
+        """
+        lazily enumerate every stable matching exactly once, starting with the proposer-optimal one; rotations are
+        decided in the order they were found, which is a linear extension of the poset
+        """
+        matched_to = self.proposer_optimal.tolist()
+        is_eliminated = [False] * len(self.rotations)
+        # (rotation index, step): 0 branch without the rotation, 1 branch with it, 2 undo it
+        stack = [(0, 0)]
+        while stack:
+            rotation, step = stack.pop()
+            if rotation == len(self.rotations):
+                yield self.to_uuid_matching(matched_to)
+            elif step == 0:
+                stack.append((rotation, 1))
+                stack.append((rotation + 1, 0))
+            elif step == 1:
+                if all(is_eliminated[predecessor] for predecessor in self.predecessors[rotation]):
+                    pairs = self.rotations[rotation].pairs
+                    for index, (proposer, _) in enumerate(pairs):
+                        matched_to[proposer] = pairs[(index + 1) % len(pairs)][1]
+                    is_eliminated[rotation] = True
+                    stack.append((rotation, 2))
+                    stack.append((rotation + 1, 0))
+            else:
+                for proposer, responder in self.rotations[rotation].pairs:
+                    matched_to[proposer] = responder
+                is_eliminated[rotation] = False
+
+    def egalitarian_cost(self, matched_to: List[int]) -> int:
+        """
+        :param matched_to: responder index matched to each proposer index
+        :return: sum over matched participants of both sides of the rank of their partner, 0 for most preferred
+        """
+        return sum(self.proposer_rank[proposer][responder] + self.responder_rank[responder][proposer]
+                   for proposer, responder in enumerate(matched_to) if responder != MatchingEngine.NO_MATCH)
+
+    def egalitarian_stable_matching(self) -> MatchingOutcome:
+        """
+        stable matching minimizing the sum of ranks of partners over both sides: the cheapest closed set of rotations,
+        found as a minimum cut of the rotation poset weighted by the change of cost of each rotation
+        :return: MatchingOutcome of the matching (responder_uuid of each proposer_uuid), its egalitarian cost and the
+            rotations eliminated
+        """
+        count_rotations = len(self.rotations)
+        source, sink = count_rotations, count_rotations + 1
+        unbounded = sum(abs(rotation.weight) for rotation in self.rotations) + 1
+        arcs = []
+        for rotation, (_, weight) in enumerate(self.rotations):
+            if weight < 0:
+                arcs.append((source, rotation, -weight))
+            elif weight > 0:
+                arcs.append((rotation, sink, weight))
+            arcs.extend((rotation, predecessor, unbounded) for predecessor in self.predecessors[rotation])
+        rotations = minimum_cut_source_side(count_rotations + 2, arcs, source, sink) - {source}
+        matched_to = self.matching_indices(rotations)
+        return MatchingOutcome(self.to_uuid_matching(matched_to), self.egalitarian_cost(matched_to), rotations)
+
+    def regret(self, matched_to: List[int]) -> Tuple[int, int, bool]:
+        """
+        :param matched_to: responder index matched to each proposer index
+        :return: largest rank of a partner over both sides (0 for most preferred), index of a participant having it
+            and whether that participant is a responder, preferring a proposer on ties
+        """
+        regret, participant, is_responder = -1, MatchingEngine.NO_MATCH, False
+        for proposer, responder in enumerate(matched_to):
+            if responder != MatchingEngine.NO_MATCH and self.proposer_rank[proposer][responder] > regret:
+                regret, participant = self.proposer_rank[proposer][responder], proposer
+        for proposer, responder in enumerate(matched_to):
+            if responder != MatchingEngine.NO_MATCH and self.responder_rank[responder][proposer] > regret:
+                regret, participant, is_responder = self.responder_rank[responder][proposer], responder, True
+        return regret, participant, is_responder
+
+    def minimum_regret_stable_matching(self) -> MatchingOutcome:
+        """
+        Gusfield's minimum regret stable matching: while the worst-off participant is a responder, eliminate the
+        rotation taking her away from her partner together with its predecessors; eliminating rotations never helps a
+        proposer, so the walk stops once a proposer is worst off
+        :return: MatchingOutcome of the matching (responder_uuid of each proposer_uuid), its regret (largest rank of a
+            partner, 0 for most preferred) and the rotations eliminated
+        """
+        matched_to = self.proposer_optimal.tolist()
+        eliminated: Set[int] = set()
+        best_regret, best_eliminated = self.regret(matched_to)[0], set()
+        while True:
+            regret, participant, is_responder = self.regret(matched_to)
+            if regret < best_regret:
+                best_regret, best_eliminated = regret, set(eliminated)
+            if not is_responder:
+                break
+            holder = matched_to.index(participant)
+            rotation = self.rotation_of_pair.get((holder, participant))
+            if rotation is None:
+                break
+            for forced in sorted(self.closure({rotation}) - eliminated):
+                pairs = self.rotations[forced].pairs
+                for index, (proposer, _) in enumerate(pairs):
+                    matched_to[proposer] = pairs[(index + 1) % len(pairs)][1]
+                eliminated.add(forced)
+        return MatchingOutcome(self.to_uuid_matching(self.matching_indices(best_eliminated)), best_regret,
+                               best_eliminated)
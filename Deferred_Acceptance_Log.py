@@ -0,0 +1,110 @@
+"""
+Append-only proposal log backed by one (n, 4) integer array instead of a list of Proposal named tuples; saved as .npy
+it can be memory-mapped back without loading it, and text is only produced when iterated over
+"""
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+from Deferred_Acceptance_Entity import Proposal
+from Deferred_Acceptance_Instrumentation import InstrumentationSink
+
+
+class ProposalLog(InstrumentationSink):
+    """
+    columns proposal_id, proposer_uuid, responder_uuid, rejected_uuid; NO_UUID stands in for None. As a sink of
+    Market.enable_instrumentation() it records every proposal the market makes one at a time; proposals made on engine
+    arrays, by run_to_completion("engine") or "rounds" and by the fresh solve Market.warm_start() may fall back to,
+    are not recorded since the engine only reports counts per round, and run_to_completion() warns about it
+    """
+    NO_UUID = -1
+    CHUNK_ROWS = 1 << 16
+    COLUMNS = ("proposal_id", "proposer_uuid", "responder_uuid", "rejected_uuid")
+
+    def __init__(self, initial_capacity: int = 1024, dtype: type = np.int64):
+        """
+        :param initial_capacity: number of rows allocated up front, doubled whenever the log is full
+        :param dtype: integer type of the columns
+        """
+        self.rows = np.empty((max(initial_capacity, 1), 4), dtype=dtype)
+        self.count = 0
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'ProposalLog':
+        """
+        :param path: .npy file written by save()
+        :param mmap: map the file read-only instead of reading it into memory; appending copies it into memory first
+        :return: log holding the saved proposals
+        """
+        log = cls.__new__(cls)
+        log.rows = np.load(path, mmap_mode="r" if mmap else None)
+        log.count = len(log.rows)
+        return log
+
+    def save(self, path: str) -> None:
+        """
+        :param path: .npy file to write
+        """
+        np.save(path, self.array)
+
+    @property
+    def array(self) -> np.ndarray:
+        """
+        :return: (len(self), 4) view of the recorded proposals
+        """
+        return self.rows[:self.count]
+
+    def reserve(self, count: int) -> None:
+        """
+        :param count: number of rows the log must be able to hold without growing again
+        """
+        if count > len(self.rows) or not self.rows.flags.writeable:
+            rows = np.empty((max(count, 2 * len(self.rows)), 4), dtype=self.rows.dtype)
+            rows[:self.count] = self.rows[:self.count]
+            self.rows = rows
+
+    def append(self, proposal: Proposal) -> None:
+        """
+        :param proposal: proposal with a proposal_id, as returned by Market.proposer_make_move()
+        """
+        if self.count == len(self.rows) or not self.rows.flags.writeable:
+            self.reserve(self.count + 1)
+        proposal_id, proposer_uuid, responder_uuid, rejected_uuid = proposal
+        self.rows[self.count] = (proposal_id, proposer_uuid, responder_uuid,
+                                 self.NO_UUID if rejected_uuid is None else rejected_uuid)
+        self.count += 1
+
+    def extend(self, proposals: Iterable[Proposal]) -> None:
+        """
+        :param proposals: proposals with a proposal_id, e.g. from Market.stream_proposals()
+        """
+        for proposal in proposals:
+            self.append(proposal)
+
+    def on_proposal(self, proposal: Proposal, unmatched_count: int) -> None:
+        self.append(proposal)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> Proposal:
+        proposal_id, proposer_uuid, responder_uuid, rejected_uuid = self.array[index].tolist()
+        return Proposal(proposal_id, proposer_uuid, responder_uuid,
+                        None if rejected_uuid == self.NO_UUID else rejected_uuid)
+
+    def __iter__(self) -> Iterator[Proposal]:
+        no_uuid = self.NO_UUID
+        # convert a chunk at a time so that a memory-mapped log is never read in full
+        for chunk_start in range(0, self.count, self.CHUNK_ROWS):
+            for proposal_id, proposer_uuid, responder_uuid, rejected_uuid in \
+                    self.rows[chunk_start:min(chunk_start + self.CHUNK_ROWS, self.count)].tolist():
+                yield Proposal(proposal_id, proposer_uuid, responder_uuid,
+                               None if rejected_uuid == no_uuid else rejected_uuid)
+
+    def sentences(self, market) -> Iterator[List[str]]:
+        """
+        :param market: Market the proposals were made in, naming proposers and responders
+        :return: lazily, the output of market.interpret_proposal_outcome() for each proposal
+        """
+        for proposal in self:
+            yield market.interpret_proposal_outcome(proposal)
@@ -2,13 +2,51 @@
 Gale-Shapley algorithm for Stable Matching Problem (SMP) between two equally sized sets of elements, Proposers and
 Responders
 """
-from itertools import count
-from typing import List, Set, Dict, Tuple, Optional
+import warnings
+from bisect import bisect_left
+from collections import Counter
+from heapq import heapify, heappush, heapreplace
+from itertools import count, islice
+from operator import itemgetter
+from typing import Generator, Iterator, List, Set, Dict, Tuple, Optional, Union
 
-from Deferred_Acceptance_Entity import Responder, Proposer, Proposal
+import numpy as np
+
+from Deferred_Acceptance_Engine import MatchingEngine, PreferenceTable
+from Deferred_Acceptance_Entity import Responder, CapacityResponder, Proposer, Proposal, ValidationReport
+from Deferred_Acceptance_File import open_engine, save_market
+from Deferred_Acceptance_Instrumentation import InstrumentationSink, MarketInstrumentation
+from Deferred_Acceptance_Lattice import StableMatchingLattice
+
+
+def drain(generator: Generator[Proposal, None, Tuple[Set[int], Set[int]]]) -> Tuple[Set[int], Set[int]]:
+    """
+    :param generator: generator of proposals such as Market.iter_warm_start()
+    :return: value the generator returns once it has made every proposal
+    """
+    while True:
+        try:
+            next(generator)
+        except StopIteration as finished:
+            return finished.value
+
+
+class RematchBudgetExceeded(Exception):
+    """
+    raised by Market.spend_rematch_budget() once re-matching in place has cost more than solving the market again;
+    carries the participants touched so far, whose matching may have changed
+    """
+
+    def __init__(self):
+        super().__init__("re-matching in place would cost more than solving the market again")
+        self.proposer_uuid: Set[int] = set()
+        self.responder_uuid: Set[int] = set()
 
 
 class Market:
+    NO_UUID = -1
+    CHECKPOINT_VERSION = 1
+
     def __init__(self):
         self.uuid_proposer = count(1)
         self.uuid_responder = count(1001)
@@ -19,6 +57,127 @@ class Market:
         self.count_responder = 0
         self.proposal_count = 0
         self.is_strict_preference = True
+        self.engine: Optional[MatchingEngine] = None
+        # None unless enable_instrumentation() is called, the proposal loop then only pays for one attribute check
+        self.instrumentation: Optional[MarketInstrumentation] = None
+        # steps warm_start() may still take before a fresh solve is cheaper, None outside of warm_start(); starts out
+        # as a lower bound on the cost of a fresh solve, replaced by the full estimate only if that bound is reached
+        self.rematch_budget: Optional[int] = None
+        self.is_rematch_budget_estimated = False
+
+    @classmethod
+    def from_preference_matrix(cls, proposer_preference: np.ndarray, responder_preference: np.ndarray,
+                               proposer_names: List[str] = None, responder_names: List[str] = None,
+                               responder_capacity: List[int] = None) -> 'Market':
+        """
+        build a whole market in one call out of preference tables over dense indices; Proposers and Responders are
+        given the uuids register_proposer() and register_responder() would give them, in row order
+        :param proposer_preference: row i lists responder row indices from most to least preferred by proposer i,
+            truncated lists are padded at the end with -1
+        :param responder_preference: row j lists proposer row indices from most to least preferred by responder j,
+            truncated lists are padded at the end with -1
+        :param proposer_names: names of proposers in row order; if None names set to "Proposer proposer_uuid"
+        :param responder_names: names of responders in row order; if None names set to "Responder responder_uuid"
+        :param responder_capacity: number of seats of responders in row order; if None every responder has one seat
+        :return: Market whose Proposers and Responders read their preferences from arrays of a shared MatchingEngine
+        """
+        return cls.from_preference_tables(PreferenceTable.from_padded(proposer_preference),
+                                          PreferenceTable.from_padded(responder_preference),
+                                          proposer_names, responder_names, responder_capacity)
+
+    @classmethod
+    def from_preference_tables(cls, proposer_preference: PreferenceTable, responder_preference: PreferenceTable,
+                               proposer_names: List[str] = None, responder_names: List[str] = None,
+                               responder_capacity: List[int] = None) -> 'Market':
+        """
+        build a whole market in one call out of CSR-style truncated preference lists over dense indices, so memory
+        scales with total length of the lists rather than with the number of possible pairs
+        :param proposer_preference: row i lists responder row indices from most to least preferred by proposer i
+        :param responder_preference: row j lists proposer row indices ranked by responder j, rank 0 most preferred
+        :param proposer_names: names of proposers in row order; if None names set to "Proposer proposer_uuid"
+        :param responder_names: names of responders in row order; if None names set to "Responder responder_uuid"
+        :param responder_capacity: number of seats of responders in row order, at least one each; if None every
+            responder has one seat
+        :return: Market whose Proposers and Responders read their preferences from arrays of a shared MatchingEngine
+        """
+        count_proposer, count_responder = proposer_preference.count_rows, responder_preference.count_rows
+        for side, table, count_columns in (("proposer", proposer_preference, count_responder),
+                                           ("responder", responder_preference, count_proposer)):
+            row = table.first_invalid_row(count_columns)
+            if row is not None:
+                raise ValueError("Row %d of the %s preference table lists an index outside 0 to %d" %
+                                 (row, side, count_columns - 1))
+        engine = MatchingEngine.from_preference_tables(proposer_preference, responder_preference,
+                                                       list(range(1, count_proposer + 1)),
+                                                       list(range(1001, 1001 + count_responder)), responder_capacity)
+        return cls.from_engine(engine, proposer_names, responder_names)
+
+    @classmethod
+    def from_engine(cls, engine: MatchingEngine, proposer_names: List[str] = None,
+                    responder_names: List[str] = None) -> 'Market':
+        """
+        :param engine: engine holding preferences, its uuids become the uuids of Proposers and Responders
+        :param proposer_names: names of proposers in dense index order; if None names set to "Proposer proposer_uuid"
+        :param responder_names: names of responders in dense index order; if None names set to "Responder
+            responder_uuid"
+        :return: Market whose Proposers and Responders read their preferences from the arrays of engine
+        """
+        market = cls()
+        proposer_uuids = engine.proposer_uuids.tolist()
+        responder_uuids = engine.responder_uuids.tolist()
+        market.uuid_proposer = count(max(proposer_uuids, default=0) + 1)
+        market.uuid_responder = count(max(responder_uuids, default=1000) + 1)
+
+        for index, uuid in enumerate(proposer_uuids):
+            proposer = Proposer(uuid, proposer_names[index] if proposer_names else None)
+            proposer.proposal_order = engine.proposal_order_view(index)
+            market.proposer_uuid_dict[uuid] = proposer
+        for index, uuid in enumerate(responder_uuids):
+            name = responder_names[index] if responder_names else None
+            capacity = int(engine.responder_capacity[index])
+            responder = CapacityResponder(uuid, name, capacity) if capacity > 1 else Responder(uuid, name)
+            responder.preference_order = engine.preference_order_view(index)
+            market.responder_uuid_dict[uuid] = responder
+        market.unmatched_proposer_uuid = set(proposer_uuids)
+        market.count_proposer = len(proposer_uuids)
+        market.count_responder = len(responder_uuids)
+        market.engine = engine
+        return market
+
+    @classmethod
+    def from_market_file(cls, path: str) -> 'Market':
+        """
+        :param path: market file written by save_market_file(), see Deferred_Acceptance_File for the format
+        :return: Market reading its preferences straight from the memory-mapped file, nothing is copied
+        """
+        return cls.from_engine(*open_engine(path))
+
+    def save_market_file(self, path: str) -> None:
+        """
+        :param path: market file to write participants, names and preferences to, see Deferred_Acceptance_File
+        """
+        save_market(path, self)
+
+    @classmethod
+    def from_arrays(cls, *args, **kwargs) -> 'Market':
+        """
+        same as from_preference_matrix(), every argument is passed on; kept as a short alias
+        """
+        return cls.from_preference_matrix(*args, **kwargs)
+
+    @classmethod
+    def from_preference_files(cls, proposer_path: str, responder_path: str) -> 'Market':
+        """
+        :param proposer_path: .npy or comma separated .csv file holding the proposer preference table
+        :param responder_path: .npy or comma separated .csv file holding the responder preference table
+        :return: Market built by from_preference_matrix() out of the two tables
+        """
+        def load_table(path: str) -> np.ndarray:
+            if path.endswith(".npy"):
+                return np.load(path)
+            return np.loadtxt(path, delimiter=",", dtype=np.int32, ndmin=2)
+
+        return cls.from_preference_matrix(load_table(proposer_path), load_table(responder_path))
 
     def strict_preference_only(self) -> bool:
         """
@@ -34,6 +193,7 @@ class Market:
         """
         new_uuid = uuid if uuid else next(self.uuid_proposer)
         new_proposer = Proposer(new_uuid, name)
+        self.engine = None
         self.proposer_uuid_dict[new_uuid] = new_proposer
         self.unmatched_proposer_uuid.add(new_uuid)
         self.count_proposer += 1
@@ -46,6 +206,7 @@ class Market:
         :param strict_preference: list of Acceptor proposer_uuid stating proposal order
         """
         self.proposer_uuid_dict[uuid].set_strict_preference(strict_preference)
+        self.engine = None
 
     def register_proposer_weak_preference(self, uuid: int, weak_preference: List[List[int]]) -> None:
         """
@@ -55,6 +216,7 @@ class Market:
         :param weak_preference: list of Acceptor proposer_uuid stating proposal order
         """
         self.is_strict_preference = self.proposer_uuid_dict[uuid].set_weak_preference(weak_preference)
+        self.engine = None
 
     def proposer_name_lookup_from_uuid(self) -> Dict[str, int]:
         """
@@ -62,14 +224,19 @@ class Market:
         """
         return {proposer.uuid: proposer.name for proposer in self.proposer_uuid_dict.values()}
 
-    def register_responder(self, name: str = None, uuid: int = None) -> int:
+    def register_responder(self, name: str = None, uuid: int = None, capacity: int = 1) -> int:
         """
         :param name: name of the responder; if None name set to "Responder proposer_uuid"
         :param uuid: override randomly generated system proposer_uuid with customer supplied proposer_uuid.
+        :param capacity: number of Proposers the responder can hold, at least 1; above 1 the market becomes a
+                many-to-one (college admissions) market and the responder keeps its held Proposers in a heap
         :return: proposer_uuid of the responder
         """
+        if capacity < 1:
+            raise ValueError("Responder capacity must be at least 1, got %d" % capacity)
         new_uuid = uuid if uuid else next(self.uuid_responder)
-        new_responder = Responder(new_uuid, name)
+        new_responder = CapacityResponder(new_uuid, name, capacity) if capacity > 1 else Responder(new_uuid, name)
+        self.engine = None
         self.responder_uuid_dict[new_uuid] = new_responder
         self.count_responder += 1
         return new_uuid
@@ -80,6 +247,7 @@ class Market:
         :param strict_preference: list of Proposer uuids representing strict preference over them
         """
         self.responder_uuid_dict[uuid].set_strict_preference(strict_preference)
+        self.engine = None
 
     def register_responder_weak_preference(self, uuid: int, weak_preference: List[List[int]]) -> None:
         """
@@ -88,6 +256,7 @@ class Market:
         :param weak_preference: list of Proposer uuids representing weak preference over them
         """
         self.is_strict_preference = self.responder_uuid_dict[uuid].set_weak_preference(weak_preference)
+        self.engine = None
 
     def responder_name_lookup_from_uuid(self) -> Dict[str, int]:
         """
@@ -103,31 +272,70 @@ class Market:
             (3) preference orders for all Responder set properly
             (4) first error message encountered, in case of error, or None
         """
-        error_message = None
+        bool_market, bool_proposer, bool_responder, _, error_messages = self.validation_report()
+        return bool_market, bool_proposer, bool_responder, error_messages[0] if error_messages else None
+
+    def validation_report(self) -> ValidationReport:
+        """
+        check every preference list in a single pass against the uuid universes of both sides of the market; markets
+        built from preference tables are checked on their engine arrays
+        :return: ValidationReport of
+            (1) whether proposer_uuid were assigned correctly
+            (2) proposal orders for all Proposers are set properly
+            (3) preference orders for all Responder set properly
+            (4) Counter of number of participants per kind of error
+            (5) list of all error messages
+        """
+        if self.engine is not None:
+            # preferences still live in the engine arrays, checked there without going through the views
+            return self.engine.validation_report(lambda uuid: self.proposer_uuid_dict[uuid].name,
+                                                 lambda uuid: self.responder_uuid_dict[uuid].name)
+        error_counts = Counter()
+        error_messages = []
+
         if len(self.proposer_uuid_dict) != self.count_proposer:
-            bool_market = False
-            error_message = error_message if error_message else "Proposer proposer_uuid assigned incorrectly"
-        elif len(self.responder_uuid_dict) != self.count_responder:
-            bool_market = False
-            error_message = error_message if error_message else "Responder proposer_uuid assigned incorrectly"
-        else:
-            bool_market = True
+            error_counts["proposer uuid"] += 1
+            error_messages.append("Proposer proposer_uuid assigned incorrectly")
+        if len(self.responder_uuid_dict) != self.count_responder:
+            error_counts["responder uuid"] += 1
+            error_messages.append("Responder proposer_uuid assigned incorrectly")
+        bool_market = not error_messages
+
+        # dict key views serve as uuid universes without copying them into sets per participant
+        proposer_universe = self.proposer_uuid_dict.keys()
+        responder_universe = self.responder_uuid_dict.keys()
 
         bool_proposer = True
         for uuid, proposer in self.proposer_uuid_dict.items():
-            if not proposer.validate(self.proposer_uuid_dict, self.responder_uuid_dict):
+            problems = []
+            if proposer.uuid != uuid:
+                problems.append("registered under uuid %s" % uuid)
+            unknown = sum(1 for responder_uuid in proposer.proposal_order if responder_uuid not in responder_universe)
+            if unknown:
+                error_counts["unknown responder in proposal order"] += 1
+                problems.append("%d unknown responder uuid(s) in proposal order" % unknown)
+            duplicates = len(proposer.proposal_order) - len(set(proposer.proposal_order))
+            if duplicates:
+                error_counts["duplicate responder in proposal order"] += 1
+                problems.append("%d duplicate responder uuid(s) in proposal order" % duplicates)
+            if problems:
                 bool_proposer = False
-                error_message = error_message if error_message else "Proposer %s is incorrect" % proposer.name
-                break
+                error_messages.append("Proposer %s is incorrect: %s" % (proposer.name, ", ".join(problems)))
 
         bool_responder = True
         for uuid, responder in self.responder_uuid_dict.items():
-            if not responder.validate(self.proposer_uuid_dict, self.responder_uuid_dict):
+            problems = []
+            if responder.uuid != uuid:
+                problems.append("registered under uuid %s" % uuid)
+            unknown = sum(1 for proposer_uuid in responder.preference_order if proposer_uuid not in proposer_universe)
+            if unknown:
+                error_counts["unknown proposer in preference order"] += 1
+                problems.append("%d unknown proposer uuid(s) in preference order" % unknown)
+            if problems:
                 bool_responder = False
-                error_message = error_message if error_message else "Responder %s is incorrect" % responder.name
-                break
+                error_messages.append("Responder %s is incorrect: %s" % (responder.name, ", ".join(problems)))
 
-        return bool_market, bool_proposer, bool_responder, error_message
+        return ValidationReport(bool_market, bool_proposer, bool_responder, error_counts, error_messages)
 
     def has_more_proposal(self) -> bool:
         """
@@ -163,7 +371,10 @@ class Market:
             rejected_proposer.register_response(is_acceptance=False)
             self.unmatched_proposer_uuid.remove(proposer_uuid)
             self.unmatched_proposer_uuid.add(rejection_uuid)
-        return Proposal(self.proposal_count, proposer_uuid, next_propose_to, rejection_uuid)
+        proposal = Proposal(self.proposal_count, proposer_uuid, next_propose_to, rejection_uuid)
+        if self.instrumentation is not None:
+            self.instrumentation.record_proposal(proposal, len(self.unmatched_proposer_uuid))
+        return proposal
 
     def one_round_simultaneous_proposals(self):
         """
@@ -171,30 +382,708 @@ class Market:
         :return: list of Proposal(self.proposal_count, want_to_propose_uuid, next_propose_to, rejection_uuid)
                 describing proposals in current round; use interpret_proposal_outcome() to translate the output
         """
-        proposals_in_current_round = []
+        return list(self.iter_one_round_simultaneous_proposals())
+
+    def iter_one_round_simultaneous_proposals(self) -> Iterator[Proposal]:
+        """
+        same as one_round_simultaneous_proposals() but yields each Proposal as it is made instead of building a list;
+        the unmatched set is updated as each proposal is applied, so a generator closed in the middle of a round leaves
+        a consistent market: proposers who have not moved yet are still unmatched
+        """
         next_round_proposer_uuid = set()
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            instrumentation.start_round()
+            round_proposals = []
 
-        for want_to_propose_uuid in self.unmatched_proposer_uuid:
+        # proposers rejected during the round join the unmatched set but only propose again next round
+        for want_to_propose_uuid in list(self.unmatched_proposer_uuid):
             want_to_propose = self.proposer_uuid_dict[want_to_propose_uuid]
             next_propose_to = want_to_propose.propose_next()
-            if next_propose_to != Proposer.NO_NEXT_PROPOSAL:
-                self.proposal_count += 1
-                rejection_uuid = self.responder_uuid_dict[next_propose_to].respond_to_proposal(want_to_propose_uuid)
-                if rejection_uuid is None:
-                    want_to_propose.register_response(is_acceptance=True)
-                elif rejection_uuid == want_to_propose_uuid:
-                    next_round_proposer_uuid.add(want_to_propose_uuid)
-                else:
-                    want_to_propose.register_response(is_acceptance=True)
-                    rejected_proposer = self.proposer_uuid_dict[rejection_uuid]
-                    rejected_proposer.register_response(is_acceptance=False)
-                    next_round_proposer_uuid.add(rejection_uuid)
+            if next_propose_to == Proposer.NO_NEXT_PROPOSAL:
+                self.unmatched_proposer_uuid.discard(want_to_propose_uuid)
+                continue
+            self.proposal_count += 1
+            rejection_uuid = self.responder_uuid_dict[next_propose_to].respond_to_proposal(want_to_propose_uuid)
+            if rejection_uuid is None:
+                want_to_propose.register_response(is_acceptance=True)
+                self.unmatched_proposer_uuid.discard(want_to_propose_uuid)
+            elif rejection_uuid == want_to_propose_uuid:
+                next_round_proposer_uuid.add(want_to_propose_uuid)
+            else:
+                want_to_propose.register_response(is_acceptance=True)
+                rejected_proposer = self.proposer_uuid_dict[rejection_uuid]
+                rejected_proposer.register_response(is_acceptance=False)
+                self.unmatched_proposer_uuid.discard(want_to_propose_uuid)
+                self.unmatched_proposer_uuid.add(rejection_uuid)
+                next_round_proposer_uuid.add(rejection_uuid)
+
+            proposal = Proposal(self.proposal_count, want_to_propose_uuid, next_propose_to, rejection_uuid)
+            if instrumentation is not None:
+                round_proposals.append(proposal)
+                instrumentation.record_proposal(proposal, len(next_round_proposer_uuid))
+            yield proposal
+
+        if instrumentation is not None:
+            instrumentation.record_round(round_proposals, len(next_round_proposer_uuid))
 
-                proposals_in_current_round.append(Proposal(self.proposal_count, want_to_propose_uuid,
-                                                           next_propose_to, rejection_uuid))
+    def stream_proposals(self, mode: str = "sequential") -> Iterator[Proposal]:
+        """
+        keep making proposals until no unmatched proposer wants to make an offer, yielding each Proposal as it is made
+        :param mode: "sequential" lets one unmatched proposer move at a time as run_to_completion() does,
+                "rounds" makes rounds of simultaneous proposals
+        """
+        if mode == "sequential":
+            while self.has_more_proposal():
+                # follow each displacement chain to its end, the rejected proposer moves next, so picking who moves
+                # never searches the unmatched set; it is read again once the chains run out, in case it changed
+                # while the generator was suspended
+                pending_proposer_uuid = list(self.unmatched_proposer_uuid)
+                while pending_proposer_uuid:
+                    proposer_uuid = pending_proposer_uuid.pop()
+                    if proposer_uuid not in self.unmatched_proposer_uuid:
+                        continue
+                    proposal = self.proposer_make_move(proposer_uuid)
+                    if proposal.proposal_id is None:
+                        self.unmatched_proposer_uuid.discard(proposer_uuid)
+                        continue
+                    if proposal.rejected_uuid is not None:
+                        pending_proposer_uuid.append(proposal.rejected_uuid)
+                    yield proposal
+        elif mode == "rounds":
+            while self.has_more_proposal():
+                yield from self.iter_one_round_simultaneous_proposals()
+        else:
+            raise ValueError("Unknown mode %s" % mode)
+
+    def enable_instrumentation(self, sinks: List[InstrumentationSink] = None) -> MarketInstrumentation:
+        """
+        report proposals of proposer_make_move(), rounds of one_round_simultaneous_proposals() and the end of
+        run_to_completion() to sinks; the "engine" and "rounds" modes of run_to_completion() report counts of each
+        engine round instead of individual proposals, the "engine" mode as a single round
+        :param sinks: receivers of events; if None a single ProposalStatistics
+        :return: instrumentation attached to the market, statistics() gives its ProposalStatistics
+        """
+        self.instrumentation = MarketInstrumentation(sinks)
+        return self.instrumentation
 
-        self.unmatched_proposer_uuid = next_round_proposer_uuid
-        return proposals_in_current_round
+    def disable_instrumentation(self) -> Optional[MarketInstrumentation]:
+        """
+        :return: instrumentation that was attached to the market, None if there was none
+        """
+        instrumentation, self.instrumentation = self.instrumentation, None
+        return instrumentation
+
+    def build_engine(self) -> MatchingEngine:
+        """
+        :return: array-backed engine holding registered preferences and current matching state of the market;
+                markets built from preference tables reuse their engine instead of converting objects back to arrays
+        """
+        if self.engine is None:
+            return MatchingEngine.from_market(self)
+        self.engine.import_state(self)
+        return self.engine
+
+    def verify_stability(self, count_only: bool = False) -> Union[List[Tuple[int, int]], int]:
+        """
+        find every pair blocking the current matching, in one vectorized pass over the preference arrays; works for
+        truncated lists, weak preferences (only strict improvements block) and responders with several seats
+        :param count_only: return the number of blocking pairs instead of listing them
+        :return: (proposer_uuid, responder_uuid) of every blocking pair, or their number; the matching is stable if
+                there is none
+        """
+        engine = self.build_engine()
+        proposers, responders = engine.blocking_pairs()
+        if count_only:
+            return len(proposers)
+        return list(zip(engine.proposer_uuids[proposers].tolist(), engine.responder_uuids[responders].tolist()))
+
+    def run_to_completion(self, mode: str = "sequential") -> int:
+        """
+        keep making proposals until no unmatched proposer wants to make an offer
+        :param mode: "sequential" lets one unmatched proposer move at a time through proposer_make_move();
+                "engine" runs deferred acceptance on MatchingEngine arrays and writes the outcome back to the market;
+                "rounds" does the same with vectorized simultaneous proposal rounds; neither reports individual
+                proposals, so a RuntimeWarning is issued for sinks of enable_instrumentation() that only listen for them
+        :return: number of proposals that have been made
+        """
+        if mode == "sequential":
+            for _ in self.stream_proposals(mode):
+                pass
+        elif mode in ("engine", "rounds"):
+            engine = self.build_engine()
+            on_round = None
+            if self.instrumentation is not None:
+                if self.instrumentation.proposal_only_sinks:
+                    sink_names = ", ".join(type(sink).__name__ for sink in self.instrumentation.proposal_only_sinks)
+                    warnings.warn("sinks %s only record proposals one at a time and miss every proposal of the %s "
+                                  "mode" % (sink_names, mode), RuntimeWarning, stacklevel=2)
+                self.instrumentation.start_round()
+                on_round = self.instrumentation.record_engine_round
+            if mode == "engine":
+                engine.run(on_round)
+            else:
+                engine.run_rounds(on_round)
+            engine.write_back(self)
+        else:
+            raise ValueError("Unknown mode %s" % mode)
+        if self.instrumentation is not None:
+            self.instrumentation.record_finish(self.proposal_count, sum(
+                proposer.matched_to is None for proposer in self.proposer_uuid_dict.values()))
+        return self.proposal_count
+
+    def stable_matching_lattice(self) -> StableMatchingLattice:
+        """
+        :return: rotations and rotation poset of the market, giving both optimal matchings, every stable matching and
+                egalitarian or minimum regret ones; requires strict preferences and responders with a single seat
+        """
+        return StableMatchingLattice(self)
+
+    def add_proposer(self, name: str = None, uuid: int = None, strict_preference: List[int] = None) -> int:
+        """
+        add a proposer to a market that may already be (partially) solved; nothing already matched is undone since
+        a newcomer can only make responders better off, run_to_completion() then resumes from the current matching
+        :param name: name of the proposer; if None name set to "Proposer proposer_uuid"
+        :param uuid: override randomly generated system proposer_uuid with customer supplied proposer_uuid.
+        :param strict_preference: list of Acceptor proposer_uuid stating proposal order
+        :return: proposer_uuid of the proposer
+        """
+        new_uuid = self.register_proposer(name, uuid)
+        if strict_preference is not None:
+            self.register_proposer_strict_preference(new_uuid, strict_preference)
+        return new_uuid
+
+    def remove_proposer(self, uuid: int) -> Tuple[Set[int], Set[int]]:
+        """
+        withdraw a proposer and re-match in place: the seat he held is offered again along its vacancy chain, see
+        warm_start()
+        :param uuid: proposer_uuid of the proposer withdrawing
+        :return: uuids of proposers and of responders whose matching changed
+        """
+        self.finish_proposals()
+        proposer = self.proposer_uuid_dict.pop(uuid)
+        self.count_proposer -= 1
+        # responders that rejected him may have done so in favour of someone now better off elsewhere
+        unsettled_responder_uuid = set(proposer.proposal_order[:proposer.last_proposed_to + 1])
+        if self.engine is not None:
+            # the engine drops him from its arrays, the views of the proposers after him follow their rows down
+            index = self.engine.proposer_index[uuid]
+            self.engine.remove_proposer(index)
+            for other in islice(self.proposer_uuid_dict.values(), index, None):
+                other.proposal_order.proposer -= 1
+        else:
+            for responder in self.responder_uuid_dict.values():
+                if isinstance(responder.preference_order, dict):
+                    responder.preference_order.pop(uuid, None)
+                elif uuid in responder.preference_order:
+                    responder.preference_order = {proposer_uuid: preference_rank for proposer_uuid, preference_rank
+                                                  in responder.preference_order.items() if proposer_uuid != uuid}
+        vacated_responder_uuid = []
+        if proposer.matched_to is not None:
+            self.responder_uuid_dict[proposer.matched_to].release(uuid)
+            vacated_responder_uuid.append(proposer.matched_to)
+        changed_proposer_uuid, changed_responder_uuid = self.warm_start(vacated_responder_uuid,
+                                                                        unsettled_responder_uuid)
+        changed_responder_uuid.update(vacated_responder_uuid)
+        return changed_proposer_uuid, changed_responder_uuid
+
+    def update_proposer_preference(self, uuid: int, strict_preference: List[int]) -> Tuple[Set[int], Set[int]]:
+        """
+        replace the proposal order of a proposer and re-match in place: he starts over from the top of it and the seat
+        he held is offered again along its vacancy chain, see warm_start()
+        :param uuid: proposer_uuid
+        :param strict_preference: list of Acceptor proposer_uuid stating new proposal order
+        :return: uuids of proposers and of responders whose matching changed
+        """
+        return self.update_preferences({uuid: strict_preference}, dict())
+
+    def add_responder(self, name: str = None, uuid: int = None, capacity: int = 1,
+                      strict_preference: List[int] = None) -> int:
+        """
+        add a responder to a market that may already be (partially) solved; proposers only consider him once his
+        uuid is added to their proposal order through update_proposer_preference()
+        :param name: name of the responder; if None name set to "Responder proposer_uuid"
+        :param uuid: override randomly generated system proposer_uuid with customer supplied proposer_uuid.
+        :param capacity: number of Proposers the responder can hold
+        :param strict_preference: list of Proposer uuids representing strict preference over them
+        :return: proposer_uuid of the responder
+        """
+        new_uuid = self.register_responder(name, uuid, capacity)
+        if strict_preference is not None:
+            self.register_responder_strict_preference(new_uuid, strict_preference)
+        return new_uuid
+
+    def remove_responder(self, uuid: int) -> Tuple[Set[int], Set[int]]:
+        """
+        withdraw a responder; the proposers it held move on to their next choice, which can only make proposers
+        worse off, so nothing else is undone and run_to_completion() then resumes from the current matching
+        :param uuid: uuid of the responder withdrawing
+        :return: uuids of proposers and of responders whose matching changed
+        """
+        responder = self.responder_uuid_dict.pop(uuid)
+        self.count_responder -= 1
+        released = set(responder.held_proposers())
+        for proposer_uuid in released:
+            self.proposer_uuid_dict[proposer_uuid].matched_to = None
+            self.unmatched_proposer_uuid.add(proposer_uuid)
+        for proposer in self.proposer_uuid_dict.values():
+            if uuid in proposer.proposal_order:
+                position = proposer.proposal_order.index(uuid)
+                proposer.proposal_order = [responder_uuid for responder_uuid in proposer.proposal_order
+                                           if responder_uuid != uuid]
+                if proposer.proposal_tier is not None:
+                    proposer.proposal_tier = proposer.proposal_tier[:position] + proposer.proposal_tier[position + 1:]
+                # keep pointing at the same next proposal
+                if position <= proposer.last_proposed_to:
+                    proposer.last_proposed_to -= 1
+        self.engine = None
+        return released, {uuid}
+
+    def update_responder_preference(self, uuid: int, strict_preference: List[int]) -> Tuple[Set[int], Set[int]]:
+        """
+        replace the preference of a responder and re-match in place: held proposers it no longer lists are released
+        and only the proposers it rejected and now ranks above the rank to beat propose to it again, see warm_start()
+        :param uuid: uuid of the responder
+        :param strict_preference: list of Proposer uuids representing new strict preference over them
+        :return: uuids of proposers and of responders whose matching changed
+        """
+        return self.update_preferences(dict(), {uuid: strict_preference})
+
+    def update_preferences(self, proposer_preferences: Dict[int, List[int]],
+                           responder_preferences: Dict[int, List[int]]) -> Tuple[Set[int], Set[int]]:
+        """
+        replace preferences of several participants as one bulk update followed by a single warm_start()
+        :param proposer_preferences: new proposal order of each proposer_uuid, each starts over from its top
+        :param responder_preferences: new strict preference of each responder_uuid
+        :return: uuids of proposers and of responders whose matching changed
+        """
+        return drain(self.iter_update_preferences(proposer_preferences, responder_preferences))
+
+    def iter_update_preferences(self, proposer_preferences: Dict[int, List[int]],
+                                responder_preferences: Dict[int, List[int]]) \
+            -> Generator[Proposal, None, Tuple[Set[int], Set[int]]]:
+        """
+        same as update_preferences() but yields each Proposal as it is made, the pending ones first, so that a caller
+        can pause in between; participants registered meanwhile take part in the proposals still to come
+        :param proposer_preferences: new proposal order of each proposer_uuid, each starts over from its top
+        :param responder_preferences: new strict preference of each responder_uuid
+        :return: uuids of proposers and of responders whose matching changed, as the value of the generator
+        """
+        yield from self.stream_proposals()
+        engine_orders = None
+        if self.engine is not None:
+            # an engine-backed market keeps its arrays, patched in place, unless a list names someone they don't hold
+            engine_orders = self.engine_preference_orders(proposer_preferences, responder_preferences)
+            if engine_orders is None:
+                self.engine = None
+        vacated_responder_uuid, unsettled_responder_uuid = set(responder_preferences), set(responder_preferences)
+        for uuid, strict_preference in proposer_preferences.items():
+            proposer = self.proposer_uuid_dict[uuid]
+            unsettled_responder_uuid.update(proposer.proposal_order[:proposer.last_proposed_to + 1])
+            if proposer.matched_to is not None:
+                self.responder_uuid_dict[proposer.matched_to].release(uuid)
+                vacated_responder_uuid.add(proposer.matched_to)
+                proposer.matched_to = None
+            proposer.last_proposed_to = -1
+            self.unmatched_proposer_uuid.add(uuid)
+            if engine_orders is None:
+                self.register_proposer_strict_preference(uuid, strict_preference)
+        if engine_orders is not None:
+            self.engine.replace_preferences(*engine_orders)
+        released_proposer_uuid = set()
+        for uuid, strict_preference in responder_preferences.items():
+            responder = self.responder_uuid_dict[uuid]
+            if engine_orders is None:
+                self.register_responder_strict_preference(uuid, strict_preference)
+            for proposer_uuid in responder.release_unacceptable():
+                # he moves on to his next choice, as if rejected now
+                self.proposer_uuid_dict[proposer_uuid].matched_to = None
+                self.unmatched_proposer_uuid.add(proposer_uuid)
+                released_proposer_uuid.add(proposer_uuid)
+
+        changed_proposer_uuid, changed_responder_uuid = yield from self.iter_warm_start(list(vacated_responder_uuid),
+                                                                                        unsettled_responder_uuid)
+        changed_proposer_uuid.update(proposer_preferences, released_proposer_uuid)
+        changed_responder_uuid.update(vacated_responder_uuid)
+        return changed_proposer_uuid, changed_responder_uuid
+
+    def engine_preference_orders(self, proposer_preferences: Dict[int, List[int]],
+                                 responder_preferences: Dict[int, List[int]]) \
+            -> Optional[Tuple[Dict[int, List[int]], Dict[int, List[int]]]]:
+        """
+        :param proposer_preferences: new proposal order of each proposer_uuid
+        :param responder_preferences: new strict preference of each responder_uuid
+        :return: the same lists as dense indices of the engine, keyed by dense index, to be passed on to
+            MatchingEngine.replace_preferences(); None if any list names a uuid the engine does not hold
+        """
+        proposer_index, responder_index = self.engine.proposer_index, self.engine.responder_index
+        try:
+            return {proposer_index[uuid]: [responder_index[responder_uuid] for responder_uuid in order]
+                    for uuid, order in proposer_preferences.items()}, \
+                {responder_index[uuid]: [proposer_index[proposer_uuid] for proposer_uuid in order]
+                 for uuid, order in responder_preferences.items()}
+        except KeyError:
+            return None
+
+    def finish_proposals(self) -> None:
+        """
+        make every proposal still pending in sequential mode, so that a change starts from a proposer-optimal matching
+        """
+        for _ in self.stream_proposals():
+            pass
+
+    def warm_start(self, vacated_responder_uuid: List[int],
+                   unsettled_responder_uuid: Set[int]) -> Tuple[Set[int], Set[int]]:
+        """
+        re-match a solved market after some seats were freed or rankings changed, without undoing the rest of it: the
+        vacancy chains are offered again through rematch_vacancies(), the proposers sent back or released propose
+        again, and restore_proposer_optimality() then eliminates the rotations this may have left around the changed
+        part, so the outcome is the proposer-optimal matching a fresh run would find. With long preference lists the
+        rotation search can scan more than a fresh run would; once its steps add up to the cost of a fresh solve,
+        see fresh_solve_cost(), the matching is solved again from scratch by solve_from_scratch() instead
+        :param vacated_responder_uuid: responders whose seats were freed or whose preference changed
+        :param unsettled_responder_uuid: responders whose rejections may no longer be justified the same way
+        :return: uuids of proposers and of responders whose matching changed
+        """
+        return drain(self.iter_warm_start(vacated_responder_uuid, unsettled_responder_uuid))
+
+    def iter_warm_start(self, vacated_responder_uuid: List[int],
+                        unsettled_responder_uuid: Set[int]) -> Generator[Proposal, None, Tuple[Set[int], Set[int]]]:
+        """
+        same as warm_start() but yields each Proposal the proposers sent back or released make
+        :param vacated_responder_uuid: responders whose seats were freed or whose preference changed
+        :param unsettled_responder_uuid: responders whose rejections may no longer be justified the same way
+        :return: uuids of proposers and of responders whose matching changed, as the value of the generator
+        """
+        changed_proposer_uuid, changed_responder_uuid = set(), set()
+        # every solve writes every participant back, so a fresh one costs at least one step per participant
+        self.rematch_budget = self.count_proposer + self.count_responder
+        self.is_rematch_budget_estimated = False
+        try:
+            previous_position, left_responder_uuid = self.rematch_vacancies(vacated_responder_uuid)
+            changed_proposer_uuid.update(previous_position, self.unmatched_proposer_uuid)
+            changed_responder_uuid.update(left_responder_uuid)
+            for proposal in self.stream_proposals():
+                # the proposer may have been registered while the generator was suspended
+                changed_proposer_uuid.add(proposal.proposer_uuid)
+                changed_responder_uuid.add(proposal.responder_uuid)
+                if proposal.rejected_uuid is not None:
+                    changed_proposer_uuid.add(proposal.rejected_uuid)
+                self.spend_rematch_budget(1)
+                yield proposal
+
+            for uuid in changed_proposer_uuid:
+                proposer = self.proposer_uuid_dict[uuid]
+                # where he moved between rejections may now point at a rotation
+                last_position = max(proposer.last_proposed_to, previous_position.get(uuid, -1))
+                unsettled_responder_uuid.update(proposer.proposal_order[:last_position + 1])
+            unsettled_responder_uuid.update(changed_responder_uuid)
+            if self.is_strict_preference:
+                rotated_proposer_uuid, rotated_responder_uuid = self.restore_proposer_optimality(
+                    unsettled_responder_uuid)
+                changed_proposer_uuid.update(rotated_proposer_uuid)
+                changed_responder_uuid.update(rotated_responder_uuid)
+        except RematchBudgetExceeded as exceeded:
+            changed_proposer_uuid.update(exceeded.proposer_uuid, self.unmatched_proposer_uuid)
+            changed_responder_uuid.update(exceeded.responder_uuid)
+            solved_proposer_uuid, solved_responder_uuid = self.solve_from_scratch()
+            changed_proposer_uuid.update(solved_proposer_uuid)
+            changed_responder_uuid.update(solved_responder_uuid)
+        finally:
+            self.rematch_budget = None
+        return changed_proposer_uuid, changed_responder_uuid
+
+    def spend_rematch_budget(self, steps: int) -> None:
+        """
+        account for steps of work done by warm_start(), one per preference list entry scanned or proposal made
+        :param steps: number of steps just taken
+        :raise RematchBudgetExceeded: once the steps add up to more than a fresh solve would take
+        """
+        if self.rematch_budget is None:
+            return
+        self.rematch_budget -= steps
+        if self.rematch_budget < 0 and not self.is_rematch_budget_estimated:
+            # the lower bound is spent, so estimating the full cost now takes less than the work already done
+            self.rematch_budget += self.fresh_solve_cost() - self.count_proposer - self.count_responder
+            self.is_rematch_budget_estimated = True
+        if self.rematch_budget < 0:
+            raise RematchBudgetExceeded()
+
+    def fresh_solve_cost(self) -> int:
+        """
+        :return: steps solve_from_scratch() takes, in the units of spend_rematch_budget(): building engine arrays out
+            of every preference list entry unless the market is engine-backed, making about as many proposals as
+            proposers have made so far, and writing every participant back
+        """
+        proposal_cost = sum(proposer.last_proposed_to + 2 for proposer in self.proposer_uuid_dict.values()) + \
+            self.count_responder
+        if self.engine is not None:
+            # the arrays are patched along with every change, only the run is left
+            return proposal_cost
+        return proposal_cost + sum(len(proposer.proposal_order) for proposer in self.proposer_uuid_dict.values()) + \
+            sum(len(responder.preference_order) for responder in self.responder_uuid_dict.values())
+
+    def solve_from_scratch(self) -> Tuple[Set[int], Set[int]]:
+        """
+        forget every proposal made and solve the market again on engine arrays
+        :return: uuids of proposers and of responders whose matching differs from the one held before
+        """
+        matched_before = {uuid: proposer.matched_to for uuid, proposer in self.proposer_uuid_dict.items()}
+        held_before = {uuid: set(responder.held_proposers()) for uuid, responder in self.responder_uuid_dict.items()}
+        for proposer in self.proposer_uuid_dict.values():
+            proposer.last_proposed_to = -1
+            proposer.matched_to = None
+        for responder in self.responder_uuid_dict.values():
+            responder.clear_held()
+        self.unmatched_proposer_uuid = set(self.proposer_uuid_dict)
+        self.proposal_count = 0
+
+        engine = self.build_engine()
+        on_round = None
+        if self.instrumentation is not None:
+            self.instrumentation.start_round()
+            on_round = self.instrumentation.record_engine_round
+        engine.run(on_round)
+        engine.write_back(self)
+        return {uuid for uuid, proposer in self.proposer_uuid_dict.items()
+                if proposer.matched_to != matched_before[uuid]}, \
+            {uuid for uuid, responder in self.responder_uuid_dict.items()
+             if set(responder.held_proposers()) != held_before[uuid]}
+
+    def rematch_vacancies(self, responder_uuids: List[int]) -> Tuple[Dict[int, int], Set[int]]:
+        """
+        every rejection a responder made stays valid as long as it holds someone it ranks at least as high as the
+        rejected proposer. Otherwise the best such proposers, as many as it would now accept, are sent back just before
+        it in their proposal order; each leaves the seat he held, which is handled the same way, so only the vacancy
+        chain is undone
+        :param responder_uuids: responders whose seats were freed or whose preference changed
+        :return: last_proposed_to of each proposer sent back before he was, and uuids of responders they left
+        """
+        previous_position, left_responder_uuid = dict(), set()
+        # responder each proposer sent back is expected to propose to again
+        sent_back_to: Dict[int, int] = dict()
+        pending_responder_uuid = list(responder_uuids)
+        try:
+            while pending_responder_uuid:
+                responder_uuid = pending_responder_uuid.pop()
+                responder = self.responder_uuid_dict.get(responder_uuid)
+                if responder is None:
+                    continue
+                self.spend_rematch_budget(len(responder.preference_order))
+                held = set(responder.held_proposers())
+                # min-heap of ranks the responder holds, including proposers sent back to it in this pass
+                held_ranks = [responder.preference_order.get(proposer_uuid, -1) for proposer_uuid in held]
+                heapify(held_ranks)
+                for proposer_uuid, preference_rank in sorted(responder.preference_order.items(), key=itemgetter(1),
+                                                             reverse=True):
+                    rank_to_beat = -1 if len(held_ranks) < responder.capacity else held_ranks[0]
+                    if preference_rank <= rank_to_beat:
+                        break
+                    proposer = self.proposer_uuid_dict.get(proposer_uuid)
+                    if proposer_uuid in held or proposer is None:
+                        continue
+                    if sent_back_to.get(proposer_uuid) == responder_uuid:
+                        position = proposer.last_proposed_to + 1
+                    else:
+                        self.spend_rematch_budget(proposer.last_proposed_to + 1)
+                        try:
+                            position = proposer.proposal_order.index(responder_uuid, 0, proposer.last_proposed_to + 1)
+                        except ValueError:
+                            # never proposed to the responder, he will if he gets that far
+                            continue
+
+                    if len(held_ranks) < responder.capacity:
+                        heappush(held_ranks, preference_rank)
+                    else:
+                        heapreplace(held_ranks, preference_rank)
+                    if sent_back_to.get(proposer_uuid) == responder_uuid:
+                        continue
+                    if proposer_uuid in sent_back_to:
+                        # sent back further, the responder that counted on his return has to look again
+                        pending_responder_uuid.append(sent_back_to[proposer_uuid])
+                    sent_back_to[proposer_uuid] = responder_uuid
+                    if proposer.matched_to is not None:
+                        self.responder_uuid_dict[proposer.matched_to].release(proposer_uuid)
+                        pending_responder_uuid.append(proposer.matched_to)
+                        left_responder_uuid.add(proposer.matched_to)
+                        proposer.matched_to = None
+                    previous_position.setdefault(proposer_uuid, proposer.last_proposed_to)
+                    proposer.last_proposed_to = position - 1
+                    self.unmatched_proposer_uuid.add(proposer_uuid)
+        except RematchBudgetExceeded as exceeded:
+            exceeded.proposer_uuid.update(previous_position)
+            exceeded.responder_uuid.update(left_responder_uuid)
+            raise
+        return previous_position, left_responder_uuid
+
+    def restore_proposer_optimality(self, responder_uuids: Set[int]) -> Tuple[Set[int], Set[int]]:
+        """
+        make a stable matching proposer-optimal by eliminating responder-side rotations (Gusfield and Irving), with
+        each seat of a responder taken as a single-seat copy of it and copies ordered by the rank of their holders.
+        A seat points to the seat held by the first proposer the responder ranks below the seat's holder who would
+        rather have it; a cycle of seats is a rotation, and moving every proposer on it to the seat that points at his
+        keeps the matching stable and makes each of them better off. The matching is proposer-optimal once no cycle is
+        left, and a cycle created by a change has to go through a responder whose seats point differently, so the
+        search starts from the responders of the changed part of the matching
+        :param responder_uuids: responders whose seats may point differently than in the last proposer-optimal matching
+        :return: uuids of proposers moved and of responders whose held proposers changed
+        """
+        ranked: Dict[int, Tuple[List[int], List[int]]] = dict()
+        preferred: Dict[int, Set[int]] = dict()
+        holders: Dict[int, List[int]] = dict()
+
+        def ranked_proposers(responder_uuid: int) -> Tuple[List[int], List[int]]:
+            # proposer_uuid and rank, from least to most preferred; preference orders are built in that order already
+            if responder_uuid not in ranked:
+                preference_order = self.responder_uuid_dict[responder_uuid].preference_order
+                self.spend_rematch_budget(len(preference_order))
+                order, ranks = list(preference_order), list(preference_order.values())
+                if ranks != sorted(ranks):
+                    order = sorted(order, key=preference_order.__getitem__)
+                    ranks = sorted(ranks)
+                ranked[responder_uuid] = order, ranks
+            return ranked[responder_uuid]
+
+        def preferred_responders(proposer: Proposer) -> Set[int]:
+            # responders he proposed to and would rather have than his seat, i.e. any of them if he has none
+            if proposer.uuid not in preferred:
+                self.spend_rematch_budget(proposer.last_proposed_to + 1)
+                preferred[proposer.uuid] = set(proposer.proposal_order[:proposer.last_proposed_to +
+                                                                       (proposer.matched_to is None)])
+            return preferred[proposer.uuid]
+
+        def seat_holders(responder_uuid: int) -> List[int]:
+            if responder_uuid not in holders:
+                responder = self.responder_uuid_dict[responder_uuid]
+                holders[responder_uuid] = sorted(responder.held_proposers(), reverse=True,
+                                                 key=lambda proposer_uuid: responder.preference_order[proposer_uuid])
+            return holders[responder_uuid]
+
+        def next_seat(seat: Tuple[int, int]) -> Optional[Tuple[Tuple[int, int], int]]:
+            responder_uuid, index = seat
+            holding = seat_holders(responder_uuid)
+            order, ranks = ranked_proposers(responder_uuid)
+            holder_rank = self.responder_uuid_dict[responder_uuid].preference_order[holding[index]]
+            first_index = bisect_left(ranks, holder_rank) - 1
+            step, order_index = None, 0
+            for order_index in range(first_index, -1, -1):
+                proposer_uuid = order[order_index]
+                if index + 1 < len(holding) and proposer_uuid == holding[index + 1]:
+                    step = (responder_uuid, index + 1), proposer_uuid
+                    break
+                proposer = self.proposer_uuid_dict.get(proposer_uuid)
+                if proposer is None or responder_uuid not in preferred_responders(proposer):
+                    continue
+                # if he is unmatched he would take the seat, so no rotation moves its holder down past him
+                if proposer.matched_to is not None:
+                    step = (proposer.matched_to, seat_holders(proposer.matched_to).index(proposer_uuid)), \
+                        proposer_uuid
+                break
+            self.spend_rematch_budget(first_index - order_index + 1)
+            return step
+
+        moved_proposer_uuid, rotated_responder_uuid = set(), set()
+        pending_responder_uuid = {uuid for uuid in responder_uuids if uuid in self.responder_uuid_dict}
+        # seats from which no cycle can be reached in the current matching
+        dead_end = set()
+        try:
+            while pending_responder_uuid:
+                start_uuid = pending_responder_uuid.pop()
+                for start_index in range(len(seat_holders(start_uuid))):
+                    path, path_index = [], dict()
+                    seat = (start_uuid, start_index)
+                    while seat is not None and seat not in path_index and seat not in dead_end:
+                        path_index[seat] = len(path)
+                        step = next_seat(seat)
+                        path.append((seat, None if step is None else step[1]))
+                        seat = None if step is None else step[0]
+                    if seat is None or seat in dead_end:
+                        dead_end.update(path_index)
+                        continue
+
+                    rotation = path[path_index[seat]:]
+                    leaving, joining = dict(), dict()
+                    for (responder_uuid, index), proposer_uuid in rotation:
+                        leaving.setdefault(responder_uuid, []).append(seat_holders(responder_uuid)[index])
+                        joining.setdefault(responder_uuid, []).append(proposer_uuid)
+                    for (responder_uuid, _), proposer_uuid in rotation:
+                        proposer = self.proposer_uuid_dict[proposer_uuid]
+                        previous_position = proposer.last_proposed_to
+                        proposer.matched_to = responder_uuid
+                        proposer.last_proposed_to = proposer.proposal_order.index(responder_uuid)
+                        # he no longer wants the responders between his new and his previous seat
+                        pending_responder_uuid.update(
+                            proposer.proposal_order[proposer.last_proposed_to:previous_position + 1])
+                        preferred.pop(proposer_uuid, None)
+                        moved_proposer_uuid.add(proposer_uuid)
+                    for responder_uuid, leaving_uuids in leaving.items():
+                        kept = [proposer_uuid for proposer_uuid in seat_holders(responder_uuid)
+                                if proposer_uuid not in leaving_uuids]
+                        self.responder_uuid_dict[responder_uuid].hold(kept + joining[responder_uuid])
+                        del holders[responder_uuid]
+                    rotated_responder_uuid.update(leaving)
+                    pending_responder_uuid.update(leaving)
+                    pending_responder_uuid.add(start_uuid)
+                    dead_end.clear()
+                    break
+        except RematchBudgetExceeded as exceeded:
+            exceeded.proposer_uuid.update(moved_proposer_uuid)
+            exceeded.responder_uuid.update(rotated_responder_uuid)
+            raise
+        return moved_proposer_uuid, rotated_responder_uuid
+
+    def checkpoint(self, path: str) -> None:
+        """
+        write the matching state, not the preferences, as columns of an uncompressed .npz file: last_proposed_to and
+        matched_to of each proposer, the (responder, proposer) pair of every held seat, the unmatched set and
+        proposal_count; NO_UUID stands in for None
+        :param path: file to write, used as given without appending .npz
+        """
+        proposers = list(self.proposer_uuid_dict.values())
+        held_pairs = [(responder.uuid, proposer_uuid) for responder in self.responder_uuid_dict.values()
+                      for proposer_uuid in responder.held_proposers()]
+        with open(path, "wb") as checkpoint_file:
+            np.savez(checkpoint_file,
+                     version=np.array([self.CHECKPOINT_VERSION]),
+                     proposer_uuid=np.array([proposer.uuid for proposer in proposers], dtype=np.int64),
+                     last_proposed_to=np.array([proposer.last_proposed_to for proposer in proposers], dtype=np.int32),
+                     proposer_matched_to=np.array([self.NO_UUID if proposer.matched_to is None else proposer.matched_to
+                                                   for proposer in proposers], dtype=np.int64),
+                     responder_uuid=np.array(list(self.responder_uuid_dict), dtype=np.int64),
+                     held_pairs=np.array(held_pairs, dtype=np.int64).reshape(len(held_pairs), 2),
+                     unmatched_proposer_uuid=np.array(list(self.unmatched_proposer_uuid), dtype=np.int64),
+                     proposal_count=np.array([self.proposal_count], dtype=np.int64))
+
+    def resume(self, path: str) -> None:
+        """
+        restore the matching state written by checkpoint() into this market, which must have the same participants
+        and preferences registered; the order unmatched proposers move in is not saved, so with strict preferences the
+        resumed market reaches the same stable matching, while with ties responders may break them differently
+        :param path: file written by checkpoint()
+        """
+        with np.load(path) as columns:
+            if int(columns["version"][0]) != self.CHECKPOINT_VERSION:
+                raise ValueError("Unsupported checkpoint version %d" % int(columns["version"][0]))
+            proposer_uuids = columns["proposer_uuid"].tolist()
+            if set(proposer_uuids) != set(self.proposer_uuid_dict) or \
+                    set(columns["responder_uuid"].tolist()) != set(self.responder_uuid_dict):
+                raise ValueError("Checkpoint %s does not match the participants of the market" % path)
+
+            for proposer_uuid, last_proposed_to, matched_to in zip(proposer_uuids, columns["last_proposed_to"].tolist(),
+                                                                   columns["proposer_matched_to"].tolist()):
+                proposer = self.proposer_uuid_dict[proposer_uuid]
+                proposer.last_proposed_to = last_proposed_to
+                proposer.matched_to = None if matched_to == self.NO_UUID else matched_to
+            for responder in self.responder_uuid_dict.values():
+                responder.clear_held()
+            for responder_uuid, proposer_uuid in columns["held_pairs"].tolist():
+                responder = self.responder_uuid_dict[responder_uuid]
+                if responder.capacity > 1:
+                    heappush(responder.held, (responder.preference_order.get(proposer_uuid, -1), proposer_uuid))
+                else:
+                    responder.matched_to = proposer_uuid
+            self.unmatched_proposer_uuid = set(columns["unmatched_proposer_uuid"].tolist())
+            self.proposal_count = int(columns["proposal_count"][0])
 
     def interpret_proposal_outcome(self, proposal_outcome: Proposal) -> List[str]:
         """
@@ -223,13 +1112,14 @@ class Market:
         using uuid, describe matching situations among proposers and responders under current snapshot
         :return: (1) number of proposals that have been made
                 (2) pairs of (proposer_uuid, responder_uuid) representing matching in current snapshot;
-                    None stood in for unmatched proposer or responder
+                    None stood in for unmatched proposer or responder; a responder with several seats appears once
+                    with each proposer it holds and once as (None, responder_uuid) if it still has free seats
         """
         market_description = []
         for _, proposer in self.proposer_uuid_dict.items():
             market_description.append((proposer.uuid, proposer.matched_to))
         for _, responder in self.responder_uuid_dict.items():
-            if responder.matched_to is None:
+            if responder.vacancies():
                 market_description.append((None, responder.uuid))
         return self.proposal_count, market_description
 
@@ -246,6 +1136,6 @@ class Market:
             else:
                 market_description.append('%s matched to %s' % (proposer.name, None))
         for _, responder in self.responder_uuid_dict.items():
-            if responder.matched_to is None:
+            if responder.vacancies():
                 market_description.append(('%s matched to %s' % (None, responder.name)))
         return self.proposal_count, market_description
@@ -0,0 +1,345 @@
+"""
+Asyncio front end of a Market run as a service: registrations and preference submissions arriving concurrently are
+queued and applied in batches, deferred acceptance runs on the event loop in cooperative chunks of proposals, and
+snapshots are served as deltas read from a change log instead of rescanning every participant
+"""
+import asyncio
+from collections import namedtuple
+from itertools import islice
+from typing import Dict, List, Optional, Set, Tuple
+
+from Deferred_Acceptance_Entity import Proposal
+from Deferred_Acceptance_Instrumentation import InstrumentationSink
+from Deferred_Acceptance_Market import Market
+
+IntakeRequest = namedtuple("IntakeRequest", "kind arguments future")
+# proposers: matched_to of every proposer changed since the version asked for; responders: number of free seats of
+# every responder changed since then; is_full: whether every participant is listed because the version was too old
+SnapshotDelta = namedtuple("SnapshotDelta", "version proposal_count proposers responders is_full")
+
+REGISTER_PROPOSER = "register_proposer"
+REGISTER_RESPONDER = "register_responder"
+PROPOSER_PREFERENCE = "proposer_preference"
+RESPONDER_PREFERENCE = "responder_preference"
+
+
+class ChangeLog(InstrumentationSink):
+    """
+    append-only log of participants whose snapshot entry changed; the version of the market is the number of changes
+    ever logged, only the most recent ones are kept
+    """
+
+    def __init__(self, max_entries: int = 1 << 20):
+        """
+        :param max_entries: number of changes kept; clients asking for older versions get a full snapshot
+        """
+        self.max_entries = max_entries
+        self.first_version = 0
+        # (is_responder, uuid) of each change
+        self.entries: List[Tuple[bool, int]] = []
+
+    @property
+    def version(self) -> int:
+        return self.first_version + len(self.entries)
+
+    def record(self, is_responder: bool, uuid: int) -> None:
+        self.entries.append((is_responder, uuid))
+        if len(self.entries) > self.max_entries:
+            dropped = len(self.entries) // 2
+            del self.entries[:dropped]
+            self.first_version += dropped
+
+    def on_proposal(self, proposal: Proposal, unmatched_count: int) -> None:
+        _, proposer_uuid, responder_uuid, rejected_uuid = proposal
+        if rejected_uuid is None:
+            self.record(False, proposer_uuid)
+            self.record(True, responder_uuid)
+        elif rejected_uuid != proposer_uuid:
+            self.record(False, proposer_uuid)
+            self.record(False, rejected_uuid)
+
+    def changed_since(self, version: int) -> Optional[Tuple[Set[int], Set[int]]]:
+        """
+        :param version: version returned by an earlier snapshot
+        :return: uuids of proposers and of responders changed since then, None if those changes are no longer kept
+        """
+        if version < self.first_version or version > self.version:
+            return None
+        proposer_uuids, responder_uuids = set(), set()
+        for is_responder, uuid in self.entries[version - self.first_version:]:
+            (responder_uuids if is_responder else proposer_uuids).add(uuid)
+        return proposer_uuids, responder_uuids
+
+
+class MarketService:
+    """
+    owner of one Market on an event loop; every mutation goes through the intake queue, so neither the intake batches
+    nor the proposal chunks need a lock
+    """
+
+    def __init__(self, market: Market = None, batch_size: int = 1024, chunk_proposals: int = 1000,
+                 max_log_entries: int = 1 << 20):
+        """
+        :param market: market to serve; if None an empty Market
+        :param batch_size: largest number of queued requests applied as one bulk update
+        :param chunk_proposals: number of proposals made before yielding to the event loop
+        :param max_log_entries: number of changes kept for snapshot deltas
+        """
+        self.market = market if market is not None else Market()
+        self.batch_size = batch_size
+        self.chunk_proposals = chunk_proposals
+        self.change_log = ChangeLog(max_log_entries)
+        sinks = list(self.market.instrumentation.sinks) if self.market.instrumentation is not None else []
+        self.market.enable_instrumentation(sinks + [self.change_log])
+        # preference requests applied by apply_batch() whose update the matching loop has yet to make
+        self.pending_preference_requests: List[IntakeRequest] = []
+        self.queue: Optional[asyncio.Queue] = None
+        self.has_work: Optional[asyncio.Event] = None
+        self.is_stable: Optional[asyncio.Event] = None
+        self.tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """
+        start the intake and matching tasks on the running event loop
+        """
+        self.queue = asyncio.Queue()
+        self.has_work = asyncio.Event()
+        self.is_stable = asyncio.Event()
+        if self.has_pending_work():
+            self.has_work.set()
+        else:
+            self.is_stable.set()
+        self.tasks = [asyncio.create_task(self.intake_loop()), asyncio.create_task(self.matching_loop())]
+
+    async def stop(self) -> None:
+        """
+        cancel the intake and matching tasks; requests still queued are never applied
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def __aenter__(self) -> 'MarketService':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.stop()
+
+    async def submit(self, kind: str, *arguments):
+        """
+        :param kind: REGISTER_PROPOSER, REGISTER_RESPONDER, PROPOSER_PREFERENCE or RESPONDER_PREFERENCE
+        :param arguments: arguments of the matching Market method
+        :return: result of the request once its batch is applied
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(IntakeRequest(kind, arguments, future))
+        return await future
+
+    async def register_proposer(self, name: str = None, uuid: int = None, strict_preference: List[int] = None) -> int:
+        return await self.submit(REGISTER_PROPOSER, name, uuid, strict_preference)
+
+    async def register_responder(self, name: str = None, uuid: int = None, capacity: int = 1,
+                                 strict_preference: List[int] = None) -> int:
+        return await self.submit(REGISTER_RESPONDER, name, uuid, capacity, strict_preference)
+
+    async def submit_proposer_preference(self, uuid: int, strict_preference: List[int]) -> None:
+        await self.submit(PROPOSER_PREFERENCE, uuid, strict_preference)
+
+    async def submit_responder_preference(self, uuid: int, strict_preference: List[int]) -> None:
+        await self.submit(RESPONDER_PREFERENCE, uuid, strict_preference)
+
+    def has_pending_work(self) -> bool:
+        """
+        :return: whether a preference update or a proposal is still to be made
+        """
+        return bool(self.pending_preference_requests) or self.market.has_more_proposal()
+
+    def apply_batch(self, batch: List[IntakeRequest]) -> None:
+        """
+        apply queued registrations and check queued preferences, each list only naming participants registered by
+        then; the preferences are left to the matching loop, which applies them as one bulk update in chunks of
+        proposals, see apply_preferences(), so no proposal is made here
+        """
+        market = self.market
+        for request in batch:
+            try:
+                if request.kind == REGISTER_PROPOSER:
+                    name, uuid, strict_preference = request.arguments
+                    if strict_preference is not None:
+                        self.check_listed(strict_preference, market.responder_uuid_dict)
+                    uuid = market.register_proposer(name, uuid)
+                    self.change_log.record(False, uuid)
+                    if strict_preference is not None:
+                        self.pending_preference_requests.append(
+                            IntakeRequest(PROPOSER_PREFERENCE, (uuid, strict_preference), None))
+                    request.future.set_result(uuid)
+                elif request.kind == REGISTER_RESPONDER:
+                    name, uuid, capacity, strict_preference = request.arguments
+                    if strict_preference is not None:
+                        self.check_listed(strict_preference, market.proposer_uuid_dict)
+                    uuid = market.register_responder(name, uuid, capacity)
+                    self.change_log.record(True, uuid)
+                    if strict_preference is not None:
+                        self.pending_preference_requests.append(
+                            IntakeRequest(RESPONDER_PREFERENCE, (uuid, strict_preference), None))
+                    request.future.set_result(uuid)
+                elif request.kind in (PROPOSER_PREFERENCE, RESPONDER_PREFERENCE):
+                    participants, listed = (market.proposer_uuid_dict, market.responder_uuid_dict) \
+                        if request.kind == PROPOSER_PREFERENCE else \
+                        (market.responder_uuid_dict, market.proposer_uuid_dict)
+                    if request.arguments[0] not in participants:
+                        raise KeyError(request.arguments[0])
+                    self.check_listed(request.arguments[1], listed)
+                    self.pending_preference_requests.append(request)
+                else:
+                    raise ValueError("Unknown request %s" % request.kind)
+            except Exception as error:
+                if not request.future.done():
+                    request.future.set_exception(error)
+
+    @staticmethod
+    def check_listed(strict_preference: List[int], participants: Dict[int, object]) -> None:
+        """
+        :param strict_preference: uuids listed by a preference
+        :param participants: participants the uuids have to belong to
+        :raise KeyError: with the first uuid not registered
+        """
+        for uuid in strict_preference:
+            if uuid not in participants:
+                raise KeyError(uuid)
+
+    async def apply_preferences(self) -> None:
+        """
+        apply every pending preference as one bulk update through Market.iter_update_preferences(), which re-matches
+        the market in place from a warm start, yielding to the event loop between chunks of its proposals; requests
+        fail with the exception of the update if it raises
+        """
+        requests, self.pending_preference_requests = self.pending_preference_requests, []
+        proposer_preferences, responder_preferences = dict(), dict()
+        for request in requests:
+            preferences = proposer_preferences if request.kind == PROPOSER_PREFERENCE else responder_preferences
+            preferences[request.arguments[0]] = request.arguments[1]
+        updating = self.market.iter_update_preferences(proposer_preferences, responder_preferences)
+        try:
+            while True:
+                for _ in range(self.chunk_proposals):
+                    next(updating)
+                await asyncio.sleep(0)
+        except StopIteration as finished:
+            changed_proposer_uuid, changed_responder_uuid = finished.value
+        except Exception as error:
+            for request in requests:
+                if request.future is not None and not request.future.done():
+                    request.future.set_exception(error)
+            return
+        for uuid in changed_proposer_uuid:
+            self.change_log.record(False, uuid)
+        for uuid in changed_responder_uuid:
+            self.change_log.record(True, uuid)
+        for request in requests:
+            if request.future is not None and not request.future.done():
+                request.future.set_result(None)
+
+    async def intake_loop(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self.apply_batch(batch)
+            if self.has_pending_work():
+                self.is_stable.clear()
+                self.has_work.set()
+            for _ in batch:
+                self.queue.task_done()
+
+    async def matching_loop(self) -> None:
+        while True:
+            await self.has_work.wait()
+            while self.has_pending_work():
+                if self.pending_preference_requests:
+                    await self.apply_preferences()
+                else:
+                    for _ in islice(self.market.stream_proposals(), self.chunk_proposals):
+                        pass
+                # let intake batches and snapshot queries in between chunks
+                await asyncio.sleep(0)
+            self.has_work.clear()
+            self.is_stable.set()
+
+    async def wait_until_stable(self) -> None:
+        """
+        wait until every queued request is applied and no proposer wants to make another proposal
+        """
+        while True:
+            await self.queue.join()
+            await self.is_stable.wait()
+            if self.queue.empty() and not self.has_pending_work():
+                return
+
+    def snapshot(self, since_version: int = None) -> SnapshotDelta:
+        """
+        :param since_version: version of a previous snapshot; if None, or if its changes are no longer kept, every
+            participant is listed
+        :return: SnapshotDelta of the participants changed since then, in O(changes)
+        """
+        market = self.market
+        changed = self.change_log.changed_since(since_version) if since_version is not None else None
+        is_full = changed is None
+        proposer_uuids, responder_uuids = (market.proposer_uuid_dict, market.responder_uuid_dict) if is_full else \
+            changed
+        proposers = {uuid: market.proposer_uuid_dict[uuid].matched_to
+                     for uuid in proposer_uuids if uuid in market.proposer_uuid_dict}
+        responders = {uuid: market.responder_uuid_dict[uuid].vacancies()
+                      for uuid in responder_uuids if uuid in market.responder_uuid_dict}
+        return SnapshotDelta(self.change_log.version, market.proposal_count, proposers, responders, is_full)
+
+
+class LocalMarketClient:
+    """
+    in-process client of a MarketService, keeping a mirror of the matching up to date through snapshot deltas
+    """
+
+    def __init__(self, service: MarketService):
+        self.service = service
+        self.version: Optional[int] = None
+        self.proposal_count = 0
+        self.proposer_matched_to: Dict[int, Optional[int]] = dict()
+        self.responder_vacancies: Dict[int, int] = dict()
+
+    async def register_proposer(self, name: str = None, uuid: int = None, strict_preference: List[int] = None) -> int:
+        return await self.service.register_proposer(name, uuid, strict_preference)
+
+    async def register_responder(self, name: str = None, uuid: int = None, capacity: int = 1,
+                                 strict_preference: List[int] = None) -> int:
+        return await self.service.register_responder(name, uuid, capacity, strict_preference)
+
+    async def submit_proposer_preference(self, uuid: int, strict_preference: List[int]) -> None:
+        await self.service.submit_proposer_preference(uuid, strict_preference)
+
+    async def submit_responder_preference(self, uuid: int, strict_preference: List[int]) -> None:
+        await self.service.submit_responder_preference(uuid, strict_preference)
+
+    async def wait_until_stable(self) -> None:
+        await self.service.wait_until_stable()
+
+    async def refresh(self) -> SnapshotDelta:
+        """
+        :return: delta applied to the mirror, fetched since the version of the previous refresh
+        """
+        delta = self.service.snapshot(self.version)
+        if delta.is_full:
+            self.proposer_matched_to, self.responder_vacancies = dict(), dict()
+        self.proposer_matched_to.update(delta.proposers)
+        self.responder_vacancies.update(delta.responders)
+        self.version, self.proposal_count = delta.version, delta.proposal_count
+        return delta
+
+    def market_snapshot_uuid(self) -> Tuple[int, List[Tuple[Optional[int], Optional[int]]]]:
+        """
+        :return: mirror of the matching as of the last refresh, in the format of Market.market_snapshot_uuid()
+        """
+        market_description = list(self.proposer_matched_to.items())
+        market_description.extend((None, uuid) for uuid, vacancies in self.responder_vacancies.items() if vacancies)
+        return self.proposal_count, market_description
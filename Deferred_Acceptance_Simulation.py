@@ -0,0 +1,173 @@
+"""
+Monte Carlo tie-breaking for markets with weak preferences: every draw breaks ties among indifferent options at random
+and runs deferred acceptance; draws run in a process pool sharing the base preference arrays read-only
+"""
+import multiprocessing
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from Deferred_Acceptance_Engine import MatchingEngine, PreferenceTable
+
+SINGLE_TIE_BREAKING = "single"
+MULTIPLE_TIE_BREAKING = "multiple"
+
+
+class TieGroups:
+    """
+    entries of a preference table sharing their rank with another entry of the same row, grouped by (row, rank);
+    computed once per market so that each draw only sorts tied entries
+    """
+    __slots__ = ("entries", "group", "position_in_group", "lower_in_row")
+
+    def __init__(self, table: PreferenceTable):
+        """
+        :param table: preference table whose ranks may contain ties
+        """
+        rows = table.row_of_entries()
+        entry_order = np.lexsort((table.ranks, rows))
+        sorted_rows, sorted_ranks = rows[entry_order], table.ranks[entry_order]
+        same_as_previous = np.zeros(len(entry_order), dtype=bool)
+        same_as_previous[1:] = (sorted_rows[1:] == sorted_rows[:-1]) & (sorted_ranks[1:] == sorted_ranks[:-1])
+        position = np.arange(len(entry_order))
+        group_first = np.maximum.accumulate(np.where(same_as_previous, 0, position))
+
+        # number of entries of the same row ranked lower, in ascending rank order
+        self.lower_in_row = np.empty(len(entry_order), dtype=np.int32)
+        self.lower_in_row[entry_order] = group_first - table.offsets[sorted_rows]
+
+        is_tied = same_as_previous.copy()
+        is_tied[:-1] |= same_as_previous[1:]
+        self.entries = entry_order[is_tied]
+        self.group = np.cumsum(~same_as_previous)[is_tied]
+        self.position_in_group = (position - group_first)[is_tied]
+
+    def shuffled(self, tie_key: np.ndarray) -> np.ndarray:
+        """
+        :param tie_key: random key of each tied entry
+        :return: tied entries, each group reordered by ascending tie_key
+        """
+        return self.entries[np.lexsort((tie_key, self.group))]
+
+
+class TieBreakingDraws:
+    """
+    random strict versions of a market with weak preferences
+    """
+
+    def __init__(self, engine: MatchingEngine):
+        """
+        :param engine: engine of the market with weak preferences, proposer table ranks holding tie tiers
+        """
+        self.engine = engine
+        self.proposer_ties = TieGroups(engine.proposer_preference)
+        responder_preference = engine.responder_preference
+        self.responder_ties = TieGroups(responder_preference)
+        # strict ranks consistent with the weak ones; tied entries get their group's lowest rank plus a random offset
+        self.responder_base_rank = self.responder_ties.lower_in_row
+        self.responder_tie_base = self.responder_base_rank[self.responder_ties.entries]
+
+    def draw(self, seed: int, tie_breaking: str = SINGLE_TIE_BREAKING) -> MatchingEngine:
+        """
+        :param seed: seed of the random draw
+        :param tie_breaking: "single" ranks indifferent proposers by one lottery shared by all responders,
+            "multiple" draws a separate lottery for each responder
+        :return: engine with strict preferences, ties of both sides broken at random
+        """
+        rng = np.random.default_rng(seed)
+        engine = self.engine
+
+        # proposers: shuffle entries among the slots of their tie tier
+        proposal_permutation = np.arange(len(engine.proposal_order))
+        proposal_permutation[self.proposer_ties.entries] = self.proposer_ties.shuffled(
+            rng.random(len(self.proposer_ties.entries)))
+
+        # responders: the better lottery number within a tie gets the higher rank
+        responder_preference = engine.responder_preference
+        if tie_breaking == SINGLE_TIE_BREAKING:
+            lottery = rng.random(engine.count_proposer)[responder_preference.indices[self.responder_ties.entries]]
+        elif tie_breaking == MULTIPLE_TIE_BREAKING:
+            lottery = rng.random(len(self.responder_ties.entries))
+        else:
+            raise ValueError("Unknown tie breaking %s" % tie_breaking)
+        responder_ranks = self.responder_base_rank.copy()
+        tie_order = np.lexsort((lottery, self.responder_ties.group))
+        responder_ranks[self.responder_ties.entries[tie_order]] = \
+            self.responder_tie_base[tie_order] + self.responder_ties.position_in_group
+
+        return engine.with_preference_ranks(proposal_permutation, responder_ranks)
+
+    def count_assignments(self, seeds: List[int], tie_breaking: str = SINGLE_TIE_BREAKING) -> Tuple[np.ndarray,
+                                                                                                    np.ndarray]:
+        """
+        run one draw per seed and count how often each pair is matched
+        :param seeds: seeds of the draws
+        :param tie_breaking: see draw()
+        :return: pair keys proposer * (count_responder + 1) + responder, count_responder standing for unmatched,
+            and number of draws in which each pair was matched
+        """
+        count_responder = self.engine.count_responder
+        proposer_key = np.arange(self.engine.count_proposer, dtype=np.int64) * (count_responder + 1)
+        keys = []
+        for seed in seeds:
+            draw = self.draw(seed, tie_breaking)
+            draw.run_rounds()
+            keys.append(proposer_key + np.where(draw.proposer_matched_to == MatchingEngine.NO_MATCH, count_responder,
+                                                draw.proposer_matched_to))
+        return np.unique(np.concatenate(keys) if keys else np.empty(0, dtype=np.int64), return_counts=True)
+
+
+# draws of the market being simulated; inherited by forked workers instead of being pickled per task
+shared_draws: Optional[TieBreakingDraws] = None
+
+
+def install_shared_draws(draws: Optional[TieBreakingDraws]) -> None:
+    """
+    :param draws: draws every worker task samples from
+    """
+    global shared_draws
+    shared_draws = draws
+
+
+def count_assignments_task(task: Tuple[List[int], str]) -> Tuple[np.ndarray, np.ndarray]:
+    seeds, tie_breaking = task
+    return shared_draws.count_assignments(seeds, tie_breaking)
+
+
+def simulate_tie_breaking(market, seeds: Iterable[int], tie_breaking: str = SINGLE_TIE_BREAKING,
+                          processes: int = None) -> Dict[Tuple[int, Optional[int]], float]:
+    """
+    estimate assignment probabilities of a market with weak preferences by running one deferred acceptance per seed
+    :param market: Market whose participants and (weak) preferences are registered
+    :param seeds: one seed per random draw of tie-breaking
+    :param tie_breaking: "single" or "multiple", see TieBreakingDraws.draw()
+    :param processes: number of worker processes; if None one per CPU, if 1 draws run in the calling process
+    :return: frequency of each (proposer_uuid, responder_uuid) pair over the draws; responder_uuid None stands for
+        proposer staying unmatched
+    """
+    seeds = list(seeds)
+    engine = market.build_engine()
+    draws = TieBreakingDraws(engine)
+    processes = processes if processes else multiprocessing.cpu_count()
+
+    if processes == 1 or len(seeds) <= 1:
+        keys, counts = draws.count_assignments(seeds, tie_breaking)
+    else:
+        chunk_count = min(len(seeds), processes * 4)
+        tasks = [(seeds[chunk::chunk_count], tie_breaking) for chunk in range(chunk_count)]
+        if "fork" in multiprocessing.get_all_start_methods():
+            # workers inherit the preference arrays copy-on-write from the parent, nothing is pickled per task
+            install_shared_draws(draws)
+            pool = multiprocessing.get_context("fork").Pool(processes)
+        else:
+            pool = multiprocessing.Pool(processes, initializer=install_shared_draws, initargs=(draws,))
+        with pool:
+            results = pool.map(count_assignments_task, tasks)
+        install_shared_draws(None)
+        keys, inverse = np.unique(np.concatenate([result_keys for result_keys, _ in results]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([result_counts for _, result_counts in results]))
+
+    proposer_uuids = engine.proposer_uuids.tolist()
+    responder_uuids = engine.responder_uuids.tolist() + [None]
+    return {(proposer_uuids[key // (engine.count_responder + 1)], responder_uuids[key % (engine.count_responder + 1)]):
+            count / len(seeds) for key, count in zip(keys.tolist(), counts.tolist())}
@@ -12,3 +12,502 @@ for _ in range(5):
 
 test_proposer.set_strict_preference(test_preference + [2])
 assert not test_proposer.validate([1], [2, 3, 9, 10, 11])
+
+
+from Deferred_Acceptance_Market import Market
+
+
+def build_marriage_market() -> Market:
+    marriage_market = Market()
+    for _ in range(3):
+        marriage_market.register_proposer()
+        marriage_market.register_responder()
+    for proposer_uuid, proposal_order in {1: [1001, 1002, 1003], 2: [1003, 1002, 1001], 3: [1003, 1001, 1002]}.items():
+        marriage_market.register_proposer_strict_preference(proposer_uuid, proposal_order)
+    for responder_uuid, preference in {1001: [2, 3, 1], 1002: [2, 3, 1], 1003: [2, 1, 3]}.items():
+        marriage_market.register_responder_strict_preference(responder_uuid, preference)
+    return marriage_market
+
+
+sequential_market = build_marriage_market()
+engine_market = build_marriage_market()
+assert sequential_market.run_to_completion() == engine_market.run_to_completion(mode="engine") == 5
+assert sequential_market.market_snapshot_uuid() == engine_market.market_snapshot_uuid()
+assert sorted(engine_market.market_snapshot_uuid()[1]) == [(1, 1002), (2, 1003), (3, 1001)]
+assert not engine_market.has_more_proposal()
+
+rounds_market = build_marriage_market()
+assert rounds_market.run_to_completion(mode="rounds") == 5
+assert rounds_market.market_snapshot_uuid() == engine_market.market_snapshot_uuid()
+
+invalid_market = build_marriage_market()
+invalid_market.register_proposer_strict_preference(1, [1001, 1001, 1002])
+invalid_market.register_proposer_strict_preference(2, [1001, 9999])
+invalid_market.register_responder_strict_preference(1003, [1, 8888])
+bool_market, bool_proposer, bool_responder, error_counts, error_messages = invalid_market.validation_report()
+assert bool_market and not bool_proposer and not bool_responder and len(error_messages) == 3
+assert error_counts == {"duplicate responder in proposal order": 1, "unknown responder in proposal order": 1,
+                        "unknown proposer in preference order": 1}
+assert invalid_market.test_valid_market_setup()[3].startswith("Proposer Proposer 1 is incorrect")
+assert build_marriage_market().test_valid_market_setup() == (True, True, True, None)
+assert build_marriage_market().build_engine().validation_report()[:4] == (True, True, True, {})
+
+import numpy as np
+
+matrix_market = Market.from_preference_matrix(np.array([[0, 1, 2], [2, 1, 0], [2, 0, 1]]),
+                                              np.array([[1, 2, 0], [1, 2, 0], [1, 0, 2]]),
+                                              proposer_names=["m1", "m2", "m3"])
+assert matrix_market.test_valid_market_setup() == (True, True, True, None)
+assert list(matrix_market.proposer_uuid_dict[2].proposal_order) == [1003, 1002, 1001]
+assert dict(matrix_market.responder_uuid_dict[1003].preference_order) == \
+       build_marriage_market().responder_uuid_dict[1003].preference_order
+assert matrix_market.run_to_completion(mode="engine") == 5
+assert matrix_market.market_snapshot_uuid() == engine_market.market_snapshot_uuid()
+assert matrix_market.market_snapshot_sentences()[1][0] == "m1 matched to Responder 1002"
+
+truncated_market = Market.from_preference_matrix(np.array([[0, -1], [0, 1]]), np.array([[1, -1], [0, 1]]))
+assert truncated_market.run_to_completion() == 2
+assert truncated_market.market_snapshot_uuid() == (2, [(1, None), (2, 1001), (None, 1002)])
+
+from Deferred_Acceptance_Engine import PreferenceTable
+
+short_lists = PreferenceTable.from_padded(np.array([[2, 0, -1], [1, -1, -1]]))
+assert short_lists.offsets.tolist() == [0, 2, 3] and short_lists.indices.tolist() == [2, 0, 1]
+sorted_short_lists = short_lists.sorted_by_index()
+assert sorted_short_lists.indices.tolist() == [0, 2, 1] and sorted_short_lists.ranks.tolist() == [1, 0, 0]
+assert sorted_short_lists.rank_of(0, 2) == 0 and sorted_short_lists.rank_of(1, 0) is None
+assert sorted_short_lists.lookup([0, 1, 1], [0, 1, 2], 3, -1).tolist() == [1, 0, -1]
+assert truncated_market.build_engine().proposal_rank.tolist() == [-1, 0, 0]
+
+csr_market = Market.from_preference_tables(PreferenceTable.from_lengths([1, 2], [0, 0, 1]),
+                                           PreferenceTable.from_lengths([1, 2], [1, 0, 1]))
+assert csr_market.run_to_completion(mode="engine") == 2
+assert csr_market.market_snapshot_uuid() == truncated_market.market_snapshot_uuid()
+assert csr_market.responder_uuid_dict[1002].preference_order.get(1) == 1
+assert csr_market.responder_uuid_dict[1001].preference_order.get(1, -1) == -1
+assert csr_market.validation_report() == csr_market.engine.validation_report()
+duplicate_engine_market = Market.from_preference_matrix(np.array([[0, 0], [1, 0]]), np.array([[0, 1], [1, 0]]),
+                                                        proposer_names=["p1", "p2"])
+duplicate_object_market = Market()
+duplicate_object_market.register_proposer("p1")
+duplicate_object_market.register_proposer("p2")
+duplicate_object_market.register_responder()
+duplicate_object_market.register_responder()
+duplicate_object_market.register_proposer_strict_preference(1, [1001, 1001])
+duplicate_object_market.register_proposer_strict_preference(2, [1002, 1001])
+duplicate_object_market.register_responder_strict_preference(1001, [1, 2])
+duplicate_object_market.register_responder_strict_preference(1002, [2, 1])
+assert duplicate_engine_market.test_valid_market_setup() == duplicate_object_market.test_valid_market_setup() == \
+    (True, False, True, "Proposer p1 is incorrect: 1 duplicate responder uuid(s) in proposal order")
+for out_of_range_proposer, out_of_range_responder in (([[0, 5], [1, 0]], [[0, 1], [1, 0]]),
+                                                      ([[0, 1], [1, 0]], [[0, 7], [1, 0]])):
+    try:
+        Market.from_preference_matrix(np.array(out_of_range_proposer), np.array(out_of_range_responder))
+        raise AssertionError("indices outside the other side of the market must be refused")
+    except ValueError:
+        pass
+
+from Deferred_Acceptance_Entity import CapacityResponder
+
+test_school = CapacityResponder(1001, 'school', capacity=2)
+test_school.set_strict_preference([1, 2, 3])
+assert test_school.respond_to_proposal(3) is None and test_school.respond_to_proposal(2) is None
+assert test_school.vacancies() == 0
+assert test_school.respond_to_proposal(1) == 3 and test_school.respond_to_proposal(3) == 3
+assert sorted(test_school.held_proposers()) == [1, 2]
+
+
+def build_college_market() -> Market:
+    college_market = Market()
+    for _ in range(4):
+        college_market.register_proposer()
+    college_market.register_responder('school', capacity=2)
+    college_market.register_responder('college', capacity=2)
+    for proposer_uuid in range(1, 5):
+        college_market.register_proposer_strict_preference(proposer_uuid, [1001, 1002])
+    college_market.register_responder_strict_preference(1001, [4, 3, 2, 1])
+    college_market.register_responder_strict_preference(1002, [1, 2, 3])
+    return college_market
+
+
+for college_mode in ("sequential", "engine", "rounds"):
+    college_market = build_college_market()
+    assert college_market.run_to_completion(mode=college_mode) == 6
+    assert college_market.market_snapshot_uuid() == (6, [(1, 1002), (2, 1002), (3, 1001), (4, 1001)])
+array_college_market = Market.from_arrays(np.array([[0, 1]] * 4), np.array([[3, 2, 1, 0], [0, 1, 2, -1]]),
+                                          responder_capacity=[2, 2])
+assert array_college_market.run_to_completion() == 6
+assert array_college_market.market_snapshot_uuid() == college_market.market_snapshot_uuid()
+for build_seatless_responder in (lambda: Market().register_responder(capacity=0),
+                                 lambda: Market().add_responder(capacity=-1),
+                                 lambda: Market.from_arrays(np.array([[0, 1]]), np.array([[0], [0]]),
+                                                            responder_capacity=[1, 0])):
+    try:
+        build_seatless_responder()
+        raise AssertionError("a responder without a seat must be refused")
+    except ValueError:
+        pass
+
+from Deferred_Acceptance_Engine import MatchingEngine
+
+for seed in range(200):
+    capacity_rng = np.random.default_rng(seed)
+    count_proposer, count_responder = capacity_rng.integers(2, 12), capacity_rng.integers(1, 6)
+    capacity_engine = MatchingEngine.from_preference_matrix(
+        np.array([capacity_rng.permutation(count_responder) for _ in range(count_proposer)]),
+        np.array([capacity_rng.permutation(count_proposer) for _ in range(count_responder)]),
+        list(range(1, count_proposer + 1)), list(range(1001, 1001 + count_responder)),
+        capacity_rng.integers(1, 4, size=count_responder))
+    while capacity_engine.has_more_proposal():
+        held_before_round = capacity_engine.proposer_matched_to.copy()
+        for proposer, responder, rejected in zip(*capacity_engine.one_round_simultaneous_proposals()):
+            # a displaced proposer must have been held by the responder of the proposal displacing him
+            assert rejected in (proposer, MatchingEngine.NO_MATCH) or held_before_round[rejected] == responder
+
+live_market = build_marriage_market()
+live_market.run_to_completion()
+assert live_market.remove_proposer(3) == ({1}, {1001, 1002})
+assert live_market.market_snapshot_uuid()[1] == [(1, 1001), (2, 1003), (None, 1002)]
+new_proposer_uuid = live_market.add_proposer('late', strict_preference=[1001, 1002])
+live_market.update_responder_preference(1001, [new_proposer_uuid, 1, 2])
+live_market.run_to_completion(mode="engine")
+assert live_market.market_snapshot_uuid()[1] == [(1, 1002), (2, 1003), (new_proposer_uuid, 1001)]
+
+
+
+def build_ring_market(proposal_orders: dict, preferences: dict) -> Market:
+    ring_market = Market()
+    for proposer_uuid in proposal_orders:
+        ring_market.register_proposer(uuid=proposer_uuid)
+    for responder_uuid in preferences:
+        ring_market.register_responder(uuid=responder_uuid)
+    for proposer_uuid, proposal_order in proposal_orders.items():
+        ring_market.register_proposer_strict_preference(proposer_uuid, proposal_order)
+    for responder_uuid, preference in preferences.items():
+        ring_market.register_responder_strict_preference(responder_uuid, preference)
+    ring_market.run_to_completion()
+    return ring_market
+
+
+# every proposer lists responders i and i + 1, so the whole market is one connected component
+ring_rng = np.random.default_rng(7)
+ring_proposal_orders = {uuid: [int(responder_uuid) for responder_uuid in ring_rng.permutation(list(
+    {1000 + uuid, 1001 + uuid % 400} | set(1001 + ring_rng.choice(400, 3, replace=False))))]
+    for uuid in range(1, 401)}
+ring_preferences = {responder_uuid: [] for responder_uuid in range(1001, 1401)}
+for proposer_uuid, proposal_order in ring_proposal_orders.items():
+    for responder_uuid in proposal_order:
+        ring_preferences[responder_uuid].append(proposer_uuid)
+for preference in ring_preferences.values():
+    ring_rng.shuffle(preference)
+ring_market = build_ring_market(ring_proposal_orders, ring_preferences)
+ring_proposal_count = ring_market.proposal_count
+for removed_uuid in (17, 230, 388):
+    changed_proposers, changed_responders = ring_market.remove_proposer(removed_uuid)
+    del ring_proposal_orders[removed_uuid]
+    for preference in ring_preferences.values():
+        if removed_uuid in preference:
+            preference.remove(removed_uuid)
+    assert len(changed_proposers) < 20 and len(changed_responders) < 20
+ring_preferences[1100].reverse()
+assert all(len(changed) < 20 for changed in ring_market.update_responder_preference(1100, ring_preferences[1100]))
+# a handful of proposals redone instead of the whole market, and still the proposer-optimal matching
+assert ring_market.proposal_count - ring_proposal_count < 100
+assert ring_market.market_snapshot_uuid()[1] == \
+       build_ring_market(ring_proposal_orders, ring_preferences).market_snapshot_uuid()[1]
+
+# with complete lists re-matching in place scans more than a fresh run, so the market is solved again instead; an
+# engine-backed market keeps its arrays, patched in place, through every change
+complete_rng = np.random.default_rng(11)
+complete_proposal_orders = {uuid: [int(responder_uuid) for responder_uuid in 1001 + complete_rng.permutation(60)]
+                            for uuid in range(1, 61)}
+complete_preferences = {responder_uuid: [int(proposer_uuid) for proposer_uuid in 1 + complete_rng.permutation(60)]
+                        for responder_uuid in range(1001, 1061)}
+complete_market = Market.from_preference_matrix(
+    np.array([[responder_uuid - 1001 for responder_uuid in order] for order in complete_proposal_orders.values()]),
+    np.array([[proposer_uuid - 1 for proposer_uuid in order] for order in complete_preferences.values()]))
+complete_market.run_to_completion("engine")
+complete_market.remove_proposer(5)
+del complete_proposal_orders[5]
+for preference in complete_preferences.values():
+    preference.remove(5)
+complete_preferences[1030].reverse()
+complete_market.update_responder_preference(1030, complete_preferences[1030])
+complete_proposal_orders[40].reverse()
+complete_market.update_proposer_preference(40, complete_proposal_orders[40])
+complete_rebuilt = build_ring_market(complete_proposal_orders, complete_preferences)
+assert complete_market.engine is not None and complete_market.verify_stability() == []
+assert complete_market.market_snapshot_uuid()[1] == complete_rebuilt.market_snapshot_uuid()[1]
+# the proposals made are those of a single fresh run
+assert complete_market.proposal_count == complete_rebuilt.proposal_count
+
+from Deferred_Acceptance_Simulation import simulate_tie_breaking
+
+lottery_market = Market()
+for _ in range(2):
+    lottery_market.register_proposer()
+    lottery_market.register_responder()
+for proposer_uuid in (1, 2):
+    lottery_market.register_proposer_weak_preference(proposer_uuid, [[1001, 1002]])
+for responder_uuid in (1001, 1002):
+    lottery_market.register_responder_weak_preference(responder_uuid, [[1, 2]])
+assert lottery_market.proposer_uuid_dict[1].proposal_tier == [0, 0]
+assignment_frequency = simulate_tie_breaking(lottery_market, range(200), processes=1)
+assert set(assignment_frequency) == {(1, 1001), (1, 1002), (2, 1001), (2, 1002)}
+assert 0.3 < assignment_frequency[(1, 1001)] < 0.7
+assert abs(assignment_frequency[(1, 1001)] + assignment_frequency[(1, 1002)] - 1) < 1e-9
+assert simulate_tie_breaking(lottery_market, range(20), "multiple", processes=2) == \
+       simulate_tie_breaking(lottery_market, range(20), "multiple", processes=1)
+
+from Deferred_Acceptance_Batch import solve_markets, solve_preference_tables
+
+batch_snapshots = solve_markets([build_marriage_market(), build_college_market(), truncated_market])
+assert batch_snapshots[0] == engine_market.market_snapshot_uuid()
+assert batch_snapshots[1] == (6, [(1, 1002), (2, 1002), (3, 1001), (4, 1001)])
+assert batch_snapshots[2] == truncated_market.market_snapshot_uuid()
+partial_college_market = build_college_market()
+partial_college_market.proposer_make_move(1)
+assert solve_markets([partial_college_market, build_marriage_market()], 1) == batch_snapshots[1::-1]
+assert partial_college_market.market_snapshot_uuid() == batch_snapshots[1]
+assert partial_college_market.verify_stability() == []
+assert solve_preference_tables(PreferenceTable.from_lengths([3, 3, 3, 1, 2], [0, 1, 2, 2, 1, 0, 2, 0, 1, 0, 0, 1]),
+                               PreferenceTable.from_lengths([3, 3, 3, 1, 2], [1, 2, 0, 1, 2, 0, 1, 0, 2, 1, 0, 1]),
+                               np.array([3, 2]), np.array([3, 2])) == \
+       [engine_market.market_snapshot_uuid(), truncated_market.market_snapshot_uuid()]
+
+from Deferred_Acceptance_Instrumentation import CallbackSink, ProposalStatistics
+
+instrumented_market = build_marriage_market()
+round_sizes = []
+instrumented_market.enable_instrumentation([ProposalStatistics(sample_interval=1), CallbackSink(
+    on_round=lambda round_index, proposals, seconds, unmatched_count: round_sizes.append(len(proposals)))])
+while instrumented_market.has_more_proposal():
+    instrumented_market.one_round_simultaneous_proposals()
+instrumented_market.run_to_completion()
+proposal_statistics = instrumented_market.instrumentation.statistics()
+assert round_sizes == [3, 1, 1]
+assert proposal_statistics.rejection_count == 2 and proposal_statistics.chain_lengths == [1, 1, 3]
+assert proposal_statistics.top_proposers(2) == [(1, 2), (3, 2)]
+assert proposal_statistics.unmatched_history[-1] == (5, 0)
+assert instrumented_market.disable_instrumentation().round_index == 3 and instrumented_market.instrumentation is None
+
+chain_market = Market()
+for _ in range(3):
+    chain_market.register_proposer()
+    chain_market.register_responder()
+for proposer_uuid, proposal_order in {1: [1001, 1002], 2: [1001], 3: [1003]}.items():
+    chain_market.register_proposer_strict_preference(proposer_uuid, proposal_order)
+chain_market.register_responder_strict_preference(1001, [2, 1])
+chain_market.register_responder_strict_preference(1002, [1])
+chain_market.register_responder_strict_preference(1003, [3])
+chain_statistics = chain_market.enable_instrumentation().statistics()
+for proposer_uuid in (1, 2, 3, 1):
+    chain_market.proposer_make_move(proposer_uuid)
+# proposer 3 takes a free seat while the chain started by proposer 2 is still going on through proposer 1
+assert chain_statistics.chain_lengths == [1, 1, 2]
+
+# (round index, proposals in the round, rejections, proposers proposing next round, proposals so far)
+# markets this small leave every proposal to the scalar tail of run_rounds(), reported as a single round
+for mode, engine_rounds in (("rounds", [(0, 5, 2, 0, 5)]), ("engine", [(0, 5, 2, 0, 5)])):
+    instrumented_market = build_marriage_market()
+    reported_rounds = []
+    instrumented_market.enable_instrumentation([ProposalStatistics(), CallbackSink(
+        on_engine_round=lambda round_index, round_proposal_count, rejection_count, seconds, unmatched_count,
+        proposal_count: reported_rounds.append((round_index, round_proposal_count, rejection_count, unmatched_count,
+                                                proposal_count)))])
+    instrumented_market.run_to_completion(mode)
+    proposal_statistics = instrumented_market.instrumentation.statistics()
+    assert reported_rounds == engine_rounds
+    assert proposal_statistics.rejection_count == 2 and len(proposal_statistics.round_seconds) == len(engine_rounds)
+    assert proposal_statistics.summary()["proposal_count"] == 5 and proposal_statistics.unmatched_history[-1] == (5, 0)
+for scalar_below, engine_rounds in ((0, [(3, 1, 1, 3), (1, 1, 1, 4), (1, 0, 0, 5)]), (2, [(3, 1, 1, 3), (2, 1, 0, 5)])):
+    reported_rounds = []
+    assert build_marriage_market().build_engine().run_rounds(lambda *counts: reported_rounds.append(counts),
+                                                             scalar_below) == 5
+    assert reported_rounds == engine_rounds
+
+import os
+import tempfile
+import warnings
+
+from Deferred_Acceptance_Log import ProposalLog
+
+streamed_market = build_marriage_market()
+proposal_log = ProposalLog(initial_capacity=2)
+proposal_log.extend(streamed_market.stream_proposals(mode="rounds"))
+assert streamed_market.market_snapshot_uuid() == engine_market.market_snapshot_uuid()
+assert len(proposal_log) == 5 and proposal_log.array.shape == (5, 4)
+assert list(proposal_log)[:3] == [(1, 1, 1001, None), (2, 2, 1003, None), (3, 3, 1003, 3)]
+logged_market = build_marriage_market()
+logged_market.enable_instrumentation([ProposalLog()])
+logged_market.run_to_completion()
+assert len(logged_market.instrumentation.sinks[0]) == 5
+# engine modes only report counts per round, which a ProposalLog cannot record
+logged_market = build_marriage_market()
+logged_market.enable_instrumentation([ProposalLog(), ProposalStatistics()])
+with warnings.catch_warnings(record=True) as caught_warnings:
+    warnings.simplefilter("always")
+    logged_market.run_to_completion("engine")
+assert [str(warning.message) for warning in caught_warnings] == \
+       ["sinks ProposalLog only record proposals one at a time and miss every proposal of the engine mode"]
+assert len(logged_market.instrumentation.sinks[0]) == 0
+with tempfile.TemporaryDirectory() as log_directory:
+    log_path = os.path.join(log_directory, "proposals.npy")
+    proposal_log.save(log_path)
+    mapped_log = ProposalLog.load(log_path)
+    assert list(mapped_log) == list(proposal_log)
+    assert next(mapped_log.sentences(streamed_market)) == ['Proposal No. 1', 'Proposer 1 proposed to Responder 1001']
+    mapped_log.append(proposal_log[0])
+    assert len(mapped_log) == 6 and mapped_log[5] == proposal_log[0]
+    del mapped_log
+
+unstable_market = build_marriage_market()
+unstable_market.proposer_make_move(1)
+assert sorted(unstable_market.verify_stability()) == [(2, 1001), (2, 1002), (2, 1003), (3, 1001), (3, 1002), (3, 1003)]
+assert unstable_market.verify_stability(count_only=True) == 6
+unstable_market.run_to_completion()
+assert unstable_market.verify_stability() == [] and truncated_market.verify_stability() == []
+assert instrumented_market.verify_stability(count_only=True) == 0
+
+from Deferred_Acceptance_File import open_engine, save_preference_tables
+
+with tempfile.TemporaryDirectory() as market_directory:
+    market_path = os.path.join(market_directory, "college.dam")
+    build_college_market().save_market_file(market_path)
+    mapped_market = Market.from_market_file(market_path)
+    assert mapped_market.run_to_completion() == 6
+    assert mapped_market.market_snapshot_uuid()[1] == [(1, 1002), (2, 1002), (3, 1001), (4, 1001)]
+    assert mapped_market.verify_stability() == []
+    save_preference_tables(market_path, PreferenceTable.from_padded([[0, 1, 2], [2, 1, 0], [2, 0, 1]]),
+                           PreferenceTable.from_padded([[1, 2, 0], [1, 2, 0], [1, 0, 2]]), proposer_names=["a", "b", "c"])
+    mapped_engine, mapped_names, _ = open_engine(market_path)
+    assert mapped_names == ["a", "b", "c"] and not mapped_engine.proposal_order.flags.writeable
+    mapped_market = Market.from_engine(mapped_engine, mapped_names)
+    assert mapped_market.run_to_completion(mode="rounds") == 5 and mapped_market.proposer_uuid_dict[1].name == "a"
+    assert mapped_market.market_snapshot_uuid() == engine_market.market_snapshot_uuid()
+    del mapped_engine, mapped_market
+
+latin_market = Market()
+for _ in range(3):
+    latin_market.register_proposer()
+    latin_market.register_responder()
+for proposer_uuid, proposal_order in {1: [1001, 1002, 1003], 2: [1002, 1003, 1001], 3: [1003, 1001, 1002]}.items():
+    latin_market.register_proposer_strict_preference(proposer_uuid, proposal_order)
+for responder_uuid, preference in {1001: [2, 3, 1], 1002: [3, 1, 2], 1003: [1, 2, 3]}.items():
+    latin_market.register_responder_strict_preference(responder_uuid, preference)
+lattice = latin_market.stable_matching_lattice()
+assert list(lattice.stable_matchings()) == [{1: 1001, 2: 1002, 3: 1003}, {1: 1002, 2: 1003, 3: 1001},
+                                            {1: 1003, 2: 1001, 3: 1002}]
+assert lattice.responder_optimal_matching() == {1: 1003, 2: 1001, 3: 1002}
+assert lattice.rotation_poset() == {0: set(), 1: {0}}
+assert lattice.rotation_uuids(1) == [(1, 1002), (2, 1003), (3, 1001)]
+assert lattice.matching({1}) == lattice.responder_optimal_matching()
+assert lattice.egalitarian_stable_matching().value == 6
+assert lattice.minimum_regret_stable_matching()[1:] == (1, {0})
+assert list(build_marriage_market().stable_matching_lattice().stable_matchings()) == [{1: 1002, 2: 1003, 3: 1001}]
+
+interrupted_market = build_college_market()
+interrupted_proposals = interrupted_market.stream_proposals()
+for _ in range(3):
+    next(interrupted_proposals)
+with tempfile.TemporaryDirectory() as checkpoint_directory:
+    checkpoint_path = os.path.join(checkpoint_directory, "college.ckpt")
+    interrupted_market.checkpoint(checkpoint_path)
+    resumed_market = build_college_market()
+    resumed_market.resume(checkpoint_path)
+    assert resumed_market.market_snapshot_uuid() == interrupted_market.market_snapshot_uuid()
+    assert resumed_market.run_to_completion() == 6
+    assert resumed_market.market_snapshot_uuid()[1] == [(1, 1002), (2, 1002), (3, 1001), (4, 1001)]
+    try:
+        build_marriage_market().resume(checkpoint_path)
+        raise AssertionError("resume into a market with other participants must fail")
+    except ValueError:
+        pass
+
+for mode in ("rounds", "engine", "sequential"):
+    abandoned_market = build_marriage_market()
+    abandoned_proposals = abandoned_market.stream_proposals(mode="rounds")
+    for _ in range(2):
+        next(abandoned_proposals)
+    abandoned_proposals.close()
+    assert abandoned_market.unmatched_proposer_uuid == {3}
+    assert abandoned_market.run_to_completion(mode) == 5 and abandoned_market.verify_stability() == []
+    assert abandoned_market.market_snapshot_uuid() == engine_market.market_snapshot_uuid()
+abandoned_market = build_marriage_market()
+abandoned_proposals = abandoned_market.stream_proposals(mode="rounds")
+next(abandoned_proposals)
+with tempfile.TemporaryDirectory() as checkpoint_directory:
+    checkpoint_path = os.path.join(checkpoint_directory, "marriage.ckpt")
+    abandoned_market.checkpoint(checkpoint_path)
+    resumed_market = build_marriage_market()
+    resumed_market.resume(checkpoint_path)
+    assert resumed_market.unmatched_proposer_uuid == {2, 3}
+    assert resumed_market.run_to_completion(mode="rounds") == 5 and resumed_market.verify_stability() == []
+# a proposer joining while the sequential stream is suspended still gets his turn, here two rejections
+joined_market = build_marriage_market()
+joined_proposals = joined_market.stream_proposals()
+next(joined_proposals)
+late_uuid = joined_market.add_proposer('late', strict_preference=[1001, 1002])
+assert len(list(joined_proposals)) == 6 and joined_market.proposal_count == 7
+assert joined_market.proposer_uuid_dict[late_uuid].last_proposed_to == 1 and not joined_market.has_more_proposal()
+
+
+import asyncio
+
+from Deferred_Acceptance_Service import IntakeRequest, LocalMarketClient, MarketService, REGISTER_RESPONDER, \
+    RESPONDER_PREFERENCE
+
+
+async def serve_marriage_market():
+    async with MarketService(chunk_proposals=2) as service:
+        client = LocalMarketClient(service)
+        proposer_uuids = await asyncio.gather(*(client.register_proposer() for _ in range(3)))
+        responder_uuids = await asyncio.gather(*(client.register_responder() for _ in range(3)))
+        assert sorted(proposer_uuids) == [1, 2, 3] and sorted(responder_uuids) == [1001, 1002, 1003]
+        await asyncio.gather(
+            *(client.submit_proposer_preference(proposer_uuid, proposal_order) for proposer_uuid, proposal_order in
+              {1: [1001, 1002, 1003], 2: [1003, 1002, 1001], 3: [1003, 1001, 1002]}.items()),
+            *(client.submit_responder_preference(responder_uuid, preference) for responder_uuid, preference in
+              {1001: [2, 3, 1], 1002: [2, 3, 1], 1003: [2, 1, 3]}.items()))
+        await client.wait_until_stable()
+        assert (await client.refresh()).is_full
+        assert client.market_snapshot_uuid() == service.market.market_snapshot_uuid() == \
+            sequential_market.market_snapshot_uuid()
+        assert (await client.refresh()) == (client.version, 5, {}, {}, False)
+
+        await client.submit_responder_preference(1003, [3, 1, 2])
+        await client.wait_until_stable()
+        delta = await client.refresh()
+        assert not delta.is_full and set(delta.proposers) == {1, 2, 3}
+        assert sorted(client.market_snapshot_uuid()[1]) == sorted(service.market.market_snapshot_uuid()[1]) == \
+            [(1, 1001), (2, 1002), (3, 1003)]
+        try:
+            await client.submit_proposer_preference(9, [1001])
+            raise AssertionError("preference of an unknown proposer must fail")
+        except KeyError:
+            pass
+        # a list naming an unknown participant only fails its own request, the service keeps running
+        try:
+            await client.submit_proposer_preference(1, [1001, 9999])
+            raise AssertionError("preference naming an unknown responder must fail")
+        except KeyError:
+            pass
+        await client.submit_proposer_preference(1, [1003, 1001])
+        await client.wait_until_stable()
+        await client.refresh()
+        assert sorted(client.market_snapshot_uuid()[1]) == sorted(service.market.market_snapshot_uuid()[1])
+        assert service.market.verify_stability() == [] and service.market.proposer_uuid_dict[1].matched_to == 1001
+
+    pending_service = MarketService(build_marriage_market())
+    registration = IntakeRequest(REGISTER_RESPONDER, (None, None, 1, None), asyncio.get_running_loop().create_future())
+    pending_service.apply_batch([registration])
+    assert registration.future.result() == 1004 and pending_service.market.proposal_count == 0
+    assert pending_service.market.has_more_proposal()
+    # preferences are only checked by the intake, the matching loop makes the update and its proposals
+    preference = IntakeRequest(RESPONDER_PREFERENCE, (1004, [1, 2]), asyncio.get_running_loop().create_future())
+    pending_service.apply_batch([preference])
+    assert not preference.future.done() and pending_service.pending_preference_requests == [preference]
+    assert pending_service.market.proposal_count == 0
+
+
+asyncio.run(serve_marriage_market())
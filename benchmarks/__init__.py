@@ -0,0 +1,4 @@
+"""
+Performance benchmarks of the Gale-Shapley market: synthetic market generators and a runner recording timings,
+proposal throughput and peak memory as JSON, see python -m benchmarks.run --help
+"""
@@ -0,0 +1,208 @@
+"""
+Synthetic market generators; every generator returns preference lists in the layout of the PreferenceTable taken by
+Market.from_preference_tables(): proposer rows list responder indices from most to least preferred, responder rows
+list the proposers that listed them with rank 0 for most preferred. Generators only need numpy, so that
+build_registered_market() also runs against versions of Market that predate the engine
+"""
+from collections import namedtuple
+from itertools import groupby
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+from Deferred_Acceptance_Market import Market
+
+# offsets: count_rows + 1 row boundaries into indices and ranks, as in PreferenceTable
+PreferenceLists = namedtuple("PreferenceLists", "offsets indices ranks")
+
+DEFAULT_LIST_LENGTH = 50
+SHORT_LIST_LENGTH = 10
+TIE_CLASSES = 4
+
+
+def lists_from_lengths(lengths: np.ndarray, indices: np.ndarray, ranks: np.ndarray = None) -> PreferenceLists:
+    """
+    :param lengths: length of each row
+    :param indices: listed indices, row after row
+    :param ranks: rank of each listed index; if None the position within its row, 0 for most preferred
+    :return: PreferenceLists holding the rows
+    """
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if ranks is None:
+        ranks = np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], lengths)
+    return PreferenceLists(offsets, np.asarray(indices, dtype=np.int32), np.asarray(ranks, dtype=np.int32))
+
+
+def row_of_entries(lists: PreferenceLists) -> np.ndarray:
+    """
+    :return: row of each listed index
+    """
+    return np.repeat(np.arange(len(lists.offsets) - 1, dtype=np.int32), np.diff(lists.offsets))
+
+
+def sample_lists(rng: np.random.Generator, count_rows: int, count_columns: int, list_length: int,
+                 weights: np.ndarray = None,
+                 utility: Callable[[np.ndarray], np.ndarray] = None) -> PreferenceLists:
+    """
+    :param rng: random generator
+    :param count_rows: number of lists
+    :param count_columns: number of options to pick from
+    :param list_length: number of distinct options per list, fewer if sampling keeps drawing duplicates
+    :param weights: popularity of each option; if None uniform
+    :param utility: maps drawn options, one row per list, to their utility to that list; if None lists keep the order
+        options were drawn in, else they keep the options of highest utility ordered by decreasing utility
+    :return: lists of distinct options
+    """
+    list_length = min(list_length, count_columns)
+    draws = list_length * 2 + 4
+    if weights is None:
+        candidates = rng.integers(0, count_columns, size=(count_rows, draws))
+    else:
+        cumulative = np.cumsum(weights / weights.sum())
+        candidates = np.minimum(np.searchsorted(cumulative, rng.random((count_rows, draws))), count_columns - 1)
+    if list_length == count_columns:
+        candidates = np.argsort(rng.random((count_rows, count_columns)), axis=1)
+    if utility is not None:
+        candidates = np.take_along_axis(candidates, np.argsort(-utility(candidates), axis=1), axis=1)
+
+    # keep the first occurrence of each option within a row, then the first list_length of those
+    entry_order = np.argsort(candidates, axis=1, kind="stable")
+    sorted_candidates = np.take_along_axis(candidates, entry_order, axis=1)
+    is_first = np.ones(candidates.shape, dtype=bool)
+    np.put_along_axis(is_first, entry_order[:, 1:], sorted_candidates[:, 1:] != sorted_candidates[:, :-1], axis=1)
+    is_kept = is_first & (np.cumsum(is_first, axis=1) <= list_length)
+    return lists_from_lengths(is_kept.sum(axis=1), candidates[is_kept])
+
+
+def responder_side(proposer_table: PreferenceLists, count_responder: int, score: np.ndarray,
+                   tie_classes: int = None) -> PreferenceLists:
+    """
+    :param proposer_table: proposer lists; every responder ranks exactly the proposers listing it
+    :param count_responder: number of responders
+    :param score: score of each entry of proposer_table as seen by the responder listed, higher is better
+    :param tie_classes: if given, responders only distinguish this many classes of score and are indifferent within
+    :return: responder lists with ranks, rank 0 most preferred
+    """
+    responders = proposer_table.indices
+    by_score = np.argsort(-score)
+    entry_order = by_score[np.argsort(responders[by_score], kind="stable")]
+    lengths = np.bincount(responders, minlength=count_responder)
+    ranks = None
+    if tie_classes:
+        bounds = np.quantile(score, np.linspace(0, 1, tie_classes + 1)[1:-1])
+        ranks = tie_classes - 1 - np.searchsorted(bounds, score[entry_order])
+    return lists_from_lengths(lengths, row_of_entries(proposer_table)[entry_order], ranks)
+
+
+def uniform_random(size: int, seed: int = 0,
+                   list_length: int = DEFAULT_LIST_LENGTH) -> Tuple[PreferenceLists, PreferenceLists]:
+    """
+    independent uniformly random preferences on both sides
+    """
+    rng = np.random.default_rng(seed)
+    proposer_table = sample_lists(rng, size, size, list_length)
+    return proposer_table, responder_side(proposer_table, size, rng.random(len(proposer_table.indices)))
+
+
+def correlated(size: int, seed: int = 0, list_length: int = DEFAULT_LIST_LENGTH,
+               common_weight: float = 0.8) -> Tuple[PreferenceLists, PreferenceLists]:
+    """
+    common-value preferences: every participant has a quality everybody values, plus idiosyncratic noise
+    """
+    rng = np.random.default_rng(seed)
+    responder_quality = rng.normal(size=size)
+    proposer_quality = rng.normal(size=size)
+
+    def utility(candidates: np.ndarray) -> np.ndarray:
+        return common_weight * responder_quality[candidates] + \
+            (1 - common_weight) * rng.normal(size=candidates.shape)
+
+    proposer_table = sample_lists(rng, size, size, list_length, utility=utility)
+    score = common_weight * proposer_quality[row_of_entries(proposer_table)] + \
+        (1 - common_weight) * rng.normal(size=len(proposer_table.indices))
+    return proposer_table, responder_side(proposer_table, size, score)
+
+
+def short_truncated(size: int, seed: int = 0,
+                    list_length: int = SHORT_LIST_LENGTH) -> Tuple[PreferenceLists, PreferenceLists]:
+    """
+    uniformly random preferences over very short lists
+    """
+    return uniform_random(size, seed, min(list_length, SHORT_LIST_LENGTH))
+
+
+def weak_ties(size: int, seed: int = 0,
+              list_length: int = DEFAULT_LIST_LENGTH) -> Tuple[PreferenceLists, PreferenceLists]:
+    """
+    responders only distinguish a few priority classes and are indifferent within each, as in school choice
+    """
+    rng = np.random.default_rng(seed)
+    proposer_table = sample_lists(rng, size, size, list_length)
+    return proposer_table, responder_side(proposer_table, size, rng.random(len(proposer_table.indices)),
+                                          TIE_CLASSES)
+
+
+def skewed_popularity(size: int, seed: int = 0, list_length: int = DEFAULT_LIST_LENGTH,
+                      exponent: float = 1.0) -> Tuple[PreferenceLists, PreferenceLists]:
+    """
+    a few responders are listed by almost everybody: popularity follows a Zipf law
+    """
+    rng = np.random.default_rng(seed)
+    popularity = 1.0 / np.arange(1, size + 1) ** exponent
+    proposer_table = sample_lists(rng, size, size, list_length, popularity)
+    return proposer_table, responder_side(proposer_table, size, rng.random(len(proposer_table.indices)))
+
+
+GENERATORS: Dict[str, Callable[..., Tuple[PreferenceLists, PreferenceLists]]] = {
+    "uniform_random": uniform_random,
+    "correlated": correlated,
+    "short_truncated": short_truncated,
+    "weak_ties": weak_ties,
+    "skewed_popularity": skewed_popularity,
+}
+
+
+def build_market(generator: str, size: int, seed: int = 0, list_length: int = DEFAULT_LIST_LENGTH) -> Market:
+    """
+    :param generator: name of a generator in GENERATORS
+    :param size: number of proposers and of responders
+    :param seed: random seed
+    :param list_length: length of proposer lists
+    :return: Market built from the generated preference tables, its Proposers and Responders reading them through
+        views of engine arrays
+    """
+    # imported here rather than at the top: the engine is missing from versions build_registered_market() runs on
+    from Deferred_Acceptance_Engine import PreferenceTable
+    return Market.from_preference_tables(*(PreferenceTable(*lists)
+                                           for lists in GENERATORS[generator](size, seed, list_length)))
+
+
+def build_registered_market(generator: str, size: int, seed: int = 0,
+                            list_length: int = DEFAULT_LIST_LENGTH) -> Market:
+    """
+    :param generator: name of a generator in GENERATORS
+    :param size: number of proposers and of responders
+    :param seed: random seed
+    :param list_length: length of proposer lists
+    :return: Market holding the generated preferences as Proposer and Responder objects, set up one participant at a
+        time through register_proposer() and register_responder() as every version of Market supports
+    """
+    proposer_table, responder_table = GENERATORS[generator](size, seed, list_length)
+    market = Market()
+    proposer_uuids = [market.register_proposer() for _ in range(len(proposer_table.offsets) - 1)]
+    responder_uuids = [market.register_responder() for _ in range(len(responder_table.offsets) - 1)]
+    for proposer, uuid in enumerate(proposer_uuids):
+        row = slice(proposer_table.offsets[proposer], proposer_table.offsets[proposer + 1])
+        market.register_proposer_strict_preference(uuid, [responder_uuids[responder] for responder in
+                                                          proposer_table.indices[row].tolist()])
+    for responder, uuid in enumerate(responder_uuids):
+        row = slice(responder_table.offsets[responder], responder_table.offsets[responder + 1])
+        ranked = sorted(zip(responder_table.ranks[row].tolist(), responder_table.indices[row].tolist()))
+        if len({rank for rank, _ in ranked}) == len(ranked):
+            market.register_responder_strict_preference(uuid, [proposer_uuids[proposer] for _, proposer in ranked])
+        else:
+            tiers = groupby(ranked, key=lambda entry: entry[0])
+            market.register_responder_weak_preference(uuid, [[proposer_uuids[proposer] for _, proposer in tier]
+                                                             for _, tier in tiers])
+    return market
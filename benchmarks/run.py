@@ -0,0 +1,262 @@
+"""
+Run the benchmarks and write their results as JSON, one record per (generator, size, operation):
+
+    python -m benchmarks.run --sizes 100 1000 10000 100000 --output bench.json
+    python -m benchmarks.run --compare baseline.json bench.json
+
+timings are taken without tracemalloc running; peak memory comes from a second run of the same operation traced by
+tracemalloc, which numpy reports its array allocations to; operations on Proposer and Responder objects only call
+methods the original Market already had, on markets set up through register_*(), so result files of older versions
+can be compared
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from Deferred_Acceptance_Market import Market
+from benchmarks.generators import DEFAULT_LIST_LENGTH, GENERATORS, build_market, build_registered_market
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_BATCH_MARKETS = 5000
+BATCH_MARKET_SIZE = 8
+BATCH_WARMUP_MARKETS = 50
+
+
+def validate(market: Market) -> int:
+    market.test_valid_market_setup()
+    return 0
+
+
+def proposer_make_move_loop(market: Market) -> int:
+    # follow each displacement chain to its end: the rejected proposer moves next
+    pending = list(market.unmatched_proposer_uuid)
+    while pending:
+        proposal = market.proposer_make_move(pending.pop())
+        if proposal.proposal_id is not None and proposal.rejected_uuid is not None:
+            pending.append(proposal.rejected_uuid)
+    return market.proposal_count
+
+
+def simultaneous_rounds(market: Market) -> int:
+    while market.has_more_proposal():
+        market.one_round_simultaneous_proposals()
+    return market.proposal_count
+
+
+def engine_sequential(market: Market) -> int:
+    return market.run_to_completion("engine")
+
+
+def engine_rounds(market: Market) -> int:
+    return market.run_to_completion("rounds")
+
+
+# each operation takes a freshly built market and returns the number of proposals it made
+OPERATIONS: Dict[str, Callable[[Market], int]] = {
+    "test_valid_market_setup": validate,
+    "proposer_make_move": proposer_make_move_loop,
+    "one_round_simultaneous_proposals": simultaneous_rounds,
+    "engine_sequential": engine_sequential,
+    "engine_rounds": engine_rounds,
+}
+
+
+def market_builder(operation: str) -> Callable[..., Market]:
+    """
+    :param operation: name of an operation in OPERATIONS
+    :return: build_market() for engine operations; build_registered_market() for operations on Proposer and Responder
+        objects, whose lists are then plain Python lists rather than views of engine arrays
+    """
+    return build_market if operation.startswith("engine") else build_registered_market
+
+
+def measure(generator: str, size: int, operation: str, seed: int, list_length: int, trace_memory: bool) -> dict:
+    """
+    :return: record of one benchmark: wall time, proposals made, proposals per second and peak traced memory
+    """
+    market = market_builder(operation)(generator, size, seed, list_length)
+    start = time.perf_counter()
+    proposal_count = OPERATIONS[operation](market)
+    seconds = time.perf_counter() - start
+
+    peak_memory = None
+    if trace_memory:
+        market = market_builder(operation)(generator, size, seed, list_length)
+        tracemalloc.start()
+        OPERATIONS[operation](market)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        "generator": generator,
+        "size": size,
+        "operation": operation,
+        "seed": seed,
+        "list_length": list_length,
+        "seconds": seconds,
+        "proposal_count": proposal_count,
+        "proposals_per_second": proposal_count / seconds if proposal_count and seconds > 0 else None,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def measure_batch(generator: str, market_count: int, seed: int, list_length: int) -> List[dict]:
+    """
+    time Batch.solve_markets() against a plain loop of run_to_completion("engine") over the same many small markets,
+    both built by build_market(); solve_markets() only stacks such engine-backed markets, markets set up through
+    register_*() are solved one by one as the loop would
+    :return: records of the batch and of the loop, in the format of measure(); the batch record also holds
+        batch_speedup, loop seconds over batch seconds
+    """
+    # imported here rather than at the top, like the engine in build_market()
+    from Deferred_Acceptance_Batch import solve_markets
+    list_length = min(list_length, BATCH_MARKET_SIZE)
+    # untimed first batch: the first calls of the numpy routines only solve_markets() uses are slower
+    solve_markets([build_market(generator, BATCH_MARKET_SIZE, seed + market_count + market, list_length)
+                   for market in range(BATCH_WARMUP_MARKETS)])
+    records = []
+    for operation in ("engine_loop", "solve_markets"):
+        markets = [build_market(generator, BATCH_MARKET_SIZE, seed + market, list_length)
+                   for market in range(market_count)]
+        start = time.perf_counter()
+        if operation == "solve_markets":
+            solve_markets(markets)
+        else:
+            for market in markets:
+                market.run_to_completion("engine")
+        seconds = time.perf_counter() - start
+        proposal_count = sum(market.proposal_count for market in markets)
+        records.append({
+            "generator": generator,
+            "size": BATCH_MARKET_SIZE,
+            "operation": operation,
+            "seed": seed,
+            "list_length": list_length,
+            "market_count": market_count,
+            "seconds": seconds,
+            "proposal_count": proposal_count,
+            "proposals_per_second": proposal_count / seconds if proposal_count and seconds > 0 else None,
+            "peak_memory_bytes": None,
+        })
+    records[1]["batch_speedup"] = records[0]["seconds"] / records[1]["seconds"] if records[1]["seconds"] > 0 else None
+    return records
+
+
+def environment() -> dict:
+    """
+    :return: description of the code and machine the benchmarks ran on
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run_benchmarks(generators: List[str], sizes: List[int], operations: List[str], seed: int = 0,
+                   list_length: int = DEFAULT_LIST_LENGTH, trace_memory: bool = True,
+                   max_object_size: int = None, batch_markets: int = DEFAULT_BATCH_MARKETS) -> dict:
+    """
+    :param generators: names of generators in GENERATORS
+    :param sizes: numbers of proposers and of responders
+    :param operations: names of operations in OPERATIONS
+    :param seed: random seed of every generated market
+    :param list_length: length of proposer lists
+    :param trace_memory: whether to measure peak memory
+    :param max_object_size: skip operations looping over Proposer and Responder objects above this size; if None
+        run every operation at every size
+    :param batch_markets: number of small markets solved by measure_batch() per generator; 0 skips it
+    :return: {"environment": ..., "results": [record, ...]}
+    """
+    results = []
+    for generator in generators:
+        if batch_markets:
+            batch_records = measure_batch(generator, batch_markets, seed, list_length)
+            print("%-18s %7d x%-6d solve_markets %9.3fs, engine loop %.3fs, speedup %.2f" % (
+                generator, BATCH_MARKET_SIZE, batch_markets, batch_records[1]["seconds"],
+                batch_records[0]["seconds"], batch_records[1]["batch_speedup"] or 0), file=sys.stderr)
+            results.extend(batch_records)
+        for size in sizes:
+            for operation in operations:
+                if max_object_size is not None and size > max_object_size and not operation.startswith("engine"):
+                    continue
+                record = measure(generator, size, operation, seed, list_length, trace_memory)
+                print("%-18s %7d %-34s %9.3fs %10s proposals" % (generator, size, operation, record["seconds"],
+                                                                 record["proposal_count"]), file=sys.stderr)
+                results.append(record)
+    return {"environment": environment(), "results": results}
+
+
+def compare(baseline: dict, current: dict, tolerance: float = DEFAULT_TOLERANCE) -> List[Tuple[Tuple, float, float]]:
+    """
+    :param baseline: output of run_benchmarks() for the reference version
+    :param current: output of run_benchmarks() for the version under test
+    :param tolerance: relative slowdown tolerated before a benchmark counts as a regression
+    :return: (generator, size, operation), baseline seconds and current seconds of every regression
+    """
+    def key(record: dict) -> Tuple:
+        return record["generator"], record["size"], record["operation"], record["seed"], record["list_length"]
+
+    baseline_seconds = {key(record): record["seconds"] for record in baseline["results"]}
+    regressions = []
+    for record in current["results"]:
+        reference = baseline_seconds.get(key(record))
+        if reference is not None and record["seconds"] > reference * (1 + tolerance):
+            regressions.append((key(record)[:3], reference, record["seconds"]))
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark deferred acceptance on synthetic markets")
+    parser.add_argument("--generators", nargs="+", choices=sorted(GENERATORS), default=list(GENERATORS))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--operations", nargs="+", choices=list(OPERATIONS), default=list(OPERATIONS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--list-length", type=int, default=DEFAULT_LIST_LENGTH)
+    parser.add_argument("--max-object-size", type=int, default=None,
+                        help="skip operations on Proposer and Responder objects for larger markets")
+    parser.add_argument("--batch-markets", type=int, default=DEFAULT_BATCH_MARKETS,
+                        help="number of %dx%d markets timed through solve_markets against a loop of "
+                             "run_to_completion('engine'), 0 to skip" %
+                        (BATCH_MARKET_SIZE, BATCH_MARKET_SIZE))
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run measuring peak memory")
+    parser.add_argument("--output", default=None, help="JSON file to write, standard output if omitted")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), default=None,
+                        help="compare two result files instead of running, exit status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as baseline_file, open(args.compare[1]) as current_file:
+            regressions = compare(json.load(baseline_file), json.load(current_file), args.tolerance)
+        for (generator, size, operation), reference, seconds in regressions:
+            print("%s %d %s: %.3fs -> %.3fs" % (generator, size, operation, reference, seconds))
+        return 1 if regressions else 0
+
+    report = run_benchmarks(args.generators, args.sizes, args.operations, args.seed, args.list_length,
+                            not args.no_memory, args.max_object_size, args.batch_markets)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())